@@ -2,12 +2,19 @@ import logging
 
 apscheduler = {
     'apscheduler.jobstores.default': {
-        'type': 'memory',
-        # 'url': 'sqlite:///jobs.sqlite'
+        'class': 'pyrsched.server.jobstore:SQLiteJobStore',
+        'path': 'jobs.sqlite',
     },
     'apscheduler.executors.default': {
-        'class': 'apscheduler.executors.pool:ThreadPoolExecutor',
-        'max_workers': '20'
+        'class': 'pyrsched.server.executors:PriorityThreadPoolExecutor',
+        'max_workers': '20',
+        'aging': '60',
+    },
+    'apscheduler.executors.processpool': {
+        'class': 'pyrsched.server.executors:PipelineProcessPoolExecutor',
+        'max_workers': '4',
+        'max_runs_per_child': '100',
+        'max_memory_mb': '512',
     },
     'apscheduler.job_defaults.coalesce': 'false',
     'apscheduler.job_defaults.max_instances': '3',
@@ -19,7 +26,27 @@ pypyr = {
     'pipelines.log_path': 'logs',
     'pipelines.log_level': logging.INFO,
     'pipelines.sensitive_keywords': ['db_passwd', ],
+    'pipelines.process_executor': 'processpool',
+    'pipelines.cache_size': 256,
+    'pipelines.preload': False,
+    'snapshot.publish_interval': 0.1,
+    'pipelines.log_handlers.max_open': 128,
+    'pipelines.log_handlers.use_queue': False,
     'server_port': 12345,
+    'rpc.asyncio': False,
+    'rpc.workers': 4,
+    'metrics.port': None,
+    'metrics.host': '127.0.0.1',
+    'concurrency.groups': {},
+    'admission.max_load': None,
+    'admission.max_memory_percent': None,
+    'admission.max_queue_depth': None,
+    'admission.protected_priority': 10,
+    'admission.shed_below_priority': 0,
+    'admission.max_delay': 300,
+    'triggers.precomputed_fire_times': 10,
+    'triggers.spread_intervals': True,
+    'triggers.jitter': None,
 }
 
 log_config = {
@@ -0,0 +1,260 @@
+import heapq
+import itertools
+import threading
+import time
+
+from apscheduler.events import EVENT_JOB_MISSED, JobExecutionEvent
+from apscheduler.executors.base import MaxInstancesReachedError
+
+from . import logger as pyrsched_logger
+
+logger = pyrsched_logger.getChild("admission")
+
+# job kwarg with the priority of a job, higher priorities are admitted first
+PRIORITY_KWARG = "priority"
+DEFAULT_PRIORITY = 0
+
+ADMIT = "admit"
+DEFER = "defer"
+SHED = "shed"
+
+
+def job_priority(job):
+    return (job.kwargs or {}).get(PRIORITY_KWARG, DEFAULT_PRIORITY)
+
+
+class _HeldRun:
+    def __init__(self, executor, job, run_times, priority, deadline):
+        self.executor = executor
+        self.job = job
+        self.run_times = run_times
+        self.priority = priority
+        self.deadline = deadline
+
+
+class AdmissionController:
+    """
+    Decides whether a run may start now, based on the load of the machine and of the executor.
+
+    The machine is overloaded if the one minute load average per CPU exceeds ``max_load``, the
+    used memory exceeds ``max_memory_percent`` or the queue of the executor (submitted runs waiting
+    for a worker) is longer than ``max_queue_depth``. Limits which are ``None`` are not checked.
+
+    While the machine is overloaded, runs of jobs with at least ``protected_priority`` start as
+    usual, runs with a priority below ``shed_below_priority`` are shed (reported as missed) and all
+    other runs are held back. Held runs are started, highest priority first, when the load is below
+    the limits again, and shed if that takes longer than ``max_delay`` seconds.
+    """
+    def __init__(self):
+        self.max_load = None
+        self.max_memory_percent = None
+        self.max_queue_depth = None
+        self.protected_priority = 10
+        self.shed_below_priority = 0
+        self.max_delay = 300
+        self.recheck_interval = 1
+        self._lock = threading.Condition()
+        self._held = []  # heap of (-priority, sequence number, _HeldRun)
+        self._sequence = itertools.count()
+        self._sample = (0.0, (0.0, 0.0))  # (monotonic time, (load per cpu, memory percent))
+        self._thread = None
+        self.admitted = 0
+        self.deferred = 0
+        self.shed = 0
+
+    def configure(self, max_load=None, max_memory_percent=None, max_queue_depth=None, protected_priority=10,
+                  shed_below_priority=0, max_delay=300, recheck_interval=1):
+        with self._lock:
+            self.max_load = max_load
+            self.max_memory_percent = max_memory_percent
+            self.max_queue_depth = max_queue_depth
+            self.protected_priority = protected_priority
+            self.shed_below_priority = shed_below_priority
+            self.max_delay = max_delay
+            self.recheck_interval = recheck_interval
+            self._sample = (0.0, (0.0, 0.0))
+            self._lock.notify_all()
+
+    @property
+    def enabled(self):
+        return self.max_load is not None or self.max_memory_percent is not None or self.max_queue_depth is not None
+
+    def _measure(self):
+        # psutil is only imported once the admission control is enabled
+        import psutil
+
+        return psutil.getloadavg()[0] / (psutil.cpu_count() or 1), psutil.virtual_memory().percent
+
+    def _load(self):
+        # load average and memory are sampled at most once per recheck interval, not for every run
+        sampled, load = self._sample
+        now = time.monotonic()
+        if now - sampled >= self.recheck_interval:
+            load = self._measure()
+            self._sample = (now, load)
+        return load
+
+    def overload(self, queue_depth=0):
+        """ the reason why the machine is overloaded, ``None`` if it is not """
+        if not self.enabled:
+            return None
+        load, memory = self._load()
+        if self.max_load is not None and load > self.max_load:
+            return f"load {load:.2f} per cpu > {self.max_load}"
+        if self.max_memory_percent is not None and memory > self.max_memory_percent:
+            return f"memory {memory:.0f}% > {self.max_memory_percent}%"
+        if self.max_queue_depth is not None and queue_depth > self.max_queue_depth:
+            return f"queue depth {queue_depth} > {self.max_queue_depth}"
+        return None
+
+    def decide(self, priority, queue_depth=0):
+        """ ``ADMIT``, ``DEFER`` or ``SHED`` for a run of a job with this priority """
+        if priority < self.protected_priority:
+            reason = self.overload(queue_depth)
+            if reason is not None:
+                decision = SHED if priority < self.shed_below_priority else DEFER
+                logger.debug(f"Overloaded ({reason}), decision for a run with priority {priority}: {decision}")
+                with self._lock:
+                    if decision == SHED:
+                        self.shed += 1
+                    else:
+                        self.deferred += 1
+                return decision
+        with self._lock:
+            self.admitted += 1
+        return ADMIT
+
+    def hold(self, executor, job, run_times, priority):
+        """ keep a deferred run until the load allows to start it """
+        run = _HeldRun(executor, job, run_times, priority, time.monotonic() + self.max_delay)
+        with self._lock:
+            heapq.heappush(self._held, (-priority, next(self._sequence), run))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._release_held, name="pyrsched-admission", daemon=True)
+                self._thread.start()
+            self._lock.notify_all()
+
+    def discard(self, predicate):
+        """ drop held runs for which ``predicate(run)`` is true, e.g. of a stopped executor """
+        with self._lock:
+            self._held = [entry for entry in self._held if not predicate(entry[2])]
+            heapq.heapify(self._held)
+
+    def _next_run(self):
+        """ the held run to start or shed next, ``None`` if all held runs have to wait """
+        with self._lock:
+            while not self._held:
+                self._lock.wait()
+            run = self._held[0][2]
+            if self.overload(run.executor.queue_depth()) is None:
+                return heapq.heappop(self._held)[2], ADMIT
+            now = time.monotonic()
+            expired = [entry for entry in self._held if entry[2].deadline <= now]
+            if expired:
+                self._held = [entry for entry in self._held if entry[2].deadline > now]
+                heapq.heapify(self._held)
+                self.shed += len(expired)
+                return [entry[2] for entry in expired], SHED
+            self._lock.wait(self.recheck_interval)
+            return None, None
+
+    def _release_held(self):
+        while True:
+            runs, decision = self._next_run()
+            try:
+                if decision == ADMIT:
+                    runs.executor._submit_held(runs)
+                elif decision == SHED:
+                    for run in runs:
+                        logger.warning(f'Run of job "{run.job}" shed, the load stayed too high for {self.max_delay}s')
+                        run.executor._shed_held(run)
+            except Exception:
+                logger.exception("Submitting a held run failed")
+
+    def stats(self):
+        with self._lock:
+            load, memory = self._sample[1] if self.enabled else (None, None)
+            return {
+                "enabled": self.enabled,
+                "load_per_cpu": load,
+                "memory_percent": memory,
+                "admitted": self.admitted,
+                "deferred": self.deferred,
+                "shed": self.shed,
+                "held": len(self._held),
+            }
+
+
+admission_controller = AdmissionController()
+
+
+class AdmissionMixin:
+    """
+    Executor mixin which asks the :class:`AdmissionController` before it starts a run.
+
+    Held runs occupy no worker and are not counted as running instances, but a job can not be
+    submitted again while one of its runs is held back.
+    """
+    admission = admission_controller
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self._held_runs = {}  # job id -> number of held runs
+
+    def shutdown(self, wait=True):
+        self.admission.discard(lambda run: run.executor is self)
+        super().shutdown(wait)
+
+    def queue_depth(self):
+        """ the number of submitted runs waiting for a worker """
+        in_flight = sum(self._instances.values()) - getattr(self, "deferred_runs", 0)
+        max_workers = getattr(getattr(self, "_pool", None), "_max_workers", None) or in_flight
+        return max(in_flight - max_workers, 0)
+
+    def submit_job(self, job, run_times):
+        if not self.admission.enabled:
+            return super().submit_job(job, run_times)
+
+        with self._lock:
+            held = self._held_runs.get(job.id, 0)
+            if held and self._instances[job.id] + held >= job.max_instances:
+                raise MaxInstancesReachedError(job)
+
+        priority = job_priority(job)
+        decision = self.admission.decide(priority, self.queue_depth())
+        if decision == ADMIT:
+            return super().submit_job(job, run_times)
+        if decision == SHED:
+            self._logger.warning(f'Run of job "{job}" shed, the scheduler is overloaded')
+            self._dispatch_missed(job, run_times)
+            return
+
+        with self._lock:
+            if self._instances[job.id] + held >= job.max_instances:
+                raise MaxInstancesReachedError(job)
+            self._held_runs[job.id] = held + 1
+        self._logger.debug(f'Run of job "{job}" deferred, the scheduler is overloaded')
+        self.admission.hold(self, job, run_times, priority)
+
+    def _release_held_run(self, job_id):
+        with self._lock:
+            held = self._held_runs.get(job_id, 0) - 1
+            if held > 0:
+                self._held_runs[job_id] = held
+            else:
+                self._held_runs.pop(job_id, None)
+
+    def _submit_held(self, run):
+        self._release_held_run(run.job.id)
+        try:
+            super().submit_job(run.job, run.run_times)
+        except MaxInstancesReachedError:
+            self._dispatch_missed(run.job, run.run_times)
+
+    def _shed_held(self, run):
+        self._release_held_run(run.job.id)
+        self._dispatch_missed(run.job, run.run_times)
+
+    def _dispatch_missed(self, job, run_times):
+        for run_time in run_times:
+            self._scheduler._dispatch_event(JobExecutionEvent(EVENT_JOB_MISSED, job.id, job._jobstore_alias, run_time))
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import deque
+from itertools import islice
+from datetime import datetime, timezone
+
+from apscheduler.events import (
+    EVENT_ALL_JOBS_REMOVED,
+    EVENT_JOB_ADDED,
+    EVENT_JOB_ERROR,
+    EVENT_JOB_EXECUTED,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_MODIFIED,
+    EVENT_JOB_REMOVED,
+    EVENT_JOB_SUBMITTED,
+)
+
+CHANGE_TYPES = {
+    EVENT_JOB_ADDED: "added",
+    EVENT_JOB_MODIFIED: "modified",
+    EVENT_JOB_REMOVED: "removed",
+    EVENT_ALL_JOBS_REMOVED: "all_removed",
+    EVENT_JOB_SUBMITTED: "run_started",
+    EVENT_JOB_EXECUTED: "run_finished",
+    EVENT_JOB_ERROR: "run_finished",
+    EVENT_JOB_MISSED: "run_missed",
+}
+CHANGE_EVENTS = 0
+for _mask in CHANGE_TYPES:
+    CHANGE_EVENTS |= _mask
+
+DEFAULT_BUFFER_SIZE = 10000
+MAX_WAIT = 60  # seconds a reader may wait for changes
+
+
+class JobChangeLog:
+    """
+    Numbered log of the changes of the scheduler's jobs and runs.
+
+    Each change gets the next version number. Clients remember the last version they have seen
+    and ask for newer changes only. The log keeps the last ``size`` changes; a client which asks
+    for older changes has to reload the full state.
+    """
+    def __init__(self, scheduler, size=DEFAULT_BUFFER_SIZE):
+        self._changes = deque(maxlen=size)
+        self._version = 0
+        self._condition = threading.Condition()
+        scheduler.add_listener(self._on_event, CHANGE_EVENTS)
+
+    @property
+    def version(self):
+        with self._condition:
+            return self._version
+
+    def _on_event(self, event):
+        change = {}
+        if event.code == EVENT_JOB_SUBMITTED:
+            change["run_times"] = [t.isoformat() for t in event.scheduled_run_times]
+        elif event.code in (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR):
+            change["success"] = event.exception is None
+            change["error"] = repr(event.exception) if event.exception is not None else None
+        self.record(CHANGE_TYPES[event.code], getattr(event, "job_id", None), **change)
+
+    def record(self, change_type, job_id=None, **details):
+        """ Append a change, for changes which do not fire a scheduler event. """
+        with self._condition:
+            self._version += 1
+            self._changes.append({
+                "version": self._version,
+                "type": change_type,
+                "job_id": job_id,
+                "time": datetime.now(timezone.utc).isoformat(),
+                **details,
+            })
+            self._condition.notify_all()
+
+    def since(self, version, timeout=0):
+        """ Return ``(reset, current version, changes after version)``.
+
+        Waits up to ``timeout`` seconds (at most ``MAX_WAIT``) if there are no newer changes yet.
+        ``reset`` is ``True`` if changes after ``version`` were already dropped from the log.
+        """
+        deadline = time.monotonic() + min(max(timeout or 0, 0), MAX_WAIT)
+        with self._condition:
+            if version > self._version:
+                return True, self._version, []  # the version is from before a server restart
+            while self._version <= version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            oldest = self._changes[0]["version"] if self._changes else self._version + 1
+            if version < oldest - 1:
+                return True, self._version, []
+            # versions are consecutive, so the position in the deque follows from the version
+            start = max(version - oldest + 1, 0)
+            changes = list(islice(self._changes, start, None))
+            return False, self._version, changes
@@ -3,13 +3,15 @@ from pathlib import Path
 import click
 
 from . import logger
-from .server import ServerWrapper
 
 
 @click.command()
 @click.option("-c", "--conf", "conf_dir", default="conf", help="config directory")
 def cli(conf_dir):
     click.echo(f"Starting scheduler. Config: {Path(conf_dir).resolve()}")
+    # imported here, so that --help does not import apscheduler and pypyr
+    from .server import ServerWrapper
+
     server = ServerWrapper(conf_dir)
     try:
         server.start()
@@ -0,0 +1,205 @@
+"""
+Several scheduler nodes sharing one job set in a sqlite database.
+
+Each node holds a lease in the ``nodes`` table, which it renews every ``heartbeat_interval``
+seconds. The nodes with an unexpired lease are the members of the cluster, and every job is owned
+by one of them, chosen by rendezvous hashing of the job id over the member ids. A node only looks
+for due jobs among the jobs it owns. When a node joins or its lease expires, only the jobs which
+hash to that node move, all others stay with their owner.
+
+Members can disagree about the membership for up to one heartbeat. To run a job only once anyway,
+a node claims each due run with a conditional update before it submits it: a run which another
+live node has claimed already is skipped. Claims of nodes which left the cluster are void.
+"""
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+from .jobstore import SQLiteJobStore
+
+DEFAULT_LEASE_SECONDS = 15
+DEFAULT_HEARTBEAT_INTERVAL = 5
+
+CLUSTER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id TEXT PRIMARY KEY,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_set_version (
+    version INTEGER NOT NULL
+);
+INSERT INTO job_set_version (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM job_set_version);
+CREATE TRIGGER IF NOT EXISTS jobs_inserted AFTER INSERT ON jobs
+    BEGIN UPDATE job_set_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS jobs_deleted AFTER DELETE ON jobs
+    BEGIN UPDATE job_set_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS jobs_updated AFTER UPDATE OF next_run_time, template_id, state ON jobs
+    BEGIN UPDATE job_set_version SET version = version + 1; END;
+"""
+CLAIM_COLUMNS = (("claimed_run_time", "REAL"), ("claimed_by", "TEXT"))
+# the current run of a job was not claimed yet, or by a node which is gone
+CLAIMABLE = "(claimed_run_time IS NULL OR claimed_run_time < next_run_time OR NOT is_member(claimed_by))"
+IN_CHUNK = 500  # ids per "IN (...)" query
+
+
+def owner(job_id, nodes):
+    """ the node which owns a job, by rendezvous hashing (the same on every node) """
+    return max(nodes, key=lambda node: hashlib.blake2b(f"{node}/{job_id}".encode(), digest_size=8).digest())
+
+
+class ClusterJobStore(SQLiteJobStore):
+    """
+    A :class:`~pyrsched.server.jobstore.SQLiteJobStore` shared by several scheduler nodes, each of
+    which runs only the jobs it owns. Jobs can be added, changed and removed on any node.
+
+    All nodes must use the same database file, so they have to run on one host or share a file
+    system with working locks. A node which stops leaves the cluster at once, the jobs of a node
+    which dies move to the other nodes once its lease has expired.
+
+    Plugin class: ``pyrsched.server.cluster:ClusterJobStore``
+
+    :param path: the database file shared by all nodes
+    :param node_id: the id of this node, unique in the cluster (default: host name and process id)
+    :param lease_seconds: a node which did not renew its lease for this long is considered dead
+    :param heartbeat_interval: seconds between renewals of the lease
+    :param pickle_protocol: pickle protocol for the job state
+    """
+    def __init__(self, path="jobs.sqlite", node_id=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL, **kwargs):
+        super().__init__(path, **kwargs)
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = float(lease_seconds)
+        self.heartbeat_interval = float(heartbeat_interval)
+        if self.heartbeat_interval >= self.lease_seconds:
+            raise ValueError("The heartbeat interval must be shorter than the lease")
+        self.nodes = (self.node_id, )
+        self._version = None
+        self._listeners = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_change_listener(self, callback):
+        """ ``callback()`` is called when the job set was changed, possibly by another node """
+        self._listeners.append(callback)
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        with self._lock:
+            self._conn.executescript(CLUSTER_SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for name, column_type in CLAIM_COLUMNS:
+                if name not in columns:
+                    try:
+                        self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+                    except sqlite3.OperationalError:
+                        pass  # added by another node which started at the same time
+            self._conn.create_function("owned", 1, self.owns)
+            self._conn.create_function("is_member", 1, self.is_member)
+        self._stopped.clear()
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._run_heartbeats, name="pyrsched-cluster", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        with self._lock:
+            if self._conn is not None:
+                # leave the cluster right away, the other nodes take over the jobs with their next heartbeat
+                self._conn.execute("DELETE FROM nodes WHERE id = ?", (self.node_id, ))
+        super().shutdown()
+
+    def owns(self, job_id):
+        return owner(job_id, self.nodes) == self.node_id
+
+    def is_member(self, node_id):
+        return node_id in self.nodes
+
+    def _run_heartbeats(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception:
+                self._logger.exception("Cluster heartbeat failed")
+
+    def heartbeat(self):
+        """ renew the lease of this node and pick up changes of the membership and of the job set """
+        now = time.time()
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "INSERT INTO nodes (id, expires) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET expires = excluded.expires",
+                (self.node_id, now + self.lease_seconds),
+            )
+            self._conn.execute("DELETE FROM nodes WHERE expires < ?", (now, ))
+            nodes = tuple(sorted(row[0] for row in self._conn.execute("SELECT id FROM nodes")))
+            version, = self._conn.execute("SELECT version FROM job_set_version").fetchone()
+
+        membership_changed = nodes != self.nodes
+        if membership_changed:
+            self._logger.info(f"Cluster nodes: {', '.join(nodes)}")
+            self.nodes = nodes
+        jobs_changed = version != self._version
+        self._version = version
+        if jobs_changed:
+            for listener in self._listeners:
+                listener()
+        if (membership_changed or jobs_changed) and self._scheduler is not None and self._scheduler.running:
+            # this node may own other jobs now, or jobs which are due earlier
+            self._scheduler.wakeup()
+
+    def get_due_jobs(self, now):
+        timestamp = datetime_to_utc_timestamp(now)
+        claimed = []
+        with self._lock:
+            if self._conn is None:
+                return []
+            # the claims are written after the due jobs are read, another node must not write in between
+            with self.batch(immediate=True):
+                due = self._conn.execute(
+                    f"SELECT id FROM jobs WHERE next_run_time <= ? AND owned(id) AND {CLAIMABLE}", (timestamp, )
+                ).fetchall()
+                for job_id, in due:
+                    cursor = self._conn.execute(
+                        "UPDATE jobs SET claimed_run_time = next_run_time, claimed_by = ?"
+                        f" WHERE id = ? AND next_run_time <= ? AND {CLAIMABLE}",
+                        (self.node_id, job_id, timestamp),
+                    )
+                    if cursor.rowcount:
+                        claimed.append(job_id)
+
+        # the claimed jobs are read again, another node may have run and updated them in the meantime
+        jobs = []
+        for i in range(0, len(claimed), IN_CHUNK):
+            chunk = claimed[i:i + IN_CHUNK]
+            jobs += self._get_jobs(f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+        return sorted(jobs, key=lambda job: job.next_run_time)
+
+    def get_next_run_time(self):
+        with self._lock:
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                f"SELECT next_run_time FROM jobs WHERE next_run_time IS NOT NULL AND owned(id) AND {CLAIMABLE}"
+                " ORDER BY next_run_time LIMIT 1"
+            ).fetchone()
+        return utc_timestamp_to_datetime(row[0]) if row else None
+
+    def stats(self):
+        """ the members of the cluster and the number of jobs this node owns """
+        with self._lock:
+            if self._conn is None:
+                owned = 0
+            else:
+                owned, = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE owned(id)").fetchone()
+        return {"node_id": self.node_id, "nodes": list(self.nodes), "owned_jobs": owned}
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (path={self.path}, node_id={self.node_id})>"
@@ -0,0 +1,227 @@
+import threading
+from collections import deque
+
+from apscheduler.executors.base import MaxInstancesReachedError
+
+from . import logger as pyrsched_logger
+
+logger = pyrsched_logger.getChild("concurrency")
+
+# job kwargs which assign a job to a concurrency group
+GROUP_KWARG = "concurrency_group"
+WEIGHT_KWARG = "concurrency_weight"
+
+
+def job_group(job):
+    """ ``(group name, weight)`` of a job, the name is ``None`` for jobs without group """
+    kwargs = job.kwargs or {}
+    return kwargs.get(GROUP_KWARG), kwargs.get(WEIGHT_KWARG) or 1
+
+
+class _Group:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.used = 0
+        self.waiting = deque()  # (weight, callback)
+
+
+class ConcurrencyGroups:
+    """
+    Named weighted semaphores shared by all executors.
+
+    Each group has a capacity; a run of a job in the group takes the job's weight from it while
+    the run is executing. Runs which do not fit are not submitted to the executor at all. Their
+    callback is queued and called, in order, as soon as finished runs have released enough capacity.
+    A weight larger than the capacity is reduced to the capacity, so such a run waits until the
+    group is idle.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}
+
+    def configure(self, groups):
+        """ set the capacities of several groups, ``groups`` maps names to capacities """
+        for name, capacity in (groups or {}).items():
+            self.set_capacity(name, capacity)
+
+    def set_capacity(self, name, capacity):
+        capacity = int(capacity)
+        if capacity < 1:
+            raise ValueError(f"The capacity of a concurrency group must be at least 1, got {capacity}")
+        with self._lock:
+            group = self._groups.get(name)
+            if group is None:
+                group = self._groups[name] = _Group(capacity)
+            group.capacity = capacity
+            ready = self._ready(group)
+        self._run(ready)
+
+    def remove(self, name):
+        """ remove an idle group """
+        with self._lock:
+            group = self._groups.get(name)
+            if group is not None and (group.used or group.waiting):
+                raise ValueError(f"Concurrency group {name!r} is in use")
+            self._groups.pop(name, None)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._groups
+
+    def _ready(self, group):
+        # called with self._lock held, takes the capacity for queued runs which fit now
+        ready = []
+        while group.waiting:
+            weight = min(group.waiting[0][0], group.capacity)
+            if group.used + weight > group.capacity:
+                break
+            group.used += weight
+            ready.append(group.waiting.popleft()[1])
+        return ready
+
+    def _run(self, callbacks):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Submitting a deferred run failed")
+
+    def acquire(self, name, weight, callback):
+        """ Call ``callback`` once ``weight`` is available in group ``name``, right away if possible.
+
+        :return: ``True`` if the callback was called, ``False`` if the run was deferred
+        """
+        with self._lock:
+            group = self._groups.get(name)
+            if group is None:
+                run = True  # the group was removed from the configuration after the job was added
+            else:
+                weight = min(weight, group.capacity)
+                run = not group.waiting and group.used + weight <= group.capacity
+                if run:
+                    group.used += weight
+                else:
+                    group.waiting.append((weight, callback))
+        if group is None:
+            logger.warning(f"Unknown concurrency group {name!r}, running without limit")
+        if run:
+            callback()
+        return run
+
+    def release(self, name, weight):
+        with self._lock:
+            group = self._groups.get(name)
+            if group is None:
+                return
+            group.used = max(group.used - min(weight, group.capacity), 0)
+            ready = self._ready(group)
+        self._run(ready)
+
+    def discard(self, predicate):
+        """ drop queued callbacks for which ``predicate(callback)`` is true, e.g. of a stopped executor """
+        with self._lock:
+            for group in self._groups.values():
+                group.waiting = deque(w for w in group.waiting if not predicate(w[1]))
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {"capacity": g.capacity, "used": g.used, "waiting": len(g.waiting)}
+                for name, g in self._groups.items()
+            }
+
+
+concurrency_groups = ConcurrencyGroups()
+
+
+class _DeferredRun:
+    def __init__(self, executor, job, run_times, group, weight):
+        self.executor = executor
+        self.job = job
+        self.run_times = run_times
+        self.group = group
+        self.weight = weight
+
+    def __call__(self):
+        self.executor._submit_in_group(self)
+
+
+class ConcurrencyGroupMixin:
+    """
+    Executor mixin which holds back runs of jobs in a concurrency group until the group has
+    capacity for them. A held back run occupies no worker, but counts towards the job's
+    ``max_instances``, so a job can not pile up deferred runs.
+    """
+    groups = concurrency_groups
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self.deferred_runs = 0
+        self._group_runs = {}  # job id -> [(group, weight)] of the submitted runs
+
+    def shutdown(self, wait=True):
+        self.groups.discard(lambda callback: isinstance(callback, _DeferredRun) and callback.executor is self)
+        super().shutdown(wait)
+
+    def submit_job(self, job, run_times):
+        group, weight = job_group(job)
+        if group is None:
+            with self._lock:
+                self._track_run(job)
+                try:
+                    return super().submit_job(job, run_times)
+                except Exception:
+                    self._untrack_run(job.id)
+                    raise
+
+        with self._lock:
+            if self._instances[job.id] >= job.max_instances:
+                raise MaxInstancesReachedError(job)
+            self._instances[job.id] += 1
+            self.deferred_runs += 1
+        if not self.groups.acquire(group, weight, _DeferredRun(self, job, run_times, group, weight)):
+            self._logger.debug(f'Run of job "{job}" deferred, concurrency group {group!r} is full')
+
+    def _submit_in_group(self, run):
+        with self._lock:
+            self.deferred_runs -= 1
+            self._track_run(run.job)
+            try:
+                self._do_submit_job(run.job, run.run_times)
+                return
+            except Exception as exc:
+                # not self._run_job_error, the failed run has no entry in self._group_runs
+                self._untrack_run(run.job.id)
+                super()._run_job_error(run.job.id, exc, exc.__traceback__)
+        self.groups.release(run.group, run.weight)
+
+    def _track_run(self, job):
+        # called with self._lock held before a run is submitted, remembers which group the run
+        # has to release when it's done (the run may finish before _do_submit_job returns)
+        self._group_runs.setdefault(job.id, []).append(job_group(job))
+
+    def _untrack_run(self, job_id):
+        # called with self._lock held if submitting the run failed
+        runs = self._group_runs[job_id]
+        runs.pop()
+        if not runs:
+            del self._group_runs[job_id]
+
+    def _release_group(self, job_id):
+        with self._lock:
+            runs = self._group_runs.get(job_id)
+            if not runs:
+                return
+            group, weight = runs.pop(0)
+            if not runs:
+                del self._group_runs[job_id]
+        if group is not None:
+            self.groups.release(group, weight)
+
+    def _run_job_success(self, job_id, events):
+        super()._run_job_success(job_id, events)
+        self._release_group(job_id)
+
+    def _run_job_error(self, job_id, exc, traceback=None):
+        super()._run_job_error(job_id, exc, traceback)
+        self._release_group(job_id)
@@ -0,0 +1,235 @@
+"""
+Jobs which run after other jobs instead of on a schedule.
+
+A job added with ``after=[upstream job ids]`` has a :class:`~pyrsched.server.triggers.DependencyTrigger`,
+which never fires by time. It runs each time all of its upstream jobs succeeded (at least once)
+since its last run: as soon as the last of them completes, the run is submitted to the job's
+executor from the listener of the completion event, so downstream pipelines do not wait for the
+next wakeup of the scheduler.
+
+The graph keeps, for each downstream job, the upstream jobs it still waits for. A completed run
+only touches the downstream jobs of its own job, so the cost of an event does not depend on the
+size of the graph.
+"""
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from apscheduler.events import (
+    EVENT_ALL_JOBS_REMOVED,
+    EVENT_JOB_EXECUTED,
+    EVENT_JOB_MAX_INSTANCES,
+    EVENT_JOB_REMOVED,
+    EVENT_JOB_SUBMITTED,
+    EVENT_SCHEDULER_STARTED,
+    JobSubmissionEvent,
+)
+from apscheduler.executors.base import MaxInstancesReachedError
+from apscheduler.schedulers.base import STATE_STOPPED
+
+from . import logger as pyrsched_logger
+from .triggers import DependencyTrigger
+
+logger = pyrsched_logger.getChild("dependencies")
+
+
+class DependencyGraph:
+    """
+    The dependencies between the jobs of a scheduler, and the downstream jobs which are waiting.
+
+    Changes of jobs made through the scheduler service are applied with :meth:`update`, removed
+    jobs are dropped from the graph on their events. The graph is rebuilt from the job stores when
+    the scheduler starts and when other nodes of a cluster changed the job set. Jobs whose upstream
+    jobs did not change keep waiting for the same ones, after a restart all of them start over.
+    """
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+        self._lock = threading.Lock()
+        self._upstream = {}  # downstream job id -> upstream job ids
+        self._downstream = defaultdict(set)  # upstream job id -> downstream job ids
+        self._waiting = {}  # downstream job id -> upstream job ids which did not succeed since its last run
+        self._submitted = 0
+        self._skipped = 0
+        scheduler.add_listener(self._on_executed, EVENT_JOB_EXECUTED)
+        scheduler.add_listener(self._on_removed, EVENT_JOB_REMOVED)
+        scheduler.add_listener(lambda event: self.rebuild(), EVENT_ALL_JOBS_REMOVED | EVENT_SCHEDULER_STARTED)
+
+    def make_trigger(self, after, job_id=None):
+        """ The trigger of a job which runs after the jobs ``after``.
+
+        :param after: an upstream job id or a list of them
+        :param job_id: the job which gets the trigger if it exists already, it must not be upstream of itself
+        :raises ValueError: an upstream job does not exist or the dependency would form a cycle
+        """
+        upstream = [after] if isinstance(after, str) else list(dict.fromkeys(after))
+        if not upstream:
+            raise ValueError("A job needs at least one upstream job to run after")
+        for upstream_id in upstream:
+            if self._scheduler.get_job(upstream_id) is None:
+                raise ValueError(f"Unknown upstream job '{upstream_id}'")
+        if job_id is not None:
+            with self._lock:
+                cycle = self._descendants(job_id) & set(upstream)
+            if cycle:
+                raise ValueError(f"Job '{job_id}' can not run after its own downstream jobs")
+        return DependencyTrigger(upstream)
+
+    def _descendants(self, job_id):
+        """ the job and all jobs which run after it, directly or indirectly """
+        found, stack = {job_id}, [job_id]
+        while stack:
+            for downstream_id in self._downstream.get(stack.pop(), ()):
+                if downstream_id not in found:
+                    found.add(downstream_id)
+                    stack.append(downstream_id)
+        return found
+
+    def update(self, job_id, trigger):
+        """ apply the trigger of an added or rescheduled job, jobs with another trigger stop waiting """
+        upstream = trigger.upstream if isinstance(trigger, DependencyTrigger) else ()
+        with self._lock:
+            self._unlink(job_id)
+            if upstream:
+                self._link(job_id, upstream)
+
+    def _link(self, job_id, upstream):
+        self._upstream[job_id] = frozenset(upstream)
+        self._waiting[job_id] = set(upstream)
+        for upstream_id in upstream:
+            self._downstream[upstream_id].add(job_id)
+
+    def _unlink(self, job_id):
+        for upstream_id in self._upstream.pop(job_id, ()):
+            downstream = self._downstream.get(upstream_id)
+            if downstream is not None:
+                downstream.discard(job_id)
+                if not downstream:
+                    del self._downstream[upstream_id]
+        self._waiting.pop(job_id, None)
+
+    def remove(self, job_id):
+        """ Drop a removed job. Its downstream jobs run when their other upstream jobs succeeded.
+
+        Downstream jobs which ran after this job only are orphaned, they never run until they are
+        rescheduled or removed.
+        """
+        with self._lock:
+            self._unlink(job_id)
+            orphaned = []
+            for downstream_id in self._downstream.pop(job_id, ()):
+                self._upstream[downstream_id] = self._upstream[downstream_id] - {job_id}
+                self._waiting[downstream_id].discard(job_id)
+                if not self._upstream[downstream_id]:
+                    orphaned.append(downstream_id)
+        self._warn_orphaned(orphaned)
+
+    def _warn_orphaned(self, job_ids):
+        for job_id in job_ids:
+            logger.warning(f"All upstream jobs of job {job_id} were removed, it will not run until it is rescheduled")
+
+    def _orphaned(self):
+        return [job_id for job_id, upstream in self._upstream.items() if not upstream]
+
+    def _read_dependent_jobs(self):
+        """ ``{job id: upstream ids}`` of all jobs which run after others.
+
+        The stores are read directly: the scheduler's job store lock may be held by a thread which waits
+        for a store lock, e.g. a batch of changes while the cluster heartbeat calls :meth:`rebuild`.
+        """
+        stores = list(self._scheduler._jobstores.values())
+        jobs = [job for job, _, _ in list(self._scheduler._pending_jobs)]
+        existing = {job.id for job in jobs}
+        for store in stores:
+            if hasattr(store, "get_jobs_with_trigger"):
+                # only restores the jobs which run after others
+                jobs += store.get_jobs_with_trigger(DependencyTrigger)
+            else:
+                jobs += store.get_all_jobs()
+        upstream = {job.id: job.trigger.upstream for job in jobs if isinstance(job.trigger, DependencyTrigger)}
+
+        # upstream jobs which were removed, e.g. while the scheduler was stopped, are gone
+        existing.update(upstream)
+        for upstream_id in {u for ids in upstream.values() for u in ids} - existing:
+            if any(store.lookup_job(upstream_id) is not None for store in stores):
+                existing.add(upstream_id)
+        return {job_id: [u for u in ids if u in existing] for job_id, ids in upstream.items()}
+
+    def rebuild(self):
+        """ read the dependencies of all jobs from the job stores """
+        dependencies = self._read_dependent_jobs()
+        with self._lock:
+            waiting = self._waiting
+            unchanged = {
+                job_id for job_id, upstream in dependencies.items() if self._upstream.get(job_id) == frozenset(upstream)
+            }
+            self._upstream = {}
+            self._downstream = defaultdict(set)
+            self._waiting = {}
+            for job_id, upstream in dependencies.items():
+                self._link(job_id, upstream)
+                if job_id in unchanged:
+                    self._waiting[job_id] = waiting[job_id]
+            orphaned = [job_id for job_id in self._orphaned() if job_id not in unchanged]
+        self._warn_orphaned(orphaned)
+        logger.debug(f"Loaded the dependencies of {len(self._upstream)} jobs")
+
+    def _on_removed(self, event):
+        self.remove(event.job_id)
+
+    def _on_executed(self, event):
+        ready = []
+        with self._lock:
+            for downstream_id in self._downstream.get(event.job_id, ()):
+                waiting = self._waiting[downstream_id]
+                waiting.discard(event.job_id)
+                if not waiting:
+                    self._waiting[downstream_id] = set(self._upstream[downstream_id])
+                    ready.append(downstream_id)
+        for downstream_id in ready:
+            self._submit(downstream_id)
+
+    def _submit(self, job_id):
+        """ submit a run of a job to its executor right away, like the scheduler does with due jobs """
+        job = self._scheduler.get_job(job_id)
+        if job is None or job.next_run_time is None or self._scheduler.state == STATE_STOPPED:
+            logger.info(f"Job {job_id} is paused, its upstream jobs succeeded without it")
+            self._skipped += 1
+            return
+        run_times = [datetime.now(self._scheduler.timezone)]
+        try:
+            executor = self._scheduler._lookup_executor(job.executor)
+            executor.submit_job(job, run_times)
+        except MaxInstancesReachedError:
+            logger.warning(f"Job {job_id} is still running, the run after its upstream jobs is skipped")
+            self._skipped += 1
+            self._scheduler._dispatch_event(
+                JobSubmissionEvent(EVENT_JOB_MAX_INSTANCES, job.id, job._jobstore_alias, run_times)
+            )
+        except Exception:
+            logger.exception(f"Error submitting job {job_id} after its upstream jobs")
+            self._skipped += 1
+        else:
+            self._submitted += 1
+            self._scheduler._dispatch_event(
+                JobSubmissionEvent(EVENT_JOB_SUBMITTED, job.id, job._jobstore_alias, run_times)
+            )
+
+    def dependencies(self, job_id):
+        """ ``{"after": [...], "waiting_for": [...], "downstream": [...], "orphaned": bool}`` of a job, sorted job ids """
+        with self._lock:
+            upstream = self._upstream.get(job_id)
+            return {
+                "after": sorted(upstream or ()),
+                "waiting_for": sorted(self._waiting.get(job_id, ())),
+                "downstream": sorted(self._downstream.get(job_id, ())),
+                "orphaned": upstream is not None and not upstream,
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "jobs": len(self._upstream),
+                "orphaned": sorted(self._orphaned()),
+                "submitted": self._submitted,
+                "skipped": self._skipped,
+            }
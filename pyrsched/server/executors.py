@@ -0,0 +1,213 @@
+import concurrent.futures
+import contextvars
+import multiprocessing
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+from apscheduler.executors.pool import BasePoolExecutor, ThreadPoolExecutor as _ThreadPoolExecutor
+from apscheduler.util import asint
+
+from .admission import AdmissionMixin, job_priority
+from .concurrency import ConcurrencyGroupMixin
+from .history import run_job_timed
+from .priority import DEFAULT_AGING, PriorityThreadPool
+
+# imported once by the fork server, every worker forked from it starts with these modules loaded
+PRELOAD_MODULES = ["pypyr.pipelinerunner", "pyrsched.server.service"]
+# the id of the job whose run the current thread executes, so the job kwargs do not need to contain it
+current_job_id = contextvars.ContextVar("pyrsched_current_job_id", default=None)
+
+
+def _default_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(PRELOAD_MODULES)
+        return context
+    return multiprocessing.get_context("spawn")  # pragma: no cover
+
+
+_start_barrier = None
+
+
+def _init_worker(start_barrier):
+    global _start_barrier
+    _start_barrier = start_barrier
+    # with the "spawn" start method nothing is preloaded, so import pypyr once per worker here
+    import pypyr.pipelinerunner  # noqa: F401
+    from . import service  # noqa: F401
+
+
+def _worker_started():
+    # blocks until all workers run this task, so the pool has to start every one of its processes
+    _start_barrier.wait(timeout=60)
+    return os.getpid()
+
+
+def _run_job(job, jobstore_alias, run_times, logger_name):
+    token = current_job_id.set(job.id)
+    try:
+        return run_job_timed(job, jobstore_alias, run_times, logger_name)
+    finally:
+        current_job_id.reset(token)
+
+
+def _run_job_in_worker(job, jobstore_alias, run_times, logger_name):
+    import psutil  # in the worker process
+
+    events = _run_job(job, jobstore_alias, run_times, logger_name)
+    return events, os.getpid(), psutil.Process().memory_info().rss
+
+
+class ThreadPoolExecutor(AdmissionMixin, ConcurrencyGroupMixin, _ThreadPoolExecutor):
+    """
+    apscheduler's thread pool executor with support for concurrency groups
+    (see :class:`~pyrsched.server.concurrency.ConcurrencyGroups`) and admission control
+    (see :class:`~pyrsched.server.admission.AdmissionController`).
+
+    Plugin class: ``pyrsched.server.executors:ThreadPoolExecutor``
+
+    :param max_workers: the maximum number of spawned threads.
+    :param pool_kwargs: dict of keyword arguments to pass to the underlying ThreadPoolExecutor constructor
+    """
+    def _do_submit_job(self, job, run_times):
+        def callback(f):
+            exc = f.exception()
+            if exc:
+                self._run_job_error(job.id, exc, getattr(exc, "__traceback__", None))
+            else:
+                self._run_job_success(job.id, f.result())
+
+        f = self._pool.submit(_run_job, job, job._jobstore_alias, run_times, self._logger.name)
+        f.add_done_callback(callback)
+
+
+class PriorityThreadPoolExecutor(AdmissionMixin, ConcurrencyGroupMixin, BasePoolExecutor):
+    """
+    A thread pool executor which starts the waiting run with the highest job priority first,
+    instead of the run which was submitted first (see :class:`~pyrsched.server.priority.PriorityThreadPool`).
+
+    A run which waits for a worker gains one priority level every ``aging`` seconds, so bulk jobs
+    with a low priority are delayed by latency critical ones, but not starved. Supports concurrency
+    groups and admission control like :class:`ThreadPoolExecutor`.
+
+    Plugin class: ``pyrsched.server.executors:PriorityThreadPoolExecutor``
+
+    :param max_workers: the maximum number of spawned threads
+    :param aging: seconds after which a waiting run gains one priority level (``None``: no aging)
+    """
+    def __init__(self, max_workers=10, aging=DEFAULT_AGING):
+        super().__init__(PriorityThreadPool(asint(max_workers), aging=float(aging) if aging else None))
+
+    def queue_depth(self):
+        return self._pool.queue_depth
+
+    def _do_submit_job(self, job, run_times):
+        def callback(f):
+            exc = f.exception()
+            if exc:
+                self._run_job_error(job.id, exc, getattr(exc, "__traceback__", None))
+            else:
+                self._run_job_success(job.id, f.result())
+
+        f = self._pool.submit_prioritized(
+            job_priority(job), _run_job, job, job._jobstore_alias, run_times, self._logger.name
+        )
+        f.add_done_callback(callback)
+
+
+class PipelineProcessPoolExecutor(AdmissionMixin, ConcurrencyGroupMixin, BasePoolExecutor):
+    """
+    An executor that runs pipelines in a pool of warm worker processes.
+
+    CPU bound pipelines do not compete for the GIL of the scheduler process. The workers are
+    forked from a fork server which has already imported pypyr, and all workers are started
+    when the scheduler starts. Each run writes to its pipeline log file and masks sensitive values
+    inside the worker, because ``job_function`` sets up its logging context there.
+
+    ``concurrent.futures`` can not retire a single worker, so the whole pool is recycled: once a
+    worker has served ``max_runs_per_child`` runs or its memory exceeds ``max_memory_mb``,
+    a fresh pool takes over new runs while the old one finishes its running pipelines.
+
+    Plugin class: ``pyrsched.server.executors:PipelineProcessPoolExecutor``
+
+    :param max_workers: the number of worker processes
+    :param max_runs_per_child: recycle the pool after a worker served this many runs (``None``: never)
+    :param max_memory_mb: recycle the pool if a worker's resident memory exceeds this limit (``None``: never)
+    :param pool_kwargs: dict of keyword arguments to pass to the underlying ProcessPoolExecutor constructor
+    """
+    def __init__(self, max_workers=4, max_runs_per_child=None, max_memory_mb=None, pool_kwargs=None):
+        self.max_workers = asint(max_workers)
+        self.max_runs_per_child = asint(max_runs_per_child)
+        self.max_memory = asint(max_memory_mb) * 1024 * 1024 if max_memory_mb else None
+        self.pool_kwargs = pool_kwargs or {}
+        self.pool_kwargs.setdefault("mp_context", _default_context())
+        self.recycle_count = 0
+        self._runs_per_worker = {}
+        super().__init__(self._new_pool())
+
+    def _new_pool(self):
+        start_barrier = self.pool_kwargs["mp_context"].Barrier(self.max_workers)
+        return concurrent.futures.ProcessPoolExecutor(
+            self.max_workers, initializer=_init_worker, initargs=(start_barrier,), **self.pool_kwargs
+        )
+
+    def _prefork(self, pool):
+        return [pool.submit(_worker_started) for _ in range(self.max_workers)]
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        concurrent.futures.wait(self._prefork(self._pool))
+        self._logger.info(f"Started {self.max_workers} pipeline worker processes")
+
+    def _needs_recycle(self, pid, rss):
+        # called with self._lock held
+        runs = self._runs_per_worker.get(pid, 0) + 1
+        self._runs_per_worker[pid] = runs
+        if self.max_runs_per_child and runs >= self.max_runs_per_child:
+            self._logger.info(f"Worker {pid} served {runs} runs, recycling the process pool")
+            return True
+        if self.max_memory and rss > self.max_memory:
+            self._logger.info(f"Worker {pid} uses {rss // (1024 * 1024)} MB, recycling the process pool")
+            return True
+        return False
+
+    def _replace_pool(self):
+        # called with self._lock held
+        self._pool = self._new_pool()
+        self._runs_per_worker = {}
+        self.recycle_count += 1
+        self._prefork(self._pool)
+
+    def _account_run(self, pool, pid, rss):
+        with self._lock:
+            if pool is not self._pool:
+                return  # the pool this run came from was already recycled
+            if not self._needs_recycle(pid, rss):
+                return
+            self._replace_pool()
+        pool.shutdown(wait=False)
+
+    def _do_submit_job(self, job, run_times):
+        pool = self._pool
+
+        def callback(f):
+            exc = f.exception()
+            if exc:
+                self._run_job_error(job.id, exc, getattr(exc, "__traceback__", None))
+                return
+            events, pid, rss = f.result()
+            self._account_run(pool, pid, rss)
+            self._run_job_success(job.id, events)
+
+        try:
+            f = pool.submit(_run_job_in_worker, job, job._jobstore_alias, run_times, self._logger.name)
+        except BrokenProcessPool:
+            # deferred runs are submitted from other threads, only one of them replaces the pool
+            with self._lock:
+                if self._pool is pool:
+                    self._logger.warning("Process pool is broken; replacing pool with a fresh instance")
+                    self._replace_pool()
+                broken, pool = pool, self._pool
+            broken.shutdown(wait=False)
+            f = pool.submit(_run_job_in_worker, job, job._jobstore_alias, run_times, self._logger.name)
+        f.add_done_callback(callback)
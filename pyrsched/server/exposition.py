@@ -0,0 +1,47 @@
+"""
+The metrics of this process over http, for Prometheus to scrape.
+
+Only imported when the server is configured with a ``metrics.port``.
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import logger as pyrsched_logger
+from .metrics import metrics
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_HOST = "127.0.0.1"
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pyrsched_logger.getChild("metrics").debug(format % args)
+
+
+class MetricsServer:
+    """ Serves ``/metrics`` over http in a background thread. Listens on localhost by default. """
+    def __init__(self, port, host=DEFAULT_HOST, registry=metrics):
+        self._httpd = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.registry = registry
+        self.address = self._httpd.server_address[:2]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="pyrsched-metrics", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,194 @@
+import math
+import threading
+import time
+from array import array
+
+from apscheduler.executors.base import run_job
+
+from apscheduler.events import (
+    EVENT_ALL_JOBS_REMOVED,
+    EVENT_JOB_ERROR,
+    EVENT_JOB_EXECUTED,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_REMOVED,
+    EVENT_JOB_SUBMITTED,
+)
+
+DEFAULT_HISTORY_SIZE = 100
+PERCENTILES = (50, 95, 99)
+ENDED_TIMEOUT = 60  # seconds a run which finished before its submission was reported waits for that report
+
+
+def time_events(events, started, duration):
+    """ attach the start (unix timestamp) and duration (seconds) of a run to its finish events """
+    for event in events:
+        event.run_started = started
+        event.run_duration = duration
+    return events
+
+
+def run_job_timed(job, jobstore_alias, run_times, logger_name):
+    """ apscheduler's ``run_job``, which also times each run where it executes (see :func:`time_events`) """
+    events = []
+    for run_time in run_times:
+        started, start = time.time(), time.perf_counter()
+        finished = run_job(job, jobstore_alias, [run_time], logger_name)
+        events += time_events(finished, started, time.perf_counter() - start)
+    return events
+
+
+class RunBuffer:
+    """
+    The last ``size`` runs of one job in fixed size arrays.
+
+    The arrays are allocated once, new runs overwrite the oldest ones, so a buffer never grows.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.started = array("d", bytes(8 * size))  # unix timestamps
+        self.durations = array("d", bytes(8 * size))  # seconds
+        self.failed = bytearray(size)
+        self.count = 0  # runs recorded in total
+        self.last_error = None
+        self.last_error_time = None
+
+    def append(self, started, duration, error=None):
+        i = self.count % self.size
+        self.started[i] = started
+        self.durations[i] = duration
+        self.failed[i] = error is not None
+        self.count += 1
+        if error is not None:
+            self.last_error = error
+            self.last_error_time = started + duration
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def _order(self):
+        """ buffer positions from the oldest to the newest run """
+        n = len(self)
+        first = self.count % self.size if self.count > self.size else 0
+        return [(first + i) % self.size for i in range(n)]
+
+    def runs(self):
+        return [
+            {"started": self.started[i], "duration": self.durations[i], "success": not self.failed[i]}
+            for i in self._order()
+        ]
+
+    def stats(self):
+        n = len(self)
+        durations = sorted(self.durations[:n])
+        failures = sum(self.failed[:n])
+        stats = {
+            "runs": n,
+            "total_runs": self.count,
+            "failures": failures,
+            "failure_rate": failures / n if n else None,
+            "mean": sum(durations) / n if n else None,
+            "last_run": self.started[(self.count - 1) % self.size] if n else None,
+            "last_error": self.last_error,
+            "last_error_time": self.last_error_time,
+        }
+        for p in PERCENTILES:
+            # nearest rank
+            stats[f"p{p}"] = durations[max(math.ceil(p / 100 * n) - 1, 0)] if n else None
+        return stats
+
+
+class RunHistory:
+    """
+    Duration and outcome of the recent runs of each job.
+
+    A run is timed where it executes: the executors attach its start and duration to the finish
+    events (see :func:`run_job_timed`), so the time a run waited in a queue or for admission is not
+    part of its duration. Finish events without timing, e.g. of a lost remote worker, are timed from
+    the submission of the run. The events of a run may arrive in any order: a run which finished
+    before its submission was reported is recorded anyway and not tracked as running afterwards.
+    Each job keeps the last ``size`` runs; the history of a job is dropped when the job is removed.
+
+    :param scheduler: the apscheduler scheduler
+    :param size: number of runs kept per job
+    :param on_run: optional callable ``on_run(job_id, duration, error)``, called for each recorded run
+    """
+    def __init__(self, scheduler, size=DEFAULT_HISTORY_SIZE, on_run=None):
+        self.size = size
+        self._on_run = on_run
+        self._lock = threading.Lock()
+        self._buffers = {}  # job id -> RunBuffer
+        self._running = {}  # (job id, scheduled run time) -> (start timestamp, start monotonic)
+        # (job id, scheduled run time) -> monotonic time of runs which finished or were shed before their
+        # submission was reported, oldest first
+        self._ended = {}
+        scheduler.add_listener(self._on_submitted, EVENT_JOB_SUBMITTED)
+        scheduler.add_listener(self._on_finished, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+        scheduler.add_listener(self._on_missed, EVENT_JOB_MISSED)
+        scheduler.add_listener(self._on_removed, EVENT_JOB_REMOVED | EVENT_ALL_JOBS_REMOVED)
+
+    def _on_submitted(self, event):
+        start = (time.time(), time.monotonic())
+        with self._lock:
+            for run_time in event.scheduled_run_times:
+                key = (event.job_id, run_time)
+                if self._ended.pop(key, None) is None:
+                    self._running[key] = start
+
+    def _on_finished(self, event):
+        now = time.monotonic()
+        error = repr(event.exception) if event.exception is not None else None
+        with self._lock:
+            start = self._end((event.job_id, event.scheduled_run_time), now)
+            if hasattr(event, "run_started"):
+                started, duration = event.run_started, event.run_duration
+            elif start is not None:
+                started, duration = start[0], now - start[1]
+            else:
+                return  # neither timed by its executor nor submitted while the history existed
+            buffer = self._buffers.get(event.job_id)
+            if buffer is None:
+                buffer = self._buffers[event.job_id] = RunBuffer(self.size)
+            buffer.append(started, duration, error)
+        if self._on_run is not None:
+            self._on_run(event.job_id, duration, error)
+
+    def _on_missed(self, event):
+        # missed runs are not recorded, but must not stay in the running runs
+        with self._lock:
+            self._end((event.job_id, event.scheduled_run_time), time.monotonic())
+
+    def _end(self, key, now):
+        """ the start of a running run, or remember a run which ended before its submission was reported """
+        # called with self._lock held
+        start = self._running.pop(key, None)
+        if start is None:
+            # submissions are reported right after the executor accepted the run, forget orphans
+            while self._ended and now - next(iter(self._ended.values())) > ENDED_TIMEOUT:
+                del self._ended[next(iter(self._ended))]
+            self._ended[key] = now
+        return start
+
+    def _on_removed(self, event):
+        with self._lock:
+            if event.code == EVENT_ALL_JOBS_REMOVED:
+                self._buffers.clear()
+                self._running.clear()
+                self._ended.clear()
+                return
+            self._buffers.pop(event.job_id, None)
+            for key in [key for key in self._running if key[0] == event.job_id]:
+                del self._running[key]
+            for key in [key for key in self._ended if key[0] == event.job_id]:
+                del self._ended[key]
+
+    def runs(self, job_id):
+        """ the recorded runs of a job, oldest first """
+        with self._lock:
+            buffer = self._buffers.get(job_id)
+            return buffer.runs() if buffer else []
+
+    def stats(self, job_id):
+        """ duration percentiles, failure rate and last error of a job's recorded runs """
+        with self._lock:
+            buffer = self._buffers.get(job_id)
+            return buffer.stats() if buffer else RunBuffer(1).stats()
@@ -0,0 +1,292 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from apscheduler.events import (
+    EVENT_ALL_JOBS_REMOVED,
+    EVENT_JOB_ADDED,
+    EVENT_JOB_ERROR,
+    EVENT_JOB_EXECUTED,
+    EVENT_JOB_MAX_INSTANCES,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_MODIFIED,
+    EVENT_JOB_REMOVED,
+    EVENT_JOB_SUBMITTED,
+    EVENT_JOBSTORE_ADDED,
+    EVENT_JOBSTORE_REMOVED,
+    EVENT_SCHEDULER_STARTED,
+)
+
+from . import logger as pyrsched_logger
+
+logger = pyrsched_logger.getChild("jobcache")
+
+DEFAULT_PUBLISH_INTERVAL = 0.1
+PUBLISHER_IDLE_TIMEOUT = 30  # seconds without changes after which the publisher thread ends
+
+# events after which a single job has to be marshalled again
+JOB_EVENTS = (
+    EVENT_JOB_ADDED | EVENT_JOB_MODIFIED | EVENT_JOB_REMOVED | EVENT_JOB_SUBMITTED
+    | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED
+)
+# events after which all jobs have to be marshalled again
+RESET_EVENTS = EVENT_ALL_JOBS_REMOVED | EVENT_JOBSTORE_ADDED | EVENT_JOBSTORE_REMOVED | EVENT_SCHEDULER_STARTED
+
+
+def sort_key(next_run_time, insertion):
+    """ job store order: by next run time, paused jobs last, then in the order the jobs were added """
+    return (next_run_time is None, next_run_time.timestamp() if next_run_time else 0.0, insertion)
+
+
+def encode_cursor(key):
+    paused, timestamp, insertion = key
+    return f"{int(paused)}:{timestamp!r}:{insertion}"
+
+
+def decode_cursor(cursor):
+    try:
+        paused, timestamp, insertion = cursor.split(":")
+        return (bool(int(paused)), float(timestamp), int(insertion))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor!r}") from None
+
+
+class JobSnapshot:
+    """
+    The marshalled jobs at one point in time.
+
+    A snapshot is never changed after it has been published, readers take the current snapshot
+    without a lock and keep using it even while a newer one is published.
+    """
+    __slots__ = ("version", "published", "jobs", "triggers", "fire_times", "entries")
+
+    def __init__(self, version=0, jobs=None, triggers=None, fire_times=None):
+        self.version = version
+        self.published = time.monotonic()
+        self.jobs = jobs or {}  # job id -> (insertion number, next run time, marshalled job)
+        self.triggers = triggers or {}  # job id -> trigger
+        self.fire_times = fire_times or {}  # job id -> tuple of the next fire times
+        # (sort key, next run time, marshalled job) in job store order
+        self.entries = sorted(
+            (sort_key(next_run_time, insertion), next_run_time, marshalled)
+            for insertion, next_run_time, marshalled in self.jobs.values()
+        )
+
+
+class JobStateCache:
+    """
+    Marshalled jobs, published as immutable snapshots.
+
+    Event listeners only mark jobs as changed. A publisher thread marshals the changed jobs again
+    and publishes a new snapshot (copy on write), at most once per ``publish_interval`` seconds.
+    Reads are served from the current snapshot: they never call the scheduler, so monitoring
+    clients do not compete with the scheduler thread for the job store lock. :meth:`publish`
+    publishes the pending changes right away, e.g. after a client changed jobs, so that the client
+    reads its own changes. Jobs are listed in the order of the job store: by next run time, paused
+    jobs last.
+
+    With ``fire_times``, the upcoming fire times of each job are computed together with its
+    marshalled state and kept until the job changes again. ``marshal`` gets them as second argument.
+
+    :param scheduler: the apscheduler scheduler
+    :param marshal: callable which turns a job into the data structure sent to clients
+    :param fire_times: optional callable which returns the next ``fire_time_count`` fire times (datetimes)
+        of a job, fewer if the job's trigger ends
+    :param fire_time_count: the number of fire times ``fire_times`` returns
+    :param publish_interval: seconds between two snapshots published by the publisher thread
+    """
+    def __init__(self, scheduler, marshal, fire_times=None, fire_time_count=0,
+                 publish_interval=DEFAULT_PUBLISH_INTERVAL):
+        self._scheduler = scheduler
+        self._marshal = marshal
+        self._compute_fire_times = fire_times
+        self._fire_time_count = fire_time_count
+        self.publish_interval = publish_interval
+        self._lock = threading.Condition()  # guards the pending changes, notified after each publish
+        self._publish_lock = threading.Lock()  # one publish at a time, so an older one can't win
+        self._snapshot = JobSnapshot()
+        self._insertions = itertools.count()
+        self._changed = {}  # job ids in the order of their events, so new jobs keep their order
+        self._reset = True
+        self._holds = 0  # publishing is held while this is not 0
+        self._sequence = 0  # counts the changes, see wait_published
+        self._published_sequence = 0  # the changes up to this one are in the snapshot
+        self._publisher = None
+        scheduler.add_listener(self._on_job_event, JOB_EVENTS)
+        scheduler.add_listener(self._on_reset_event, RESET_EVENTS)
+
+    def _on_job_event(self, event):
+        self.invalidate(event.job_id)
+
+    def _on_reset_event(self, event):
+        self.invalidate_all()
+
+    def invalidate_all(self):
+        """ Marshal all jobs again for the next snapshot, e.g. after another process changed the job store. """
+        with self._lock:
+            self._reset = True
+            self._sequence += 1
+            self._start_publisher()
+
+    def invalidate(self, job_id):
+        """ Marshal a job again for the next snapshot, for changes which do not fire an event. """
+        with self._lock:
+            self._changed[job_id] = None
+            self._sequence += 1
+            self._start_publisher()
+
+    @property
+    def pending(self):
+        return self._reset or bool(self._changed)
+
+    def _start_publisher(self):
+        # called with self._lock held
+        self._lock.notify_all()
+        if self._publisher is None:
+            self._publisher = threading.Thread(target=self._publish_changes, name="pyrsched-snapshots", daemon=True)
+            self._publisher.start()
+
+    def _publish_changes(self):
+        while True:
+            with self._lock:
+                if not self.pending:
+                    self._lock.wait(PUBLISHER_IDLE_TIMEOUT)
+                if not self.pending:
+                    self._publisher = None  # idle, the next change starts a new thread
+                    return
+            try:
+                self.publish()
+            except Exception:
+                logger.exception("Publishing the job snapshot failed")
+            time.sleep(self.publish_interval)
+
+    @contextmanager
+    def held(self):
+        """ Publish no snapshot in the meantime, e.g. while a batch of changes holds the job store locked. """
+        with self._publish_lock:  # a publish which is under way finishes first
+            with self._lock:
+                self._holds += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._holds -= 1
+                self._lock.notify_all()
+
+    def publish(self):
+        """ Publish a snapshot with the pending changes, if there are any. """
+        with self._publish_lock:
+            with self._lock:
+                while self._holds:
+                    self._lock.wait()
+                reset, changed = self._reset, self._changed
+                self._reset, self._changed = False, {}
+                sequence = self._sequence
+            try:
+                if reset or changed:
+                    self._publish(reset, changed)
+            finally:
+                with self._lock:
+                    # a failed publish is done as well, its changes are not waited for
+                    self._published_sequence = sequence
+                    self._lock.notify_all()
+
+    def _publish(self, reset, changed):
+        # the scheduler is only called without holding self._lock, its listeners need that lock
+        jobs = self._read_jobs(None if reset else changed)
+        marshalled = {job_id: self._marshal_entry(job) if job else None for job_id, job in jobs.items()}
+
+        old = self._snapshot
+        entries = {} if reset else dict(old.jobs)
+        triggers = {} if reset else dict(old.triggers)
+        fire_times = {} if reset else dict(old.fire_times)
+        for job_id, m in marshalled.items():
+            if m is None:
+                entries.pop(job_id, None)
+                triggers.pop(job_id, None)
+                fire_times.pop(job_id, None)
+                continue
+            old_entry = old.jobs.get(job_id)
+            insertion = old_entry[0] if old_entry else next(self._insertions)
+            entries[job_id] = (insertion, ) + m[:2]
+            triggers[job_id] = jobs[job_id].trigger
+            fire_times[job_id] = m[2]
+        self._snapshot = JobSnapshot(old.version + 1, entries, triggers, fire_times)
+
+    def _read_jobs(self, job_ids=None):
+        """ ``{job id: job or None}`` of some or all jobs, read from the job stores directly.
+
+        ``scheduler.get_jobs()`` holds the scheduler's job store lock while it waits for the lock of each
+        store. A batch which holds a store's lock and then adds a job the other way round would deadlock
+        with the publisher thread.
+        """
+        stores = list(self._scheduler._jobstores.values())
+        pending = {job.id: job for job, _, _ in list(self._scheduler._pending_jobs)}
+        if job_ids is None:
+            for store in stores:
+                pending.update((job.id, job) for job in store.get_all_jobs())
+            return pending
+        jobs = {}
+        for job_id in job_ids:
+            jobs[job_id] = pending.get(job_id)
+            for store in stores:
+                jobs[job_id] = store.lookup_job(job_id) or jobs[job_id]
+        return jobs
+
+    def wait_published(self, timeout):
+        """ Wait up to ``timeout`` seconds until the changes made so far are in the snapshot. """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            sequence = self._sequence
+            while self._published_sequence < sequence:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._lock.wait(remaining):
+                    return False
+        return True
+
+    def _marshal_entry(self, job):
+        if self._compute_fire_times is None:
+            return job.next_run_time, self._marshal(job), ()
+        fire_times = tuple(self._compute_fire_times(job))
+        return job.next_run_time, self._marshal(job, fire_times), fire_times
+
+    @property
+    def snapshot(self):
+        """ the current snapshot """
+        return self._snapshot
+
+    def get(self, job_id):
+        entry = self._snapshot.jobs.get(job_id)
+        return entry[2] if entry else None
+
+    def trigger(self, job_id):
+        """ the trigger of a job in the current snapshot """
+        return self._snapshot.triggers.get(job_id)
+
+    def entries(self):
+        """ ``(sort key, next run time, marshalled job)`` of all jobs, in job store order """
+        return self._snapshot.entries
+
+    def list(self):
+        return [e[2] for e in self._snapshot.entries]
+
+    def upcoming(self, until):
+        """ Runs up to ``until`` from the precomputed fire times, in order of their run time.
+
+        :return: ``(runs, incomplete)``, ``runs`` is a list of ``(run time, marshalled job)``,
+            ``incomplete`` the ids of jobs whose precomputed fire times end before ``until``
+        """
+        snapshot = self._snapshot
+        incomplete = []
+        runs = []
+        for job_id, times in snapshot.fire_times.items():
+            if not times:
+                continue
+            job = snapshot.jobs[job_id][2]
+            if len(times) >= self._fire_time_count and times[-1] < until:
+                incomplete.append(job_id)
+            runs.append([(t, job_id, job) for t in times if t <= until])
+        merged = [(t, job) for t, _, job in heapq.merge(*runs, key=lambda run: run[:2])]
+        return merged, incomplete
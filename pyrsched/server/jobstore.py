@@ -0,0 +1,224 @@
+import hashlib
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+# job attributes which are the same for all jobs created by SchedulerService.add_job
+TEMPLATE_ATTRIBUTES = ("version", "func", "executor", "kwargs", "misfire_grace_time", "coalesce", "max_instances")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_templates (
+    id INTEGER PRIMARY KEY,
+    digest TEXT NOT NULL UNIQUE,
+    template BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    next_run_time REAL,
+    template_id INTEGER NOT NULL REFERENCES job_templates(id),
+    state BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_next_run_time ON jobs(next_run_time);
+"""
+
+
+class SQLiteJobStore(BaseJobStore):
+    """
+    Persistent job store in a sqlite database, without further dependencies.
+
+    The jobs pyrsched creates share almost all of their settings (the job function, executor, the
+    logging and path configuration in ``kwargs``). These are stored once as a job template, each job
+    row only holds its name, args, trigger and next run time. Due jobs are found through an index on
+    the next run time, so the scheduler only loads the jobs it has to run.
+
+    Writes are committed one by one, unless they happen inside ``batch()``, which commits all of
+    them in one transaction.
+
+    Plugin class: ``pyrsched.server.jobstore:SQLiteJobStore``
+
+    :param path: the database file
+    :param pickle_protocol: pickle protocol for the job state
+    """
+    def __init__(self, path="jobs.sqlite", pickle_protocol=pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.path = str(path)
+        self.pickle_protocol = int(pickle_protocol)
+        self._lock = threading.RLock()
+        self._in_batch = 0
+        self._conn = None
+        self._template_ids = {}  # digest -> template id
+        self._templates = {}  # template id -> template dict
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        with self._lock:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            for template_id, digest, template in self._conn.execute("SELECT id, digest, template FROM job_templates"):
+                self._template_ids[digest] = template_id
+                self._templates[template_id] = pickle.loads(template)
+
+    def shutdown(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @contextmanager
+    def batch(self, immediate=False):
+        """ Commit all writes inside this block in one transaction.
+
+        :param immediate: take the write lock of the database when the transaction begins. A transaction which
+            reads before it writes can not fail then, because another connection wrote in between.
+            Only applies to the outermost batch.
+        """
+        with self._lock:
+            if self._in_batch == 0:
+                self._conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            self._in_batch += 1
+            try:
+                yield
+            except BaseException:
+                self._in_batch -= 1
+                if self._in_batch == 0:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._in_batch -= 1
+            if self._in_batch == 0:
+                self._conn.execute("COMMIT")
+
+    def _template_id(self, state):
+        # called with self._lock held
+        template = pickle.dumps({k: state[k] for k in TEMPLATE_ATTRIBUTES}, self.pickle_protocol)
+        digest = hashlib.sha1(template).hexdigest()
+        template_id = self._template_ids.get(digest)
+        if template_id is None:
+            # another process on the same database may have stored the template already
+            self._conn.execute("INSERT OR IGNORE INTO job_templates (digest, template) VALUES (?, ?)", (digest, template))
+            template_id, = self._conn.execute("SELECT id FROM job_templates WHERE digest = ?", (digest, )).fetchone()
+            self._template_ids[digest] = template_id
+            self._templates[template_id] = pickle.loads(template)
+        return template_id
+
+    def _template(self, template_id):
+        template = self._templates.get(template_id)
+        if template is None:
+            with self._lock:
+                # stored by another process on the same database
+                digest, blob = self._conn.execute(
+                    "SELECT digest, template FROM job_templates WHERE id = ?", (template_id, )
+                ).fetchone()
+                template = self._templates[template_id] = pickle.loads(blob)
+                self._template_ids[digest] = template_id
+        return template
+
+    def _row(self, job):
+        state = job.__getstate__()
+        return (
+            datetime_to_utc_timestamp(job.next_run_time),
+            self._template_id(state),
+            pickle.dumps((state["name"], state["args"], state["trigger"]), self.pickle_protocol),
+            job.id,
+        )
+
+    def _reconstitute_job(self, job_id, next_run_time, template_id, job_state):
+        name, args, trigger = pickle.loads(job_state)
+        state = dict(self._template(template_id), id=job_id, name=name, args=args, trigger=trigger)
+        state["kwargs"] = dict(state["kwargs"])
+        state["next_run_time"] = None
+        if next_run_time is not None:
+            state["next_run_time"] = utc_timestamp_to_datetime(next_run_time).astimezone(trigger.timezone)
+        job = Job.__new__(Job)
+        job.__setstate__(state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, where="", params=()):
+        with self._lock:
+            if self._conn is None:
+                return []  # the scheduler thread may still look for due jobs while the scheduler shuts down
+            rows = self._conn.execute(
+                "SELECT id, next_run_time, template_id, state FROM jobs " + where
+                + " ORDER BY next_run_time IS NULL, next_run_time",
+                params,
+            ).fetchall()
+
+        jobs = []
+        failed = []
+        for row in rows:
+            try:
+                jobs.append(self._reconstitute_job(*row))
+            except BaseException:
+                self._logger.exception(f'Unable to restore job "{row[0]}" -- removing it')
+                failed.append((row[0], ))
+
+        if failed:
+            with self._lock:
+                self._conn.executemany("DELETE FROM jobs WHERE id = ?", failed)
+        return jobs
+
+    def lookup_job(self, job_id):
+        jobs = self._get_jobs("WHERE id = ?", (job_id, ))
+        return jobs[0] if jobs else None
+
+    def get_due_jobs(self, now):
+        return self._get_jobs("WHERE next_run_time <= ?", (datetime_to_utc_timestamp(now), ))
+
+    def get_next_run_time(self):
+        with self._lock:
+            if self._conn is None:
+                return None
+            timestamp, = self._conn.execute("SELECT MIN(next_run_time) FROM jobs").fetchone()
+        return utc_timestamp_to_datetime(timestamp) if timestamp is not None else None
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def get_jobs_with_trigger(self, trigger_class):
+        """ The jobs whose trigger is a ``trigger_class``, the other jobs are not restored.
+
+        The pickled state of a job names the class of its trigger, rows which do not contain the
+        name are skipped by the query.
+        """
+        jobs = self._get_jobs("WHERE instr(state, ?) > 0", (trigger_class.__qualname__.encode(), ))
+        return [job for job in jobs if isinstance(job.trigger, trigger_class)]
+
+    def add_job(self, job):
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs (next_run_time, template_id, state, id) VALUES (?, ?, ?, ?)", self._row(job)
+                )
+            except sqlite3.IntegrityError:
+                raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET next_run_time = ?, template_id = ?, state = ? WHERE id = ?", self._row(job)
+            )
+            if cursor.rowcount == 0:
+                raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id, ))
+            if cursor.rowcount == 0:
+                raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs")
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (path={self.path})>"
@@ -1,31 +1,300 @@
+import contextvars
+import functools
 import threading
 import logging
+import logging.handlers
+import queue
 import re
+import time
+from collections import OrderedDict
+
+from .metrics import LOG_LOCK_WAIT
+
+# the pipeline run (a ``PipelineLoggingContext``) which is active in the current thread
+_active_run = contextvars.ContextVar("pyrsched_active_run", default=None)
+_dispatcher_lock = threading.Lock()
+
+
+class PipelineLogDispatcher(logging.Handler):
+    """
+    Logging handler which routes each record to the handler of the pipeline run it was emitted from.
+
+    There is exactly one dispatcher per logger. Pipeline runs register themselves at the dispatcher
+    when they start and are looked up via a context variable when a record is emitted, so runs in
+    different executor threads write to their own log files without sharing a process wide lock.
+
+    The dispatcher also keeps the logger level at the lowest level any active run asked for and
+    restores the original level when the last run has finished.
+    """
+    def __init__(self, logger):
+        super().__init__()
+        self.logger = logger
+        self._runs_lock = threading.Lock()  # guards the bookkeeping below, never held during a run
+        self._run_levels = {}
+        self._base_level = logger.level
+
+    @classmethod
+    def for_logger(cls, logger):
+        """ Return the dispatcher attached to ``logger``, attach a new one if there is none yet. """
+        with _dispatcher_lock:
+            for handler in logger.handlers:
+                if isinstance(handler, cls):
+                    return handler
+            dispatcher = cls(logger)
+            logger.addHandler(dispatcher)
+            return dispatcher
+
+    def register(self, run, loglevel=None):
+        with self._runs_lock:
+            if not self._run_levels:
+                self._base_level = self.logger.level
+            self._run_levels[run] = loglevel
+            self._update_level()
+
+    def unregister(self, run):
+        with self._runs_lock:
+            self._run_levels.pop(run, None)
+            self._update_level()
+
+    def _update_level(self):
+        levels = [level for level in self._run_levels.values() if level is not None]
+        self.logger.setLevel(min(levels) if levels else self._base_level)
+
+    def handle(self, record):
+        # no handler lock here, the handler of each run serializes its own writes
+        run = _active_run.get()
+        if run is None or run.dispatcher is not self:
+            return False
+        if run.loglevel is not None and record.levelno < run.loglevel:
+            return False
+        return run.handler.handle(record)
+
+    def emit(self, record):
+        self.handle(record)
+
+
+class _TimedLock:
+    """ handler lock which reports how long callers waited for it """
+    def __init__(self, lock, histogram):
+        self._lock = lock
+        self._observe = histogram.observe
+
+    def acquire(self, *args):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(*args)
+        self._observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+    def _at_fork_reinit(self):
+        self._lock._at_fork_reinit()
+
+
+class _TimedLockMixin:
+    def createLock(self):
+        super().createLock()
+        self.lock = _TimedLock(self.lock, LOG_LOCK_WAIT.labels())
+
+
+class _FileHandler(_TimedLockMixin, logging.FileHandler):
+    pass
+
+
+class _CloseHandler:
+    """ queued after the last record of an evicted handler, so that it is closed by the listener """
+    def __init__(self, handler):
+        self.handler = handler
+
+
+class _RoutingQueueHandler(_TimedLockMixin, logging.handlers.QueueHandler):
+    """ puts records on the shared queue, tagged with the file handler which has to write them """
+    def __init__(self, log_queue, target):
+        super().__init__(log_queue)
+        self.target = target
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        record.pyrsched_target = self.target
+        return record
+
+
+class _RoutingQueueListener(logging.handlers.QueueListener):
+    def handle(self, record):
+        if isinstance(record, _CloseHandler):
+            record.handler.close()
+        else:
+            record.pyrsched_target.handle(record)
+
+
+class _HandlerEntry:
+    def __init__(self, handler, file_handler, listener=None):
+        self.handler = handler
+        self.file_handler = file_handler
+        self.listener = listener  # the queue listener which writes the records of a queued handler
+        self.users = 0
+
+
+class LogHandlerRegistry:
+    """
+    Keeps the log handlers of pipelines open across runs.
+
+    Handlers are shared by all runs which write to the same log file with the same format and
+    sensitive keys. Handlers which are not used by a running pipeline are closed in least recently
+    used order as soon as more than ``max_open`` handlers are open.
+
+    With ``use_queue``, pipeline threads only put their records on a queue. One listener thread
+    formats them and writes them to the log files, so a pipeline never waits for the disk.
+    """
+    def __init__(self, max_open=128, use_queue=False):
+        self.max_open = max_open
+        self.use_queue = use_queue
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys = {}  # handler -> key of its entry
+        self._detached = {}  # handler -> entry, handlers of the previous mode which runs still use
+        self._queue = None
+        self._listener = None
+
+    def configure(self, max_open=None, use_queue=None):
+        with self._lock:
+            if max_open is not None:
+                self.max_open = max_open
+            if use_queue is not None and use_queue != self.use_queue:
+                self._detach_all()
+                self.use_queue = use_queue
+            self._evict()
+
+    def _key(self, log_filename, log_format, sensitive_keys):
+        return (str(log_filename), log_format, tuple(sensitive_keys) if sensitive_keys else ())
+
+    def _create(self, log_filename, log_format, sensitive_keys):
+        file_handler = _FileHandler(log_filename, delay=True)
+        file_handler.setFormatter(SensitiveValueFormatter(fmt=log_format, sensitive_keys=sensitive_keys))
+        if not self.use_queue:
+            return _HandlerEntry(file_handler, file_handler)
+
+        if self._listener is None:
+            self._queue = queue.SimpleQueue()
+            self._listener = _RoutingQueueListener(self._queue)
+            self._listener.start()
+        return _HandlerEntry(_RoutingQueueHandler(self._queue, file_handler), file_handler, self._listener)
+
+    def _close_entry(self, entry):
+        if entry.listener is not None:
+            entry.listener.queue.put(_CloseHandler(entry.file_handler))
+        else:
+            entry.file_handler.close()
+
+    def _stop_listener(self, listener):
+        # called with self._lock held, the listener is stopped once no handler writes to its queue anymore
+        if listener is None or listener is self._listener:
+            return
+        if not any(entry.listener is listener for entry in self._detached.values()):
+            listener.stop()  # processes everything queued so far
+
+    def _evict(self):
+        # called with self._lock held
+        if len(self._entries) <= self.max_open:
+            return
+        idle = [key for key, entry in self._entries.items() if entry.users == 0]
+        while len(self._entries) > self.max_open and idle:
+            entry = self._entries.pop(idle.pop(0))
+            del self._keys[entry.handler]
+            self._close_entry(entry)
+
+    def _detach_all(self):
+        # called with self._lock held, handlers which are in use are closed when their runs release them
+        for entry in self._entries.values():
+            if entry.users:
+                self._detached[entry.handler] = entry
+            else:
+                self._close_entry(entry)
+        self._entries.clear()
+        self._keys.clear()
+        listener, self._listener, self._queue = self._listener, None, None
+        self._stop_listener(listener)
+
+    def _close_all(self):
+        # called with self._lock held
+        self._detach_all()
+        listeners = {entry.listener for entry in self._detached.values()}
+        for entry in self._detached.values():
+            self._close_entry(entry)
+        self._detached.clear()
+        for listener in listeners:
+            self._stop_listener(listener)
+
+    def acquire(self, log_filename, log_format=None, sensitive_keys=None):
+        """ Return the handler for a log file and mark it as in use. """
+        key = self._key(log_filename, log_format, sensitive_keys)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = self._create(log_filename, log_format, sensitive_keys)
+                self._keys[entry.handler] = key
+            self._entries.move_to_end(key)
+            entry.users += 1
+            self._evict()
+            return entry.handler
+
+    def release(self, handler):
+        with self._lock:
+            key = self._keys.get(handler)
+            if key is not None:
+                self._entries[key].users -= 1
+                self._evict()
+            elif handler in self._detached:
+                entry = self._detached[handler]
+                entry.users -= 1
+                if not entry.users:
+                    del self._detached[handler]
+                    self._close_entry(entry)
+                    self._stop_listener(entry.listener)
+
+    def open_handlers(self):
+        with self._lock:
+            return len(self._entries)
+
+    def close(self):
+        """ Close all handlers, in queue mode after all queued records have been written. """
+        with self._lock:
+            self._close_all()
+
+
+handler_registry = LogHandlerRegistry()
 
 
 class PipelineLoggingContext:
     def __init__(self, logger, loglevel=None, log_format=None, log_filename="", sensitive_keys=[]):
         self.logger = logger
         self.loglevel = loglevel
-        self.lock = threading.Lock()
+        self.dispatcher = PipelineLogDispatcher.for_logger(logger)
 
-        self.handler = logging.FileHandler(log_filename)
-        self.handler.setFormatter(SensitiveValueFormatter(fmt=log_format, sensitive_keys=sensitive_keys))
+        self.handler = handler_registry.acquire(log_filename, log_format=log_format, sensitive_keys=sensitive_keys)
 
     def __enter__(self):
-        self.lock.acquire()
-        if self.loglevel is not None:
-            self._old_level = self.logger.level
-            self.logger.setLevel(self.loglevel)
-        if self.handler:
-            self.logger.addHandler(self.handler)
+        self.dispatcher.register(self, self.loglevel)
+        self._token = _active_run.set(self)
+        return self
 
     def __exit__(self, et, ev, tb):
-        self.lock.release()
-        if self.loglevel is not None:
-            self.logger.setLevel(self._old_level)
-        if self.handler:
-            self.logger.removeHandler(self.handler)
+        _active_run.reset(self._token)
+        self.dispatcher.unregister(self)
+        handler_registry.release(self.handler)
+
+
+@functools.lru_cache(maxsize=64)
+def _sensitive_pattern(sensitive_keys):
+    """ one regex for all keys, shared by all formatters with the same set of keys """
+    alternation = "|".join(re.escape(key) for key in sensitive_keys)
+    return re.compile(r"\'(?P<key>" + alternation + r")\':\s*\'.*?\'")
 
 
 class SensitiveValueFormatter(logging.Formatter):
@@ -33,22 +302,22 @@ class SensitiveValueFormatter(logging.Formatter):
     Logging formatter which censors sensitive information.
 
     The fitler checks if the log message containssensitive key-value-pairs.
-    These pairs have to occure in the message in the form "'<key>': '<value>'". 
+    These pairs have to occure in the message in the form "'<key>': '<value>'".
     This does not have to be a string representation of a dictionary, but will be in most cases.
 
     Then the value will be replaced with the string '*****' and the log message will be emitted
     by its handler.
-    
-    """    
+
+    All keys are matched literally in a single pass. Messages which do not contain any of the keys
+    are not searched at all.
+    """
     def __init__(self, fmt=None, datefmt=None, style='%', sensitive_keys=None):
         super().__init__(fmt, datefmt, style)
-        self.sensitive_keys = sensitive_keys if sensitive_keys else []
-        self.regex_list = []
-        for key in self.sensitive_keys:            
-            self.regex_list.append( re.compile(r"\'(?P<key>" + key + r")\':\s*\'.*?\'") )
+        self.sensitive_keys = tuple(sensitive_keys) if sensitive_keys else ()
+        self.regex = _sensitive_pattern(self.sensitive_keys) if self.sensitive_keys else None
 
     def format(self, record):
         formatted_record = super().format(record)
-        for r in self.regex_list:
-            formatted_record = r.sub("'\g<key>': '*****'", formatted_record)
-        return formatted_record
+        if self.regex is None or not any(key in formatted_record for key in self.sensitive_keys):
+            return formatted_record
+        return self.regex.sub(r"'\g<key>': '*****'", formatted_record)
@@ -0,0 +1,350 @@
+"""
+Counters, gauges and histograms in the Prometheus text format.
+
+All metrics are created once at import or service start. Updating one takes an uncontended
+lock and, for histograms, a bisect over the bucket bounds, so it can be done on every log record
+and every RPC call. Values which are cheap to read from the scheduler (executor queues) are
+only collected when the metrics are scraped.
+
+Metrics are per process: runs in worker processes of the process pool executor are counted
+by the scheduler process, but their log records are not. They are served over http by
+:class:`~pyrsched.server.exposition.MetricsServer`.
+"""
+import functools
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from math import inf
+from types import SimpleNamespace
+
+from apscheduler.events import (
+    EVENT_ALL_JOBS_REMOVED,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_MODIFIED,
+    EVENT_JOB_REMOVED,
+    EVENT_JOB_SUBMITTED,
+)
+
+from . import logger as pyrsched_logger
+
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")) for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value):
+    if value == inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def get(self):
+        return self._value
+
+    def samples(self, name, labels):
+        return [(f"{name}_total", labels, self._value)]
+
+
+class Gauge:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def get(self):
+        return self._value
+
+    def samples(self, name, labels):
+        return [(name, labels, self._value)]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self._sum = 0.0
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def get(self):
+        """ ``(count, sum)`` """
+        with self._lock:
+            return sum(self._counts), self._sum
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (inf, ), counts):
+            cumulative += count
+            samples.append((f"{name}_bucket", labels + (("le", _format_value(bound)), ), cumulative))
+        samples.append((f"{name}_count", labels, cumulative))
+        samples.append((f"{name}_sum", labels, total))
+        return samples
+
+
+class MetricFamily:
+    """ A metric with its labelled children. Children are created once and should be kept by the caller. """
+    def __init__(self, name, documentation, kind, factory, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = factory()
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} has the labels {self.labelnames}, got {values}")
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        result = []
+        for values, child in children:
+            result += child.samples(self.name, tuple(zip(self.labelnames, values)))
+        return result
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}
+        self._collectors = {}
+
+    def _family(self, name, documentation, kind, factory, labelnames):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = MetricFamily(name, documentation, kind, factory, labelnames)
+            return family
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._family(name, documentation, "counter", Counter, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._family(name, documentation, "gauge", Gauge, labelnames)
+
+    def histogram(self, name, documentation, buckets=DURATION_BUCKETS, labelnames=()):
+        return self._family(name, documentation, "histogram", functools.partial(Histogram, buckets), labelnames)
+
+    def set_collector(self, key, collector):
+        """ ``collector()`` is called on each scrape and returns metric families with current values.
+        A collector replaces the one previously set with the same key. """
+        with self._lock:
+            self._collectors[key] = collector
+
+    def collect(self):
+        with self._lock:
+            families = list(self._families.values())
+            collectors = list(self._collectors.values())
+        for collector in collectors:
+            try:
+                families += list(collector())
+            except Exception:
+                pyrsched_logger.getChild("metrics").exception("Metrics collector failed")
+        return families
+
+    def exposition(self):
+        """ all metrics in the Prometheus text format """
+        lines = []
+        for family in self.collect():
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for name, labels, value in family.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+RUN_DURATION = metrics.histogram("pyrsched_run_duration_seconds", "Duration of pipeline runs", DURATION_BUCKETS)
+RUNS = metrics.counter("pyrsched_runs", "Finished pipeline runs", ["result"])
+MISFIRES = metrics.counter("pyrsched_misfires", "Runs which were not started within their misfire grace time")
+COALESCED = metrics.counter("pyrsched_coalesced_runs", "Runs which were merged into a later run of the same job")
+LOG_LOCK_WAIT = metrics.histogram(
+    "pyrsched_log_lock_wait_seconds", "Time spent waiting for the lock of a pipeline log handler", LATENCY_BUCKETS
+)
+RPC_LATENCY = metrics.histogram(
+    "pyrsched_rpc_call_duration_seconds", "Duration of RPC calls", LATENCY_BUCKETS, ["method"]
+)
+
+# coalesced runs are counted when the metrics are collected, this bounds the backlog between scrapes
+MAX_PENDING_SUBMISSIONS = 10000
+
+
+class SchedulerMetrics:
+    """
+    Metrics of a scheduler and its executors.
+
+    Run durations come from the service's :class:`~pyrsched.server.history.RunHistory` via
+    ``observe_run``. Coalesced runs are the fire times of a job's trigger which were skipped between
+    two of its submissions, so submissions are only remembered in the scheduler thread and counted
+    when the metrics are scraped. The triggers of the jobs are looked up once and kept until the job
+    is changed or removed, or :meth:`forget_triggers` is called.
+    """
+    def __init__(self, scheduler, registry=metrics):
+        self._scheduler = scheduler
+        self._lock = threading.Lock()
+        self._last_run_times = {}  # job id -> last scheduled run time
+        self._triggers = {}  # job id -> trigger of a job which coalesces its runs, None if it does not
+        self._changes = 0  # jobs changed, a trigger looked up meanwhile may be outdated
+        self._submissions = deque(maxlen=MAX_PENDING_SUBMISSIONS)  # (job id, previous run time, run time)
+        self._run_results = (RUNS.labels("success"), RUNS.labels("error"))
+        self._misfires = MISFIRES.labels()
+        self._coalesced = COALESCED.labels()
+        self._run_duration = RUN_DURATION.labels()
+        scheduler.add_listener(self._on_submitted, EVENT_JOB_SUBMITTED)
+        scheduler.add_listener(lambda event: self._misfires.inc(), EVENT_JOB_MISSED)
+        scheduler.add_listener(self._on_changed, EVENT_JOB_MODIFIED | EVENT_JOB_REMOVED | EVENT_ALL_JOBS_REMOVED)
+        registry.set_collector("executors", self._collect_executors)
+        registry.set_collector("coalesced", self._collect_coalesced)
+
+    def observe_run(self, job_id, duration, error=None):
+        self._run_duration.observe(duration)
+        self._run_results[error is not None].inc()
+
+    def _on_submitted(self, event):
+        run_time = event.scheduled_run_times[0]
+        with self._lock:
+            previous = self._last_run_times.get(event.job_id)
+            self._last_run_times[event.job_id] = event.scheduled_run_times[-1]
+            if previous is not None:
+                self._submissions.append((event.job_id, previous, run_time))
+
+    def _on_changed(self, event):
+        with self._lock:
+            self._changes += 1
+            if event.code == EVENT_ALL_JOBS_REMOVED:
+                self._last_run_times.clear()
+                self._triggers.clear()
+                return
+            self._triggers.pop(event.job_id, None)
+            if event.code == EVENT_JOB_REMOVED:
+                self._last_run_times.pop(event.job_id, None)
+
+    def forget_triggers(self):
+        """ look up the triggers of the jobs again, e.g. after other nodes of a cluster changed them """
+        with self._lock:
+            self._changes += 1
+            self._triggers.clear()
+
+    def _trigger(self, job_id):
+        """ the trigger of a job which coalesces its runs, ``None`` if it does not or was removed """
+        with self._lock:
+            if job_id in self._triggers:
+                return self._triggers[job_id]
+            changes = self._changes
+        job = self._scheduler.get_job(job_id)
+        if job is None:
+            return None
+        trigger = job.trigger if job.coalesce else None
+        with self._lock:
+            if changes == self._changes:
+                self._triggers[job_id] = trigger
+        return trigger
+
+    def _collect_coalesced(self):
+        with self._lock:
+            submissions = list(self._submissions)
+            self._submissions.clear()
+        for job_id, previous, run_time in submissions:
+            trigger = self._trigger(job_id)
+            if trigger is None:
+                continue
+            fire_time = trigger.get_next_fire_time(previous, previous)
+            skipped = 0
+            while fire_time is not None and fire_time < run_time and skipped < MAX_PENDING_SUBMISSIONS:
+                skipped += 1
+                fire_time = trigger.get_next_fire_time(fire_time, fire_time)
+            if skipped:
+                self._coalesced.inc(skipped)
+        return []
+
+    def _collect_executors(self):
+        queued = MetricFamily("pyrsched_executor_queue_depth", "Submitted runs waiting for a worker", "gauge", Gauge, ["executor"])
+        busy = MetricFamily("pyrsched_executor_busy_workers", "Workers running a pipeline", "gauge", Gauge, ["executor"])
+        workers = MetricFamily("pyrsched_executor_workers", "Size of the executor's worker pool", "gauge", Gauge, ["executor"])
+        deferred = MetricFamily(
+            "pyrsched_executor_deferred_runs", "Runs waiting for capacity in their concurrency group", "gauge", Gauge, ["executor"]
+        )
+        for alias, executor in list(self._scheduler._executors.items()):
+            # the executor counts running instances per job from submission until the run has finished,
+            # runs held back by a concurrency group are counted as well
+            deferred_runs = getattr(executor, "deferred_runs", 0)
+            in_flight = sum(executor._instances.values()) - deferred_runs
+            deferred.labels(alias).set(deferred_runs)
+            max_workers = getattr(getattr(executor, "_pool", None), "_max_workers", None)
+            if max_workers is None:
+                max_workers = in_flight
+            workers.labels(alias).set(max_workers)
+            busy.labels(alias).set(min(in_flight, max_workers))
+            queued.labels(alias).set(max(in_flight - max_workers, 0))
+        return [queued, busy, workers, deferred]
+
+
+def instrument(service, histogram=RPC_LATENCY):
+    """ Wrap the public methods of ``service`` so that the duration of each call is measured.
+
+    The result has the same public methods, so it can be served in place of ``service``.
+    """
+    def timed(name, method):
+        observe = histogram.labels(name).observe
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                observe(time.perf_counter() - start)
+        return wrapper
+
+    methods = {
+        name: timed(name, getattr(service, name))
+        for name in dir(service)
+        if not name.startswith("_") and callable(getattr(service, name))
+    }
+    return SimpleNamespace(**methods)
@@ -0,0 +1,106 @@
+"""
+Cache for parsed pipeline definitions.
+
+This module is also a pypyr pipeline loader (it provides ``get_pipeline_definition``), so
+``job_function`` passes its name to pypyr and pypyr gets the definitions from the cache
+instead of reading and parsing the yaml file on every run.
+"""
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import pypyr.yaml
+from pypyr.pypeloaders.fileloader import get_pipeline_path
+
+from . import logger as pyrsched_logger
+
+logger = pyrsched_logger.getChild("pipelinecache")
+
+DEFAULT_CACHE_SIZE = 256
+
+
+def _forget_in_pypyr(pipeline_name):
+    # pypyr keeps its own, never invalidated copy of each pipeline by name
+    try:
+        from pypyr.cache.pipelinecache import pipeline_cache as pypyr_cache
+    except ImportError:  # pragma: no cover; older pypyr versions have no pipeline cache
+        return
+    with pypyr_cache._lock:
+        pypyr_cache._cache.pop(pipeline_name, None)
+
+
+class PipelineCache:
+    """
+    Size bounded LRU cache of parsed pipeline definitions, keyed by the path of the pipeline file.
+
+    An entry is valid as long as the modification time and size of its file did not change.
+    """
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # path -> (mtime_ns, size, definition)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def resize(self, max_size):
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self):
+        # called with self._lock held
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, pipeline_name, working_dir):
+        """ Return the definition of a pipeline and whether it was (re)loaded from disk. """
+        pipeline_path = get_pipeline_path(pipeline_name, Path(working_dir))
+        stat = pipeline_path.stat()
+        with self._lock:
+            entry = self._entries.get(pipeline_path)
+            if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+                self._entries.move_to_end(pipeline_path)
+                self.hits += 1
+                return entry[2], False
+            self.misses += 1
+
+        logger.debug(f"loading {pipeline_path}")
+        with open(pipeline_path) as yaml_file:
+            definition = pypyr.yaml.get_pipeline_yaml(yaml_file)
+
+        with self._lock:
+            self._entries[pipeline_path] = (stat.st_mtime_ns, stat.st_size, definition)
+            self._entries.move_to_end(pipeline_path)
+            self._evict()
+        return definition, True
+
+    def refresh(self, pipeline_name, working_dir):
+        """ Make sure pypyr runs the current version of the pipeline file. """
+        _, loaded = self.get(pipeline_name, working_dir)
+        if loaded:
+            _forget_in_pypyr(pipeline_name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+pipeline_cache = PipelineCache()
+
+
+def get_pipeline_definition(pipeline_name, working_dir):
+    """ pypyr loader interface, see ``pypyr.pypeloaders.fileloader`` """
+    definition, _ = pipeline_cache.get(pipeline_name, working_dir)
+    return definition
@@ -0,0 +1,101 @@
+"""
+Import the step modules of pipelines before the scheduler starts.
+
+pypyr imports the module of a step the first time a pipeline uses it, so without preloading the
+first run of each pipeline after a deploy pays for those imports. Preloading parses the pipelines
+(which also fills the pipeline cache), imports their steps and context parsers into pypyr's step
+cache, and adds the modules to the modules the fork server of the process pool imports, so that
+worker processes started afterwards have them loaded as well.
+"""
+import multiprocessing
+import time
+from pathlib import Path
+
+from . import logger as pyrsched_logger
+from .executors import PRELOAD_MODULES
+from .pipelinecache import pipeline_cache
+
+logger = pyrsched_logger.getChild("preload")
+
+PIPELINE_SUFFIX = ".yaml"
+
+
+def pipeline_names(pipeline_path):
+    """ the names of all pipelines below a directory, like pypyr names them (``sub/dir/name``) """
+    root = Path(pipeline_path)
+    return sorted(path.relative_to(root).with_suffix("").as_posix() for path in root.rglob(f"*{PIPELINE_SUFFIX}"))
+
+
+def step_names(definition):
+    """ the modules of all steps and the context parser of a parsed pipeline """
+    names = []
+    for key, group in definition.items():
+        if key == "context_parser" and isinstance(group, str):
+            names.append(group)
+        if not isinstance(group, list):
+            continue  # not a step group, e.g. the pipeline's metadata
+        for step in group:
+            name = step.get("name") if isinstance(step, dict) else step
+            if isinstance(name, str):
+                names.append(name)
+    return list(dict.fromkeys(names))
+
+
+def _import_step(name):
+    from pypyr.cache.stepcache import step_cache
+
+    step_cache.get_step(name)
+
+
+def _import_parser(name):
+    from pypyr.cache.parsercache import contextparser_cache
+
+    contextparser_cache.get_context_parser(name)
+
+
+def preload_pipelines(pipeline_path, names=None):
+    """ Parse pipelines and import their step modules.
+
+    Pipelines or steps which fail to load are logged and skipped, they fail again when they run.
+
+    :param pipeline_path: the directory of the pipelines, step modules in it can be imported as well
+    :param names: the pipelines to preload (default: all pipelines in ``pipeline_path``)
+    :return: ``{"pipelines": number preloaded, "modules": number imported, "errors": [messages], "seconds": duration}``
+    :rtype: dict
+    """
+    from pypyr.moduleloader import add_sys_path
+
+    start = time.perf_counter()
+    add_sys_path(Path(pipeline_path))
+    if names is None:
+        names = pipeline_names(pipeline_path)
+    modules, errors, preloaded = [], [], 0
+    for name in names:
+        try:
+            definition, _ = pipeline_cache.get(name, pipeline_path)
+        except Exception as exc:
+            errors.append(f"pipeline {name}: {exc!r}")
+            continue
+        preloaded += 1
+        for module in step_names(definition):
+            if module in modules:
+                continue
+            try:
+                if module == definition.get("context_parser"):
+                    _import_parser(module)
+                else:
+                    _import_step(module)
+            except Exception as exc:
+                errors.append(f"step {module} of pipeline {name}: {exc!r}")
+                continue
+            modules.append(module)
+
+    PRELOAD_MODULES.extend(module for module in modules if module not in PRELOAD_MODULES)
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        # takes effect if the fork server was not started yet, i.e. before the scheduler starts
+        multiprocessing.get_context("forkserver").set_forkserver_preload(PRELOAD_MODULES)
+    seconds = time.perf_counter() - start
+    for error in errors:
+        logger.warning(f"Preloading failed: {error}")
+    logger.info(f"Preloaded {preloaded} pipelines with {len(modules)} step modules in {seconds:.3f}s")
+    return {"pipelines": preloaded, "modules": len(modules), "errors": errors, "seconds": seconds}
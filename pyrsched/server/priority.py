@@ -0,0 +1,104 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Executor, Future
+
+DEFAULT_AGING = 60  # seconds after which a waiting run gains one priority level
+
+
+class PriorityThreadPool(Executor):
+    """
+    A thread pool which starts the waiting call with the highest priority first, instead of the oldest one.
+
+    Calls of the same priority start in the order they were submitted. To prevent starvation, a waiting
+    call gains one priority level every ``aging`` seconds. All waiting calls age at the same rate, so
+    ``priority + waited / aging`` orders them like ``submitted / aging - priority`` does, which is fixed
+    at submission: the queue is a plain heap and never has to be reordered.
+
+    :param max_workers: the maximum number of threads, started on demand
+    :param aging: seconds after which a waiting call gains one priority level (``None``: no aging)
+    :param thread_name_prefix: name prefix of the worker threads
+    """
+    def __init__(self, max_workers, aging=DEFAULT_AGING, thread_name_prefix="pyrsched-priority"):
+        if max_workers <= 0:
+            raise ValueError("max_workers must be greater than 0")
+        self._max_workers = max_workers
+        self.aging = aging
+        self._thread_name_prefix = thread_name_prefix
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (sort key, sequence number, future, fn, args, kwargs)
+        self._sequence = itertools.count()
+        self._threads = []
+        self._idle = 0  # waiting threads which were not notified yet
+        self._shutdown = False
+
+    def _sort_key(self, priority):
+        if not self.aging:
+            return -priority
+        return time.monotonic() / self.aging - priority
+
+    def submit(self, fn, /, *args, **kwargs):
+        return self.submit_prioritized(0, fn, *args, **kwargs)
+
+    def submit_prioritized(self, priority, fn, /, *args, **kwargs):
+        """ like ``submit``, calls with a higher ``priority`` start first """
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            heapq.heappush(self._queue, (self._sort_key(priority), next(self._sequence), future, fn, args, kwargs))
+            if self._idle:
+                self._idle -= 1
+                self._cond.notify()
+            elif len(self._threads) < self._max_workers:
+                thread = threading.Thread(
+                    target=self._work, name=f"{self._thread_name_prefix}_{len(self._threads)}", daemon=True
+                )
+                self._threads.append(thread)
+                thread.start()
+        return future
+
+    @property
+    def queue_depth(self):
+        """ the number of calls waiting for a thread """
+        with self._cond:
+            return len(self._queue)
+
+    def _next_call(self):
+        with self._cond:
+            while not self._queue:
+                if self._shutdown:
+                    return None
+                self._idle += 1
+                self._cond.wait()
+            return heapq.heappop(self._queue)[2:]
+
+    def _work(self):
+        while True:
+            call = self._next_call()
+            if call is None:
+                return
+            future, fn, args, kwargs = call
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as exc:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._cond:
+            self._shutdown = True
+            if cancel_futures:
+                for entry in self._queue:
+                    entry[2].cancel()
+                self._queue = []
+            self._idle = 0
+            self._cond.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for thread in threads:
+                thread.join()
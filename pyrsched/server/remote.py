@@ -0,0 +1,179 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, JobExecutionEvent
+from apscheduler.executors.base import BaseExecutor
+
+from .admission import AdmissionMixin
+from .concurrency import ConcurrencyGroupMixin
+from .history import time_events
+
+DEFAULT_LEASE_SECONDS = 300
+MAX_WAIT = 60  # seconds a worker may wait for runs in one call
+
+
+class RemoteRunError(Exception):
+    """ a run failed on a worker, or its worker was lost """
+
+
+class _RemoteRun:
+    def __init__(self, run_id, job, run_times):
+        self.run_id = run_id
+        self.job_id = job.id
+        self.jobstore = job._jobstore_alias
+        self.run_times = run_times
+        self.name = job.name
+        self.args = list(job.args)
+        self.kwargs = dict(job.kwargs)
+        self.worker_id = None
+        self.expires = None
+
+    def marshal(self):
+        return {
+            "run_id": self.run_id,
+            "job_id": self.job_id,
+            "name": self.name,
+            "args": self.args,
+            "kwargs": self.kwargs,
+            "run_times": [run_time.isoformat() for run_time in self.run_times],
+        }
+
+
+class RemoteWorkerExecutor(AdmissionMixin, ConcurrencyGroupMixin, BaseExecutor):
+    """
+    An executor which does not run jobs itself, but hands their runs to worker agents
+    (``pyrsched-worker``), which pull them over RPC in batches and report the results back.
+
+    A pulled run is leased to its worker for ``lease_seconds``. Workers renew the leases of their
+    runs with every call; the runs of a worker which does not renew them in time fail, they are not
+    handed out again because the pipeline may have run partly. Only jobs created by
+    :class:`~pyrsched.server.service.SchedulerService` can run on workers.
+
+    Plugin class: ``pyrsched.server.remote:RemoteWorkerExecutor``
+
+    :param lease_seconds: a worker which did not call for this long is considered lost
+    """
+    def __init__(self, lease_seconds=DEFAULT_LEASE_SECONDS):
+        super().__init__()
+        self.lease_seconds = float(lease_seconds)
+        self._runs_queued = None  # a condition of the lock of the executor, which is created by start()
+        self._queue = deque()  # runs waiting for a worker
+        self._leased = {}  # run id -> run
+        self._workers = {}  # worker id -> time of its last call
+        self._run_ids = itertools.count(1)
+        self._stopped = threading.Event()
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self._alias = alias
+        self._runs_queued = threading.Condition(self._lock)
+        self._stopped.clear()
+        self._reaper = threading.Thread(target=self._expire_leases_regularly, name="pyrsched-remote", daemon=True)
+        self._reaper.start()
+
+    def shutdown(self, wait=True):
+        self._stopped.set()
+        with self._lock:
+            self._runs_queued.notify_all()
+        super().shutdown(wait)
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    def _do_submit_job(self, job, run_times):
+        # called with self._lock held
+        self._queue.append(_RemoteRun(f"{self._alias}-{next(self._run_ids)}", job, run_times))
+        self._runs_queued.notify()
+
+    def pull(self, worker_id, max_runs=10, timeout=0):
+        """ Lease up to ``max_runs`` queued runs to a worker, waiting up to ``timeout`` seconds for the first one.
+
+        Renews the leases of the runs the worker already holds.
+        """
+        deadline = time.monotonic() + min(max(timeout, 0), MAX_WAIT)
+        with self._lock:
+            self._renew(worker_id)
+            while max_runs > 0 and not self._queue and not self._stopped.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._runs_queued.wait(remaining)
+            runs = [self._queue.popleft() for _ in range(min(max_runs, len(self._queue)))]
+            expires = time.monotonic() + self.lease_seconds
+            for run in runs:
+                run.worker_id, run.expires = worker_id, expires
+                self._leased[run.run_id] = run
+        if runs:
+            self._logger.debug(f"Worker {worker_id} pulled {len(runs)} runs")
+        return [run.marshal() for run in runs]
+
+    def report(self, worker_id, results):
+        """ Finish runs with the results of a worker.
+
+        :param results: ``[{"run_id", "error" (None if the run succeeded), "traceback", "started", "duration"}]``,
+            the start (unix timestamp) and duration (seconds) of the run on the worker are optional
+        """
+        finished = []
+        with self._lock:
+            self._renew(worker_id)
+            for result in results:
+                run = self._leased.pop(result["run_id"], None)
+                if run is None:
+                    # the lease expired, the run was already reported as failed
+                    self._logger.warning(f"Worker {worker_id} reported the unknown run {result['run_id']}")
+                    continue
+                finished.append((run, result))
+        for run, result in finished:
+            self._finish(run, result.get("error"), result.get("traceback"), result.get("started"), result.get("duration"))
+
+    def _renew(self, worker_id):
+        # called with self._lock held
+        self._workers[worker_id] = time.monotonic()
+        expires = time.monotonic() + self.lease_seconds
+        for run in self._leased.values():
+            if run.worker_id == worker_id:
+                run.expires = expires
+
+    def _finish(self, run, error=None, traceback=None, started=None, duration=None):
+        if error is None:
+            events = [JobExecutionEvent(EVENT_JOB_EXECUTED, run.job_id, run.jobstore, t) for t in run.run_times]
+        else:
+            self._logger.warning(f'Run {run.run_id} of job "{run.name}" failed on worker {run.worker_id}: {error}')
+            exception = RemoteRunError(error)
+            events = [
+                JobExecutionEvent(EVENT_JOB_ERROR, run.job_id, run.jobstore, t, exception=exception, traceback=traceback)
+                for t in run.run_times
+            ]
+        if duration is not None:
+            time_events(events, started, duration)
+        self._run_job_success(run.job_id, events)
+
+    def expire_leases(self):
+        """ fail the runs of workers which did not renew their leases in time """
+        now = time.monotonic()
+        with self._lock:
+            expired = [run for run in self._leased.values() if run.expires < now]
+            for run in expired:
+                del self._leased[run.run_id]
+            for worker_id, last_seen in list(self._workers.items()):
+                if now - last_seen > self.lease_seconds:
+                    del self._workers[worker_id]
+        for run in expired:
+            self._finish(run, f"worker {run.worker_id} was lost")
+
+    def _expire_leases_regularly(self):
+        while not self._stopped.wait(min(self.lease_seconds / 2, 5)):
+            try:
+                self.expire_leases()
+            except Exception:
+                self._logger.exception("Expiring the leases of remote runs failed")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": len(self._queue),
+                "leased": len(self._leased),
+                "workers": sorted(self._workers),
+            }
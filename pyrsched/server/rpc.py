@@ -0,0 +1,251 @@
+import asyncio
+import hmac
+import os
+import pickle
+import struct
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.managers import public_methods
+from traceback import format_exc
+
+from . import logger as pyrsched_logger
+
+# message constants of multiprocessing.connection's authentication
+CHALLENGE = b"#CHALLENGE#"
+WELCOME = b"#WELCOME#"
+FAILURE = b"#FAILURE#"
+CHALLENGE_DIGEST = "sha256"
+CHALLENGE_LENGTH = 40
+ALLOWED_DIGESTS = {b"md5", b"sha256", b"sha384", b"sha3_256", b"sha3_384"}
+MAX_AUTH_MESSAGE = 256
+
+
+def _split_digest(message):
+    """ b"{sha256}payload" -> ("sha256", b"payload"), legacy messages have no digest prefix and use md5 """
+    if message.startswith(b"{"):
+        end = message.find(b"}", 1, 20)
+        if end > 0 and message[1:end] in ALLOWED_DIGESTS:
+            return message[1:end].decode("ascii"), message[end + 1:]
+    return None, message
+
+
+def _create_response(authkey, message):
+    digest_name, _ = _split_digest(message)
+    if digest_name is None:
+        return hmac.new(authkey, message, "md5").digest()
+    mac = hmac.new(authkey, message, digest_name).digest()
+    return b"{%s}%s" % (digest_name.encode("ascii"), mac)
+
+
+def _verify_response(authkey, message, response):
+    digest_name, mac = _split_digest(response)
+    expected = hmac.new(authkey, message, digest_name or "md5").digest()
+    return hmac.compare_digest(expected, mac)
+
+
+class _Connection:
+    """ asyncio counterpart of ``multiprocessing.connection.Connection`` (length prefixed, pickled messages) """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def recv_bytes(self, maxlength=None):
+        size, = struct.unpack("!i", await self.reader.readexactly(4))
+        if size == -1:
+            size, = struct.unpack("!Q", await self.reader.readexactly(8))
+        if maxlength is not None and size > maxlength:
+            raise OSError("bad message length")
+        return await self.reader.readexactly(size)
+
+    async def send_bytes(self, buf):
+        n = len(buf)
+        header = struct.pack("!i", -1) + struct.pack("!Q", n) if n > 0x7fffffff else struct.pack("!i", n)
+        self.writer.write(header + buf)
+        await self.writer.drain()
+
+    async def recv(self):
+        return pickle.loads(await self.recv_bytes())
+
+    async def send(self, obj):
+        await self.send_bytes(pickle.dumps(obj))
+
+    async def deliver_challenge(self, authkey):
+        message = b"{%s}%s" % (CHALLENGE_DIGEST.encode("ascii"), os.urandom(CHALLENGE_LENGTH))
+        await self.send_bytes(CHALLENGE + message)
+        response = await self.recv_bytes(MAX_AUTH_MESSAGE)
+        if not _verify_response(authkey, message, response):
+            await self.send_bytes(FAILURE)
+            raise AuthenticationError("digest received was wrong")
+        await self.send_bytes(WELCOME)
+
+    async def answer_challenge(self, authkey):
+        message = await self.recv_bytes(MAX_AUTH_MESSAGE)
+        if not message.startswith(CHALLENGE):
+            raise AuthenticationError(f"Protocol error, expected challenge: {message!r}")
+        await self.send_bytes(_create_response(authkey, message[len(CHALLENGE):]))
+        if await self.recv_bytes(MAX_AUTH_MESSAGE) != WELCOME:
+            raise AuthenticationError("digest sent was rejected")
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+class AsyncRPCServer:
+    """
+    Serves the ``SchedulerService`` from a single asyncio event loop.
+
+    It speaks the wire protocol of ``multiprocessing.managers.BaseManager``, including the shared
+    secret handshake, so existing clients connect to it without changes. Connections are handled by
+    the event loop instead of one thread per connection; the service methods themselves run in a
+    small thread pool, because they may wait for the scheduler's job store lock. Methods marked with
+    a true ``long_poll`` attribute may wait for up to a minute, each call of them gets a thread of its
+    own, so that long-polling clients do not hold the threads of the pool.
+
+    :param service: the object to serve
+    :param typeid: the name clients use to get the service (``manager.<typeid>()``)
+    :param address: ``(host, port)`` to listen on
+    :param authkey: the shared secret (bytes)
+    :param workers: number of threads which run service methods
+    """
+    public = ["create", "accept_connection", "get_methods", "debug_info", "number_of_objects", "dummy", "incref", "decref"]
+
+    def __init__(self, service, typeid, address, authkey, workers=4, logger=None):
+        self._logger = logger.getChild("rpc") if logger else pyrsched_logger.getChild("rpc")
+        self.service = service
+        self.typeid = typeid
+        self.address = address
+        self.authkey = authkey
+        self.ident = "%x" % id(service)
+        self.exposed = tuple(public_methods(service))
+        self._executor = ThreadPoolExecutor(max_workers=int(workers), thread_name_prefix="pyrsched-rpc")
+        self._loop = None
+        self._server = None
+        self._stopped = None
+
+    async def _serve(self, ready=None):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        host, port = self.address
+        self._server = await asyncio.start_server(self._handle_connection, host or None, port)
+        self.address = self._server.sockets[0].getsockname()[:2]
+        self._logger.info(f"Serving RPC clients on {self.address}")
+        if ready is not None:
+            ready.set()
+        async with self._server:
+            await self._stopped.wait()
+        self._executor.shutdown(wait=False)
+
+    def serve_forever(self, ready=None):
+        """ Serve until ``shutdown()`` is called. ``ready`` (a ``threading.Event``) is set once the server listens. """
+        asyncio.run(self._serve(ready))
+
+    def shutdown(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    async def _call(self, function, *args, **kwds):
+        if getattr(function, "long_poll", False):
+            return await self._call_in_thread(function, *args, **kwds)
+        return await self._loop.run_in_executor(self._executor, lambda: function(*args, **kwds))
+
+    async def _call_in_thread(self, function, *args, **kwds):
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(function(*args, **kwds))
+            except BaseException as e:
+                future.set_exception(e)
+
+        # a daemon thread, a waiting call must not keep the process alive when the server stops
+        threading.Thread(target=run, name="pyrsched-rpc-poll", daemon=True).start()
+        return await asyncio.wrap_future(future)
+
+    async def _handle_connection(self, reader, writer):
+        conn = _Connection(reader, writer)
+        try:
+            await conn.deliver_challenge(self.authkey)
+            await conn.answer_challenge(self.authkey)
+            _, funcname, args, kwds = await conn.recv()
+            if funcname not in self.public:
+                raise ValueError(f"{funcname!r} unrecognized")
+            if funcname == "accept_connection":
+                await conn.send(("#RETURN", None))
+                await self._serve_client(conn)
+                return
+            msg = ("#RETURN", getattr(self, funcname)(*args, **kwds))
+        except (AuthenticationError, asyncio.IncompleteReadError, ConnectionError) as e:
+            self._logger.debug(f"Connection dropped: {e!r}")
+            await conn.close()
+            return
+        except Exception:
+            msg = ("#TRACEBACK", format_exc())
+
+        try:
+            await conn.send(msg)
+        except Exception:
+            await conn.send(("#TRACEBACK", format_exc()))
+        finally:
+            await conn.close()
+
+    async def _serve_client(self, conn):
+        """ Handle the method calls of one proxy until it disconnects. """
+        while True:
+            try:
+                ident, methodname, args, kwds = await conn.recv()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+
+            try:
+                if ident != self.ident:
+                    raise KeyError(ident)
+                if methodname in ("__str__", "__repr__"):
+                    msg = ("#RETURN", str(self.service) if methodname == "__str__" else repr(self.service))
+                elif methodname not in self.exposed:
+                    raise AttributeError(f"method {methodname!r} of {type(self.service)!r} object is not in exposed={self.exposed!r}")
+                else:
+                    try:
+                        msg = ("#RETURN", await self._call(getattr(self.service, methodname), *args, **kwds))
+                    except Exception as e:
+                        msg = ("#ERROR", e)
+            except Exception:
+                msg = ("#TRACEBACK", format_exc())
+
+            try:
+                try:
+                    await conn.send(msg)
+                except (pickle.PicklingError, TypeError, AttributeError):
+                    await conn.send(("#UNSERIALIZABLE", format_exc()))
+            except ConnectionError:
+                break
+        await conn.close()
+
+    # BaseManager server methods, there is only one shared object which lives as long as the server
+
+    def create(self, typeid, *args, **kwds):
+        if typeid != self.typeid:
+            raise KeyError(typeid)
+        return self.ident, self.exposed
+
+    def get_methods(self, token):
+        return self.exposed
+
+    def debug_info(self):
+        return f"  {self.ident}:       {str(self.service)[:75]}"
+
+    def number_of_objects(self):
+        return 1
+
+    def dummy(self):
+        pass
+
+    def incref(self, ident):
+        pass
+
+    def decref(self, ident):
+        pass
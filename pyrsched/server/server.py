@@ -10,6 +10,8 @@ from pathlib import Path
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from . import logger
+from .logging import handler_registry
+from .metrics import instrument
 from .service import SchedulerService
 from .utils import import_external
 
@@ -41,6 +43,9 @@ class ServerWrapper(object):
             self._scheduler.shutdown()
         except:
             pass
+        if getattr(self, "_metrics_server", None) is not None:
+            self._metrics_server.shutdown()
+        handler_registry.close()
 
     def start(self):  # pragma: no cover
         if self._logger.level <= logging.DEBUG:
@@ -51,21 +56,50 @@ class ServerWrapper(object):
         try:
             scheduler_config = deepcopy(self._config.apscheduler)
             scheduler = BackgroundScheduler(scheduler_config)
-
-            class SchedulerManager(BaseManager):
-                pass
+            self._scheduler = scheduler
 
             authkey = self._check_authkey()
             service = SchedulerService(
                 scheduler=scheduler, config=self._config, logger=self._logger
             )
-            SchedulerManager.register("scheduler", callable=lambda: service)
+            address = ("", self._config.pypyr.get("server_port", 12345))
+            # clients call the instrumented service, which measures the latency of each method
+            served = instrument(service)
 
-            manager = SchedulerManager(
-                address=("", self._config.pypyr.get("server_port", 12345)),
-                authkey=str(authkey).encode("utf-8"),
-            )
-            server = manager.get_server()
+            metrics_port = self._config.pypyr.get("metrics.port", None)
+            if metrics_port is not None:
+                # the http server is only imported when the metrics are served
+                from .exposition import MetricsServer, DEFAULT_HOST
+
+                self._metrics_server = MetricsServer(
+                    metrics_port, host=self._config.pypyr.get("metrics.host", DEFAULT_HOST)
+                ).start()
+                self._logger.info(f"Serving metrics on http://{self._metrics_server.address[0]}:{self._metrics_server.address[1]}/metrics")
+
+            if self._config.pypyr.get("rpc.asyncio", False):
+                # asyncio is only imported when it is used
+                from .rpc import AsyncRPCServer
+
+                server = AsyncRPCServer(
+                    served, "scheduler", address, str(authkey).encode("utf-8"),
+                    workers=self._config.pypyr.get("rpc.workers", 4), logger=self._logger,
+                )
+            else:
+                class SchedulerManager(BaseManager):
+                    pass
+
+                SchedulerManager.register("scheduler", callable=lambda: served)
+
+                manager = SchedulerManager(
+                    address=address,
+                    authkey=str(authkey).encode("utf-8"),
+                )
+                server = manager.get_server()
+
+            preload = self._config.pypyr.get("pipelines.preload", False)
+            if preload:
+                # before the scheduler starts, so that the first runs and the worker processes have the steps loaded
+                service.preload_pipelines(None if preload is True else list(preload))
 
             scheduler.start()
             server.serve_forever()
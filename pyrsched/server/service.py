@@ -1,26 +1,119 @@
+import functools
 import uuid
 import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from fnmatch import fnmatchcase
 from pathlib import Path
 
-import psutil
-
-from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.events import EVENT_JOB_ERROR
+from apscheduler.schedulers.base import STATE_RUNNING
 from apscheduler.jobstores.base import JobLookupError
+from apscheduler.util import convert_to_datetime
 from pypyr.pipelinerunner import main as pipeline_runner
 
-from .logging import PipelineLoggingContext
+from .changelog import JobChangeLog, DEFAULT_BUFFER_SIZE
+from .admission import DEFAULT_PRIORITY, PRIORITY_KWARG, admission_controller, job_priority
+from .concurrency import ConcurrencyGroupMixin, GROUP_KWARG, WEIGHT_KWARG, concurrency_groups
+from .dependencies import DependencyGraph
+from .executors import current_job_id
+from .history import RunHistory, DEFAULT_HISTORY_SIZE
+from .jobcache import DEFAULT_PUBLISH_INTERVAL, JobStateCache, decode_cursor, encode_cursor
+from .logging import PipelineLoggingContext, handler_registry
+from .metrics import SchedulerMetrics
+from .pipelinecache import pipeline_cache, DEFAULT_CACHE_SIZE
+from .preload import preload_pipelines
+from .spreading import aligned_start, phase, spread_offsets
+from .timeouts import PipelineTimeout, RunCancelled, killable_runs, timeout_kwargs
+from .triggers import DEFAULT_FIRE_TIMES, DependencyTrigger, make_trigger, marshal_trigger, next_fire_times
 
 NEW_JOB_MAX_INSTANCES = 1
+PIPELINE_LOADER = "pyrsched.server.pipelinecache"
+EXECUTION_MODES = ("thread", "process", "remote")
+MAX_HISTOGRAM_SECONDS = 3600
+# methods whose results clients can request in the binary wire format, see call_encoded
+ENCODED_METHODS = (
+    "get_job", "list_jobs", "query_jobs", "state", "get_changes", "upcoming_runs", "get_run_stats", "fire_histogram",
+)
+_KEEP = object()  # reschedule_job: keep the concurrency group of the job
+CHANGES_PUBLISH_TIMEOUT = 1  # seconds get_changes waits for the snapshot with the jobs of the changes
+
+
+def _publishes(method):
+    """ publish the job snapshot after a method which changes jobs, so that the client reads its own changes """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._job_cache.publish()
+    return wrapper
+
+
+def _long_poll(method):
+    """ mark a method which may wait for up to a minute, the asyncio RPC server runs it outside its thread pool """
+    method.long_poll = True
+    return method
+
+
+def _spreads(method):
+    """ Hold the spread lock while a method chooses start dates for interval jobs, changes the jobs and
+    publishes them, so that concurrent calls see each other's jobs and do not choose the same slots. """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._spread_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
-def job_function(pipeline_name, log_path, log_level, log_format, pipeline_path, sensitive_keys):
+
+def _spread_interval(job):
+    """ the interval of a job in a bulk request, ``None`` if the job has another trigger """
+    if not isinstance(job, dict) or any(job.get(key) is not None for key in ("cron", "run_date", "after")):
+        return None
+    return job.get("interval", 60)
+
+
+def _after_ids(after, added):
+    """ the upstream job ids of a job in a bulk request, an int refers to an earlier job of the request """
+    if after is None or isinstance(after, str):
+        return after
+    ids = []
+    for upstream in after:
+        if isinstance(upstream, int):
+            if not 0 <= upstream < len(added) - 1 or added[upstream] is None:
+                raise ValueError(f"'after' refers to job {upstream} of the request, which was not added before")
+            upstream = added[upstream]
+        ids.append(upstream)
+    return ids
+
+
+def job_function(pipeline_name, log_path, log_level, log_format, pipeline_path, sensitive_keys,
+                 concurrency_group=None, concurrency_weight=1, priority=DEFAULT_PRIORITY, timeout=None):
+    # concurrency_group and concurrency_weight are read by the executors, see pyrsched.server.concurrency,
+    # priority by the admission control, see pyrsched.server.admission
+    args = (pipeline_name, log_path, log_level, log_format, pipeline_path, sensitive_keys)
+    if timeout is None:
+        run_pipeline(*args)
+    else:
+        # a child process can be killed when it hangs, a thread can not, see pyrsched.server.timeouts
+        killable_runs.run(current_job_id.get() or pipeline_name, timeout, run_pipeline, args)
+
+
+def run_pipeline(pipeline_name, log_path, log_level, log_format, pipeline_path, sensitive_keys):
     logger = logging.getLogger("pypyr")
     log_filename = Path(log_path) / f"{pipeline_name}.log"
 
     with PipelineLoggingContext(logger, loglevel=log_level, log_format=log_format, log_filename=log_filename, sensitive_keys=sensitive_keys):
+        pipeline_cache.refresh(pipeline_name, pipeline_path)
         pipeline_runner(
-            pipeline_name, pipeline_context_input="", working_dir=Path(pipeline_path),
+            pipeline_name, pipeline_context_input="", working_dir=Path(pipeline_path), loader=PIPELINE_LOADER,
         )
 
+
 class SchedulerService(object):
     def __init__(self, scheduler=None, config=None, logger=None):
         self._logger = logger.getChild("service") if logger else logging.getLogger(
@@ -28,34 +121,186 @@ class SchedulerService(object):
         )
         self._config = config
         self._scheduler = scheduler
+        self._batch_lock = threading.Lock()
+        self._spread_lock = threading.Lock()
+        self._batches = 0
+        self._resume_after_batch = False
+        self._fire_time_count = self._config.pypyr.get("triggers.precomputed_fire_times", DEFAULT_FIRE_TIMES)
+        self._job_cache = JobStateCache(
+            scheduler, self._marshal_job, fire_times=self._next_fire_times, fire_time_count=self._fire_time_count,
+            publish_interval=self._config.pypyr.get("snapshot.publish_interval", DEFAULT_PUBLISH_INTERVAL),
+        )
+        # listeners are called in order, runs are recorded before clients are notified of them
+        self._metrics = SchedulerMetrics(scheduler)
+        self._history = RunHistory(
+            scheduler, self._config.pypyr.get("history.size", DEFAULT_HISTORY_SIZE), on_run=self._metrics.observe_run
+        )
+        self._changes = JobChangeLog(scheduler, self._config.pypyr.get("changes.buffer_size", DEFAULT_BUFFER_SIZE))
+        # downstream runs are submitted after the upstream run was recorded
+        self._dependencies = DependencyGraph(scheduler)
+        pipeline_cache.resize(self._config.pypyr.get("pipelines.cache_size", DEFAULT_CACHE_SIZE))
+        handler_registry.configure(
+            max_open=self._config.pypyr.get("pipelines.log_handlers.max_open", None),
+            use_queue=self._config.pypyr.get("pipelines.log_handlers.use_queue", None),
+        )
+        concurrency_groups.configure(self._config.pypyr.get("concurrency.groups", None))
+        for jobstore in self._cluster_jobstores():
+            # jobs can be changed by other nodes of the cluster without an event on this one
+            jobstore.add_change_listener(self._job_cache.invalidate_all)
+            jobstore.add_change_listener(self._dependencies.rebuild)
+            jobstore.add_change_listener(self._metrics.forget_triggers)
+        admission_controller.configure(
+            max_load=self._config.pypyr.get("admission.max_load", None),
+            max_memory_percent=self._config.pypyr.get("admission.max_memory_percent", None),
+            max_queue_depth=self._config.pypyr.get("admission.max_queue_depth", None),
+            protected_priority=self._config.pypyr.get("admission.protected_priority", 10),
+            shed_below_priority=self._config.pypyr.get("admission.shed_below_priority", 0),
+            max_delay=self._config.pypyr.get("admission.max_delay", 300),
+            recheck_interval=self._config.pypyr.get("admission.recheck_interval", 1),
+        )
+        self._aborted_runs = Counter()
+        scheduler.add_listener(self._count_aborted_run, EVENT_JOB_ERROR)
+
+    def _count_aborted_run(self, event):
+        if isinstance(event.exception, PipelineTimeout):
+            self._aborted_runs["timed_out"] += 1
+        elif isinstance(event.exception, RunCancelled):
+            self._aborted_runs["cancelled"] += 1
+
+    def _cluster_jobstores(self):
+        """ the job stores shared with other nodes (:class:`~pyrsched.server.cluster.ClusterJobStore`) """
+        return [store for store in self._scheduler._jobstores.values() if hasattr(store, "add_change_listener")]
 
-    def _marshal_job(self, job):
+    def _remote_executors(self):
+        """ ``{alias: executor}`` of the executors of remote workers (:class:`~pyrsched.server.remote.RemoteWorkerExecutor`) """
+        return {alias: executor for alias, executor in self._scheduler._executors.items() if hasattr(executor, "pull")}
+
+    def _next_fire_times(self, job):
+        return next_fire_times(job.trigger, job.next_run_time, self._fire_time_count)
+
+    def _marshal_job(self, job, fire_times=None):
         """ make a data structure which is able to be submitted over the RPC line"""
         marshalled_job = job.__getstate__()
+        # add an "is_running" flag
+        marshalled_job["is_running"] = marshalled_job["next_run_time"] is not None
         marshalled_job["next_run_time"] = (
             marshalled_job["next_run_time"].isoformat()
-            if marshalled_job["next_run_time"]
+            if marshalled_job["next_run_time"] and not isinstance(job.trigger, DependencyTrigger)
             else None
         )
 
-        # add an "is_running" flag
-        marshalled_job["is_running"] = marshalled_job["next_run_time"] is not None
-        trigger = job.trigger.__getstate__()
-        marshalled_job["trigger"] = {
-            "interval": trigger["interval"].total_seconds(),
-            "start_date": trigger["start_date"].isoformat()
-            if trigger["start_date"]
-            else None,
-            "timezone": str(trigger["timezone"]),
-        }
+        marshalled_job["trigger"] = marshal_trigger(job.trigger)
+        marshalled_job["priority"] = job_priority(job)
+        if fire_times is None:
+            fire_times = self._next_fire_times(job)
+        marshalled_job["next_run_times"] = [t.isoformat() for t in fire_times]
 
         return marshalled_job
 
-    def add_job(self, pipeline_name, interval=60):
-        self._logger.info(f"add_job({pipeline_name}, {interval})")
+    def _executor_alias(self, execution_mode):
+        """ map an execution mode to the alias of the executor configured for it """
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode '{execution_mode}', use one of {EXECUTION_MODES}")
+        if execution_mode == "process":
+            alias = self._config.pypyr.get("pipelines.process_executor", "processpool")
+        elif execution_mode == "remote":
+            alias = self._config.pypyr.get("pipelines.remote_executor", "remote")
+        else:
+            return "default"  # the scheduler adds a default executor if none is configured
+        if alias not in self._scheduler._executors:
+            # apscheduler would only fail at the first run, and remove the job
+            raise ValueError(f"The executor '{alias}' for execution mode '{execution_mode}' is not configured")
+        return alias
 
-        # ToDo: lookup if a job with the same name already exists and handle duplicate job names (suffix?)
+    def _remote_executor(self):
+        alias = self._executor_alias("remote")
+        executor = self._remote_executors().get(alias)
+        if executor is None:
+            raise ValueError(f"The executor '{alias}' for remote workers is not configured")
+        return executor
+
+    def _group_kwargs(self, executor, concurrency_group, weight):
+        """ the job kwargs which put a job into a concurrency group, checks the group and the executor """
+        if concurrency_group is None:
+            return {}
+        if concurrency_group not in concurrency_groups:
+            raise ValueError(f"Unknown concurrency group '{concurrency_group}'")
+        weight = int(weight)
+        if weight < 1:
+            raise ValueError(f"The weight of a job must be at least 1, got {weight}")
+        if not isinstance(self._scheduler._executors.get(executor), ConcurrencyGroupMixin):
+            raise ValueError(f"The executor '{executor}' does not support concurrency groups")
+        return {GROUP_KWARG: concurrency_group, WEIGHT_KWARG: weight}
+
+    def _trigger(self, interval=60, cron=None, run_date=None, jitter=None, start_date=None, after=None, job_id=None):
+        if after is not None:
+            return self._dependencies.make_trigger(after, job_id)
+        if jitter is None:
+            jitter = self._config.pypyr.get("triggers.jitter", None)
+        return make_trigger(
+            interval, cron, run_date, timezone=self._scheduler.timezone, jitter=jitter, start_date=start_date
+        )
+
+    def _start_dates(self, intervals):
+        """ Start dates for new interval jobs which spread them evenly over their interval.
+
+        :param intervals: the interval of each new job, ``None`` for jobs with another trigger
+        :return: one start date per entry of ``intervals`` (``None`` if it is not spread)
+        """
+        if not self._config.pypyr.get("triggers.spread_intervals", True):
+            return [None] * len(intervals)
+        wanted = {float(i) for i in intervals if i is not None}
+        phases = defaultdict(list)
+        for _, _, job in self._job_cache.entries():
+            trigger = job["trigger"]
+            if trigger["type"] == "interval" and trigger["interval"] in wanted and trigger["start_date"]:
+                start_date = datetime.fromisoformat(trigger["start_date"])
+                phases[trigger["interval"]].append(phase(start_date, trigger["interval"]))
+
+        counts = Counter(float(i) for i in intervals if i is not None)
+        offsets = {interval: iter(spread_offsets(interval, phases[interval], n)) for interval, n in counts.items()}
+        now = datetime.now(self._scheduler.timezone)
+        return [
+            aligned_start(next(offsets[float(i)]), float(i), now) if i is not None else None
+            for i in intervals
+        ]
+
+    @_spreads
+    @_publishes
+    def add_job(self, pipeline_name, interval=60, execution_mode="thread", concurrency_group=None, weight=1,
+                cron=None, run_date=None, jitter=None, priority=DEFAULT_PRIORITY, timeout=None, after=None):
+        """ Add a job which runs a pipeline periodically, or after other jobs.
 
+        Interval jobs are spread over their interval: their first run is offset so that jobs with
+        the same interval do not all run in the same second (unless ``triggers.spread_intervals`` is off).
+
+        :param pipeline_name: The name of the pipeline (without ``.yaml``)
+        :param interval: The interval between runs in seconds
+        :param cron: run at the times of a crontab expression (``"30 3 * * *"``) or a dict of apscheduler
+            ``CronTrigger`` fields instead of every ``interval`` seconds
+        :param run_date: run once at this time (ISO string or datetime) instead of every ``interval`` seconds
+        :param after: the id of a job or a list of job ids. The job has no schedule of its own, it runs as soon as
+            all of these jobs succeeded since its last run (see :mod:`pyrsched.server.dependencies`)
+        :param jitter: delay each run by a random number of up to ``jitter`` seconds (default: ``triggers.jitter``)
+        :param execution_mode: ``"thread"`` runs the pipeline in the scheduler's thread pool,
+            ``"process"`` in the pool of worker processes (see :class:`~pyrsched.server.executors.PipelineProcessPoolExecutor`)
+        :param concurrency_group: name of the concurrency group the job's runs count towards (see :meth:`set_concurrency_group`)
+        :param weight: how much of the group's capacity a run of the job takes
+        :param priority: while the server is overloaded, runs of jobs with a low priority are held back
+            or shed (see :class:`~pyrsched.server.admission.AdmissionController`)
+        :param timeout: kill a run of the job after this many seconds. Runs of jobs with a timeout execute the
+            pipeline in a child process, which can be killed (see :meth:`cancel_run`).
+        :return: the id of the new job
+        """
+        self._logger.info(f"add_job({pipeline_name}, {interval}, {execution_mode}, {concurrency_group})")
+        start_date, = self._start_dates([interval if cron is None and run_date is None and after is None else None])
+        return self._add_job(
+            pipeline_name, self._trigger(interval, cron, run_date, jitter, start_date, after), execution_mode,
+            self._job_settings(), concurrency_group, weight, priority, timeout,
+        )
+
+    def _job_settings(self):
+        """ settings from the config which are the same for all new jobs """
         formatters = self._config.log_config.get(
             "formatters",
             {
@@ -71,42 +316,87 @@ class SchedulerService(object):
         pipeline_path = str(
             Path(self._config.pypyr.get("pipelines.base_path", Path("pipelines"))).resolve()
         )
-
-        job = self._scheduler.add_job(
-            job_function,
-            id=str(uuid.uuid4()),
-            name=pipeline_name,
-            trigger=IntervalTrigger(seconds=interval),
-            next_run_time=None,
-            args=[pipeline_name,],
-            max_instances=NEW_JOB_MAX_INSTANCES,
-            misfire_grace_time=None,
-            coalesce=self._config.apscheduler.get("apscheduler.job_defaults.coalesce", False),
-            kwargs={
+        return {
+            "coalesce": self._config.apscheduler.get("apscheduler.job_defaults.coalesce", False),
+            "kwargs": {
                 "log_path": log_path,
                 "log_format": log_format,
                 "log_level": self._config.pypyr.get(
                     "pipelines.log_level", logging.WARNING
                 ),
-                "pipeline_path": pipeline_path, 
+                "pipeline_path": pipeline_path,
                 "sensitive_keys": self._config.pypyr.get(
                     "pipelines.sensitive_keywords", None
                 ),
             },
+        }
+
+    def _add_job(self, pipeline_name, trigger, execution_mode, settings, concurrency_group=None, weight=1,
+                 priority=DEFAULT_PRIORITY, timeout=None):
+        executor = self._executor_alias(execution_mode)
+        job_id = str(uuid.uuid4())
+        kwargs = dict(settings["kwargs"], **self._group_kwargs(executor, concurrency_group, weight))
+        if priority != DEFAULT_PRIORITY:
+            kwargs[PRIORITY_KWARG] = int(priority)
+        kwargs.update(timeout_kwargs(timeout))
+
+        # ToDo: lookup if a job with the same name already exists and handle duplicate job names (suffix?)
+
+        job = self._scheduler.add_job(
+            job_function,
+            id=job_id,
+            name=pipeline_name,
+            trigger=trigger,
+            next_run_time=None,
+            args=[pipeline_name,],
+            max_instances=NEW_JOB_MAX_INSTANCES,
+            executor=executor,
+            misfire_grace_time=None,
+            coalesce=settings["coalesce"],
+            kwargs=kwargs,
         )
+        # jobs added before the scheduler starts do not fire an event
+        self._job_cache.invalidate(job.id)
+        self._dependencies.update(job.id, job.trigger)
+        if job.pending:
+            self._changes.record("added", job.id)
 
         return job.id
 
-    def reschedule_job(self, job_id, interval=60):
+    @_spreads
+    @_publishes
+    def reschedule_job(self, job_id, interval=60, concurrency_group=_KEEP, weight=1, cron=None, run_date=None,
+                       jitter=None, after=None):
+        """ Change the interval of a job, or its cron expression, run date or upstream jobs (see :meth:`add_job`).
+
+        :param concurrency_group: move the job to another concurrency group, ``None`` removes it from its group.
+            If it is not given, the job stays in its group.
+        :param weight: the weight of the job in its new group
+        :return: the changed job or None if the job was not found in the jobstore
+        """
         self._logger.info(f"reschedule_job({job_id})")
-        trigger = IntervalTrigger(seconds=interval)
         try:
-            job = self._scheduler.reschedule_job(job_id, trigger=trigger)
+            start_date, = self._start_dates([interval if cron is None and run_date is None and after is None else None])
+            trigger = self._trigger(interval, cron, run_date, jitter, start_date, after, job_id)
+            job = self._reschedule_job(job_id, trigger, concurrency_group, weight)
         except JobLookupError as jle:
             self._logger.exception(jle, exc_info=False)
             return None
         return self._marshal_job(job)
 
+    def _reschedule_job(self, job_id, trigger, concurrency_group=_KEEP, weight=1):
+        if concurrency_group is not _KEEP:
+            job = self._scheduler.get_job(job_id)
+            if job is None:
+                raise JobLookupError(job_id)
+            kwargs = {k: v for k, v in job.kwargs.items() if k not in (GROUP_KWARG, WEIGHT_KWARG)}
+            kwargs.update(self._group_kwargs(job.executor, concurrency_group, weight))
+            self._scheduler.modify_job(job_id, kwargs=kwargs)
+        job = self._scheduler.reschedule_job(job_id, trigger=trigger)
+        self._dependencies.update(job.id, job.trigger)
+        return job
+
+    @_publishes
     def pause_job(self, job_id):
         self._logger.info(f"pause_job({job_id})")
         try:
@@ -116,6 +406,7 @@ class SchedulerService(object):
             return None
         return self._marshal_job(job)
 
+    @_publishes
     def start_job(self, job_id):
         """ Start a job. 
 
@@ -137,6 +428,7 @@ class SchedulerService(object):
             return None
         return self._marshal_job(job)
 
+    @_publishes
     def remove_job(self, job_id):
         self._logger.info(f"remove_job({job_id})")
         try:
@@ -144,24 +436,431 @@ class SchedulerService(object):
         finally:
             return None  # self._marshal_job(job_id)
 
+    @contextmanager
+    def _batch(self):
+        """ Hold back job processing while many jobs are changed, the scheduler wakes up once afterwards.
+
+        Job stores which support it (``SQLiteJobStore``) write all changes in one transaction.
+        """
+        with self._batch_lock:
+            if self._batches == 0:
+                self._resume_after_batch = self._scheduler.state == STATE_RUNNING
+                if self._resume_after_batch:
+                    self._scheduler.pause()
+            self._batches += 1
+        try:
+            with ExitStack() as stack:
+                # the snapshot publisher would wait for the job store locks of the batch
+                stack.enter_context(self._job_cache.held())
+                # the scheduler's job store lock before the store locks, in the order the scheduler takes them,
+                # so that a call of another thread can not hold it while it waits for a store of the batch
+                stack.enter_context(self._scheduler._jobstores_lock)
+                for jobstore in self._scheduler._jobstores.values():
+                    if hasattr(jobstore, "batch"):
+                        stack.enter_context(jobstore.batch())
+                yield
+        finally:
+            with self._batch_lock:
+                self._batches -= 1
+                if self._batches == 0 and self._resume_after_batch:
+                    self._scheduler.resume()
+
+    def _apply(self, operation, items):
+        """ run ``operation`` for each item, collecting results and errors per item """
+        results = []
+        with self._batch():
+            for item in items:
+                try:
+                    results.append({"result": operation(item), "error": None})
+                except JobLookupError:
+                    results.append({"result": None, "error": "job not found"})
+                except (KeyError, TypeError, ValueError) as e:
+                    results.append({"result": None, "error": repr(e)})
+        return results
+
+    @_spreads
+    @_publishes
+    def add_jobs(self, jobs):
+        """ Add many jobs at once.
+
+        :param jobs: list of dicts with the arguments of :meth:`add_job`
+            (``pipeline_name`` and optionally ``interval`` and ``execution_mode``). The ``after`` list of a job
+            may also contain the index of an earlier job in ``jobs``, so that a whole graph is added in one call.
+        :return: one ``{"result": job id, "error": None or message}`` per job, in the same order
+        :rtype: list
+        """
+        self._logger.info(f"add_jobs({len(jobs)} jobs)")
+        settings = self._job_settings()
+        start_dates = iter(self._start_dates([_spread_interval(job) for job in jobs]))
+        added = []  # the id of each job of the request so far, None if it was not added
+
+        def add(job):
+            added.append(None)
+            added[-1] = self._add_job(
+                job["pipeline_name"],
+                self._trigger(
+                    job.get("interval", 60), job.get("cron"), job.get("run_date"), job.get("jitter"), next(start_dates),
+                    _after_ids(job.get("after"), added),
+                ),
+                job.get("execution_mode", "thread"),
+                settings,
+                job.get("concurrency_group"),
+                job.get("weight", 1),
+                job.get("priority", DEFAULT_PRIORITY),
+                job.get("timeout"),
+            )
+            return added[-1]
+
+        return self._apply(add, jobs)
+
+    @_spreads
+    @_publishes
+    def reschedule_jobs(self, jobs):
+        """ Reschedule many jobs at once.
+
+        :param jobs: list of dicts with ``job_id`` and the other arguments of :meth:`reschedule_job`
+        :return: one ``{"result": marshalled job, "error": None or message}`` per job, in the same order
+        :rtype: list
+        """
+        self._logger.info(f"reschedule_jobs({len(jobs)} jobs)")
+        start_dates = iter(self._start_dates([_spread_interval(job) for job in jobs]))
+        return self._apply(
+            lambda job: self._marshal_job(
+                self._reschedule_job(
+                    job["job_id"],
+                    self._trigger(
+                        job.get("interval", 60), job.get("cron"), job.get("run_date"), job.get("jitter"),
+                        next(start_dates), job.get("after"), job["job_id"],
+                    ),
+                    job.get("concurrency_group", _KEEP),
+                    job.get("weight", 1),
+                )
+            ),
+            jobs,
+        )
+
+    @_publishes
+    def pause_jobs(self, job_ids):
+        """ Pause many jobs at once, see :meth:`add_jobs` for the result. """
+        self._logger.info(f"pause_jobs({len(job_ids)} jobs)")
+        return self._apply(lambda job_id: self._marshal_job(self._scheduler.pause_job(job_id)), job_ids)
+
+    @_publishes
+    def start_jobs(self, job_ids):
+        """ Start many jobs at once, see :meth:`add_jobs` for the result. """
+        self._logger.info(f"start_jobs({len(job_ids)} jobs)")
+        return self._apply(lambda job_id: self._marshal_job(self._scheduler.resume_job(job_id)), job_ids)
+
+    @_publishes
+    def remove_jobs(self, job_ids):
+        """ Remove many jobs at once, see :meth:`add_jobs` for the result. """
+        self._logger.info(f"remove_jobs({len(job_ids)} jobs)")
+        return self._apply(lambda job_id: self._scheduler.remove_job(job_id), job_ids)
+
+    def set_concurrency_group(self, name, capacity):
+        """ Create a concurrency group or change its capacity.
+
+        The runs of all jobs in a group together take at most ``capacity``, each run takes the
+        weight of its job. Runs which do not fit wait, without occupying a worker, until enough
+        runs of the group have finished.
+        """
+        self._logger.info(f"set_concurrency_group({name}, {capacity})")
+        concurrency_groups.set_capacity(name, capacity)
+        return concurrency_groups.stats()[name]
+
+    def remove_concurrency_group(self, name):
+        """ Remove an idle concurrency group. Jobs still assigned to it run without limit. """
+        self._logger.info(f"remove_concurrency_group({name})")
+        concurrency_groups.remove(name)
+
+    def get_concurrency_groups(self):
+        """ ``{name: {"capacity", "used", "waiting"}}`` of all concurrency groups """
+        return concurrency_groups.stats()
+
+    def preload_pipelines(self, names=None):
+        """ Import the step modules of pipelines, so that their first runs do not pay for the imports.
+
+        :param names: the pipelines to preload (default: all pipelines in ``pipelines.base_path``)
+        :return: the number of preloaded pipelines and imported modules and the errors,
+            see :func:`~pyrsched.server.preload.preload_pipelines`
+        :rtype: dict
+        """
+        self._logger.info(f"preload_pipelines({names})")
+        pipeline_path = Path(self._config.pypyr.get("pipelines.base_path", Path("pipelines"))).resolve()
+        return preload_pipelines(pipeline_path, names)
+
+    def cancel_run(self, job_id):
+        """ Kill the runs of a job which are in progress. They fail with ``RunCancelled``.
+
+        Only runs of jobs with a ``timeout`` (see :meth:`add_job`) which execute in the server's threads
+        can be cancelled, the pipelines of other runs can not be stopped from the outside.
+
+        :return: the number of cancelled runs
+        :rtype: int
+        """
+        self._logger.info(f"cancel_run({job_id})")
+        return killable_runs.cancel(job_id)
+
     def get_job(self, job_id):
         self._logger.info(f"get_job({job_id})")
-        job = self._scheduler.get_job(job_id)
-        return self._marshal_job(job) if job is not None else None
+        return self._job_cache.get(job_id)
+
+    def get_dependencies(self, job_id):
+        """ The dependencies of a job.
+
+        :return: ``{"after": upstream job ids, "waiting_for": upstream job ids which did not succeed since the
+            last run of the job, "downstream": ids of the jobs which run after it, "orphaned": True if all
+            upstream jobs of the job were removed, so that it never runs}``
+        :rtype: dict
+        """
+        self._logger.info(f"get_dependencies({job_id})")
+        return self._dependencies.dependencies(job_id)
+
+    @_long_poll
+    def pull_runs(self, worker_id, max_runs=10, timeout=0):
+        """ Hand due runs of jobs with ``execution_mode="remote"`` to a worker agent.
+
+        Waits up to ``timeout`` seconds (at most one minute) if no run is due. Each call renews the
+        leases of the runs the worker holds, see :class:`~pyrsched.server.remote.RemoteWorkerExecutor`.
+
+        :param worker_id: the id of the calling worker
+        :param max_runs: the maximum number of runs to return, ``0`` only renews the leases
+        :return: ``[{"run_id", "job_id", "name", "args", "kwargs", "run_times"}]``, the worker calls
+            ``job_function(*args, **kwargs)`` for each run
+        :rtype: list
+        """
+        self._logger.debug(f"pull_runs({worker_id}, {max_runs}, {timeout})")
+        return self._remote_executor().pull(worker_id, max_runs, timeout)
+
+    def report_runs(self, worker_id, results):
+        """ Report the results of runs a worker pulled with :meth:`pull_runs`.
+
+        :param results: ``[{"run_id", "error": None if the run succeeded, otherwise a message, "traceback",
+            "started", "duration"}]``, optionally with the start (unix timestamp) and duration (seconds) of the run
+        """
+        self._logger.debug(f"report_runs({worker_id}, {len(results)} results)")
+        self._remote_executor().report(worker_id, results)
+
+    def get_run_stats(self, job_id, include_runs=False):
+        """ Statistics of the recent runs of a job.
 
-    def list_jobs(self):
+        :param job_id: the id of the job
+        :param include_runs: also return the recorded runs (start timestamp, duration, success), oldest first
+        :return: ``None`` if the job does not exist, else a dict with the pipeline ``name``, the number of
+            recorded ``runs``, ``failures``, ``failure_rate``, ``mean``, ``p50``, ``p95`` and ``p99`` duration
+            in seconds, ``last_run``, ``last_error`` and ``last_error_time`` (unix timestamps)
+        :rtype: dict
+        """
+        self._logger.info(f"get_run_stats({job_id})")
+        job = self._job_cache.get(job_id)
+        if job is None:
+            return None
+        stats = dict(self._history.stats(job_id), id=job_id, name=job["name"])
+        if include_runs:
+            stats["run_history"] = self._history.runs(job_id)
+        return stats
+
+    def _select_jobs(self, name=None, running=None, next_run_from=None, next_run_until=None):
+        """ cached job entries which match all given filters, in job store order """
+        timezone = self._scheduler.timezone
+        next_run_from = convert_to_datetime(next_run_from, timezone, "next_run_from")
+        next_run_until = convert_to_datetime(next_run_until, timezone, "next_run_until")
+
+        selected = []
+        for entry in self._job_cache.entries():
+            _, next_run_time, job = entry
+            if name is not None and not fnmatchcase(job["name"], name):
+                continue
+            if running is not None and job["is_running"] != running:
+                continue
+            if next_run_from is not None and (next_run_time is None or next_run_time < next_run_from):
+                continue
+            if next_run_until is not None and (next_run_time is None or next_run_time > next_run_until):
+                continue
+            selected.append(entry)
+        return selected
+
+    def _project(self, job, fields):
+        if fields is None:
+            return job
+        return {k: v for k, v in job.items() if k == "id" or k in fields}
+
+    def list_jobs(self, name=None, running=None, next_run_from=None, next_run_until=None, fields=None):
+        """ List jobs, optionally filtered and reduced to some fields.
+
+        :param name: only jobs whose name matches this glob pattern (e.g. ``"backup_*"``)
+        :param running: only running (``True``) or paused (``False``) jobs
+        :param next_run_from: only jobs which run next at or after this time (datetime or ISO string)
+        :param next_run_until: only jobs which run next at or before this time (datetime or ISO string)
+        :param fields: only return these fields of each job, the ``id`` is always returned
+        :return: the marshalled jobs
+        :rtype: list
+        """
         self._logger.info(f"list_jobs()")
-        job_list = self._scheduler.get_jobs()
-        return [self._marshal_job(job) for job in job_list]
+        entries = self._select_jobs(name, running, next_run_from, next_run_until)
+        return [self._project(job, fields) for _, _, job in entries]
+
+    def query_jobs(self, name=None, running=None, next_run_from=None, next_run_until=None, fields=None,
+                   cursor=None, limit=100):
+        """ Like :meth:`list_jobs`, but returns at most ``limit`` jobs per call.
+
+        Pass the ``next_cursor`` of a result as ``cursor`` to get the following page.
+        Jobs are ordered by their next run time, so a job which is rescheduled between two calls
+        can be skipped or returned twice.
+
+        :return: ``{"jobs": [...], "next_cursor": str or None, "total": number of matching jobs}``
+        :rtype: dict
+        """
+        self._logger.info(f"query_jobs(cursor={cursor}, limit={limit})")
+        entries = self._select_jobs(name, running, next_run_from, next_run_until)
+        start = bisect_right([e[0] for e in entries], decode_cursor(cursor)) if cursor else 0
+        page = entries[start:start + limit]
+        has_more = start + limit < len(entries)
+        return {
+            "jobs": [self._project(job, fields) for _, _, job in page],
+            "next_cursor": encode_cursor(page[-1][0]) if page and has_more else None,
+            "total": len(entries),
+        }
+
+    def _upcoming(self, until):
+        """ ``(run time, marshalled job)`` of all runs up to ``until``, in order of their run time """
+        runs, incomplete = self._job_cache.upcoming(until)
+        if incomplete:
+            extended = set(incomplete)
+            runs = [run for run in runs if run[1]["id"] not in extended]
+            # from the snapshot as well, the scheduler is not asked
+            snapshot = self._job_cache.snapshot
+            for job_id in incomplete:
+                entry = snapshot.jobs.get(job_id)
+                if entry is not None:
+                    _, next_run_time, marshalled = entry
+                    fire_times = next_fire_times(snapshot.triggers[job_id], next_run_time, until=until)
+                    runs += [(t, marshalled) for t in fire_times]
+            runs.sort(key=lambda run: run[0])
+        return runs
+
+    def upcoming_runs(self, within=3600, name=None, limit=1000):
+        """ The runs of all running jobs in the next ``within`` seconds, in order of their run time.
+
+        Runs are taken from the fire times precomputed for each job (``triggers.precomputed_fire_times``),
+        only jobs which fire more often within the window are computed further.
+
+        :param within: length of the window in seconds
+        :param name: only jobs whose name matches this glob pattern
+        :param limit: return at most this many runs
+        :return: list of ``{"run_time": ISO string, "job_id": str, "name": str}``
+        :rtype: list
+        """
+        self._logger.info(f"upcoming_runs({within})")
+        runs = self._upcoming(datetime.now(self._scheduler.timezone) + timedelta(seconds=within))
+        result = []
+        for run_time, job in runs:
+            if name is not None and not fnmatchcase(job["name"], name):
+                continue
+            result.append({"run_time": run_time.isoformat(), "job_id": job["id"], "name": job["name"]})
+            if len(result) >= limit:
+                break
+        return result
+
+    def fire_histogram(self, within=60):
+        """ The number of runs per second in the next ``within`` seconds (at most one hour).
+
+        Jobs with the same interval are spread over it, so the counts should be about even.
+        Runs of jobs with jitter may be moved by up to the jitter.
+
+        :return: ``{"start": ISO string of the first second, "counts": [runs in each second]}``
+        :rtype: dict
+        """
+        self._logger.info(f"fire_histogram({within})")
+        within = max(1, min(int(within), MAX_HISTOGRAM_SECONDS))
+        start = datetime.now(self._scheduler.timezone).replace(microsecond=0)
+        counts = [0] * within
+        for run_time, _ in self._upcoming(start + timedelta(seconds=within)):
+            second = int((run_time - start).total_seconds())
+            if 0 <= second < within:
+                counts[second] += 1
+        return {"start": start.isoformat(), "counts": counts}
+
+    @_long_poll
+    def get_changes(self, since=0, timeout=0):
+        """ Get the changes of jobs and runs since a version.
+
+        Clients start with the ``version`` of :meth:`state` and then repeatedly ask for the changes
+        since the last ``version`` they got. With a ``timeout`` (seconds), the call waits for the next
+        change if there is none yet, so clients can long-poll instead of polling :meth:`state`.
+
+        Each change has a ``version``, a ``type`` (``added``, ``modified``, ``removed``, ``all_removed``,
+        ``run_started``, ``run_finished``, ``run_missed``), the ``job_id`` and the ``time`` it happened.
+        ``added`` and ``modified`` changes contain the current state of the job as ``job``.
+
+        :param since: the last version the client has seen
+        :param timeout: seconds to wait for changes (at most 60)
+        :return: ``{"version": int, "reset": bool, "changes": [...]}``, with ``reset`` set, changes were
+            lost and the client has to reload the full state
+        :rtype: dict
+        """
+        reset, version, changes = self._changes.since(since, timeout)
+        if changes:
+            # the jobs of the changes are taken from the snapshot, which is published shortly after a change
+            self._job_cache.wait_published(CHANGES_PUBLISH_TIMEOUT)
+        result = []
+        for change in changes:
+            if change["type"] in ("added", "modified"):
+                change = dict(change, job=self._job_cache.get(change["job_id"]))
+            result.append(change)
+        return {"version": version, "reset": reset, "changes": result}
 
     def state(self):
         self._logger.info("state()")
-        job_list = self._scheduler.get_jobs()
+        import psutil  # imported on first use, like by the admission control
+
+        version = self._changes.version
+        snapshot = self._job_cache.snapshot
+        job_list = [entry[2] for entry in snapshot.entries]
         state_obj = {
+            "version": version,
             "run_state": self._scheduler.state,
             "is_running": self._scheduler.running,
             "total_jobs": len(job_list),
-            "job_list": [self._marshal_job(job) for job in job_list],
+            "job_list": job_list,
+            "snapshot": {"version": snapshot.version, "age": time.monotonic() - snapshot.published},
             "cpu_load": psutil.getloadavg(),
+            "pipeline_cache": pipeline_cache.stats(),
+            "concurrency_groups": concurrency_groups.stats(),
+            "admission": admission_controller.stats(),
+            "timeouts": {
+                "running": killable_runs.running,
+                "timed_out": self._aborted_runs["timed_out"],
+                "cancelled": self._aborted_runs["cancelled"],
+            },
+            "dependencies": self._dependencies.stats(),
+            "cluster": [store.stats() for store in self._cluster_jobstores()],
+            "remote_workers": {alias: executor.stats() for alias, executor in self._remote_executors().items()},
         }
         return state_obj
+
+    def wire_formats(self):
+        """ the versions of the binary wire format (see :mod:`pyrsched.server.wire`) this server can encode """
+        from .wire import SUPPORTED_VERSIONS
+
+        return list(SUPPORTED_VERSIONS)
+
+    @_long_poll  # get_changes may wait
+    def call_encoded(self, method, version, *args, **kwargs):
+        """ Call one of the read methods (``ENCODED_METHODS``) and return its result in the binary wire format.
+
+        Job lists are much smaller than pickled ones: strings are sent once, the kwargs all jobs share
+        once per message and timestamps as integers. Decode the result with :func:`pyrsched.server.wire.decode`.
+
+        :param method: the name of the method, e.g. ``"list_jobs"``
+        :param version: the wire format version, one of :meth:`wire_formats`
+        :rtype: bytes
+        """
+        # the wire format is only imported when a client uses it
+        from .wire import SUPPORTED_VERSIONS, encode
+
+        if method not in ENCODED_METHODS:
+            raise ValueError(f"'{method}' can not be called encoded, use one of {ENCODED_METHODS}")
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported wire format version {version}, use one of {list(SUPPORTED_VERSIONS)}")
+        return encode(getattr(self, method)(*args, **kwargs), version)
@@ -0,0 +1,61 @@
+"""
+Start offsets which spread jobs with the same interval evenly over the interval.
+
+Without offsets, all jobs created at about the same time with the same interval fire at the same
+second. Each job gets the least used slot of its interval instead; among equally used slots the
+one furthest away from the used ones is taken first, so a half filled interval is still even.
+"""
+import math
+from itertools import cycle, islice
+from datetime import datetime
+
+MAX_SLOTS = 3600  # slots per interval, longer intervals get wider slots
+
+
+def _spread_order(slots):
+    """ slot numbers ordered so that each slot lies in the largest gap left by the ones before it
+
+    0, 4, 2, 6, 1, 5, 3, 7 for 8 slots: the bit reversed numbers of a power of two, without those
+    which are out of range.
+    """
+    bits = max(slots - 1, 0).bit_length()
+    for i in range(1 << bits):
+        slot = int(format(i, f"0{bits}b")[::-1], 2) if bits else 0
+        if slot < slots:
+            yield slot
+
+
+def phase(start_date, interval):
+    """ the offset within the interval at which a job with this start date fires """
+    return start_date.timestamp() % interval
+
+
+def spread_offsets(interval, phases, count, max_slots=MAX_SLOTS):
+    """ offsets (seconds within the interval) for ``count`` new jobs, given the phases of the existing jobs """
+    slots = max(1, min(int(math.ceil(interval)), max_slots))
+    width = interval / slots
+    if not phases:
+        return [slot * width for slot in islice(cycle(_spread_order(slots)), count)]
+
+    occupancy = [0] * slots
+    for p in phases:
+        occupancy[min(int(p // width), slots - 1)] += 1
+
+    offsets = []
+    level = min(occupancy)
+    while len(offsets) < count:
+        # fill the least used slots first, in spread order
+        for slot in _spread_order(slots):
+            if occupancy[slot] == level:
+                occupancy[slot] += 1
+                offsets.append(slot * width)
+                if len(offsets) == count:
+                    break
+        level += 1
+    return offsets
+
+
+def aligned_start(offset, interval, now):
+    """ the latest time before ``now`` which lies ``offset`` seconds into an interval (counted from the epoch) """
+    start = math.floor((now.timestamp() - offset) / interval) * interval + offset
+    return datetime.fromtimestamp(start, now.tzinfo)
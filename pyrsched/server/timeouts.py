@@ -0,0 +1,159 @@
+"""
+Runs of pipelines which can be killed when they exceed their timeout or are cancelled.
+
+A thread can not be stopped from the outside, so a run with a timeout executes the pipeline in a
+child process while the executor thread waits for it. When the timeout expires or the run is
+cancelled, the child process and all processes it started are killed, and the executor thread is
+free for the next run right away.
+"""
+import threading
+from collections import defaultdict
+
+from .executors import _default_context
+
+TIMEOUT_KWARG = "timeout"
+TERMINATE_GRACE = 1  # seconds a terminated pipeline gets to exit before it is killed
+
+
+class RunAborted(Exception):
+    """ a run was stopped before its pipeline finished """
+
+
+class PipelineTimeout(RunAborted):
+    """ a run exceeded the timeout of its job """
+
+
+class RunCancelled(RunAborted):
+    """ a run was cancelled with :meth:`~pyrsched.server.service.SchedulerService.cancel_run` """
+
+
+class PipelineRunError(Exception):
+    """ a pipeline failed in its child process with an exception which could not be passed back """
+
+
+def _run_in_child(conn, target, args):
+    try:
+        target(*args)
+    except BaseException as exc:
+        try:
+            conn.send(exc)
+        except Exception:
+            conn.send(PipelineRunError(repr(exc)))
+    else:
+        conn.send(None)
+    finally:
+        conn.close()
+
+
+class _KillableRun:
+    def __init__(self, process):
+        self.process = process
+        self.cancelled = False
+
+
+class KillableRuns:
+    """
+    The runs of this process which execute in child processes, by job id.
+
+    :param context: the multiprocessing context which starts the child processes
+        (default: the fork server of the process pool executor, which has pypyr imported already)
+    """
+    def __init__(self, context=None):
+        self._context = context
+        self._lock = threading.Lock()
+        self._runs = defaultdict(set)  # job id -> runs in progress
+
+    @property
+    def context(self):
+        if self._context is None:
+            self._context = _default_context()
+        return self._context
+
+    def run(self, job_id, timeout, target, args):
+        """ call ``target(*args)`` in a child process and wait for it, at most ``timeout`` seconds
+
+        :raises PipelineTimeout: the child process was killed because it ran longer than ``timeout``
+        :raises RunCancelled: the child process was killed by :meth:`cancel`
+        """
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=_run_in_child, args=(sender, target, args), name=f"pyrsched-run-{job_id}")
+        run = _KillableRun(process)
+        with self._lock:
+            process.start()
+            self._runs[job_id].add(run)
+        sender.close()
+        try:
+            process.join(timeout)
+            if process.is_alive():
+                self._kill(process)
+                raise PipelineTimeout(f"the pipeline did not finish within {timeout} seconds")
+            if run.cancelled:
+                raise RunCancelled("the run was cancelled")
+            try:
+                error = receiver.recv() if receiver.poll() else None
+            except EOFError:
+                error = None
+            if error is None and process.exitcode != 0:
+                error = PipelineRunError(f"the pipeline process exited with code {process.exitcode}")
+            if error is not None:
+                raise error
+        finally:
+            receiver.close()
+            with self._lock:
+                self._runs[job_id].discard(run)
+                if not self._runs[job_id]:
+                    del self._runs[job_id]
+
+    def cancel(self, job_id):
+        """ kill the runs of a job which are in progress, returns their number """
+        with self._lock:
+            runs = list(self._runs.get(job_id, ()))
+            for run in runs:
+                run.cancelled = True
+        for run in runs:
+            self._kill(run.process)
+        return len(runs)
+
+    def _kill(self, process):
+        """ terminate a child process and everything it started, kill whatever is left after a grace period """
+        import psutil  # only needed when a run is stopped
+
+        try:
+            descendants = psutil.Process(process.pid).children(recursive=True)
+        except psutil.NoSuchProcess:
+            descendants = []
+        process.terminate()
+        for descendant in descendants:
+            try:
+                descendant.terminate()
+            except psutil.NoSuchProcess:
+                pass
+        process.join(TERMINATE_GRACE)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        # the child was waited for by multiprocessing, the processes it started are not our children
+        _, alive = psutil.wait_procs(descendants, timeout=TERMINATE_GRACE)
+        for descendant in alive:
+            try:
+                descendant.kill()
+            except psutil.NoSuchProcess:
+                pass
+
+    @property
+    def running(self):
+        with self._lock:
+            return sum(len(runs) for runs in self._runs.values())
+
+
+killable_runs = KillableRuns()
+
+
+def timeout_kwargs(timeout):
+    """ the job kwargs which give a job a timeout """
+    if timeout is None:
+        return {}
+    timeout = float(timeout)
+    if timeout <= 0:
+        raise ValueError(f"The timeout of a job must be positive, got {timeout}")
+    return {TIMEOUT_KWARG: timeout}
@@ -0,0 +1,115 @@
+from datetime import datetime, timezone as dt_timezone
+
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.util import convert_to_datetime
+
+DEFAULT_FIRE_TIMES = 10  # fire times precomputed per job
+MAX_FIRE_TIMES = 10000  # upper bound for fire times computed on demand for a single job
+# the next run time of running jobs which only run after other jobs, the scheduler never reaches it
+NEVER = datetime(9000, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class DependencyTrigger(BaseTrigger):
+    """ The trigger of a job which runs after its upstream jobs, see :mod:`pyrsched.server.dependencies`.
+
+    It never fires by time: a running job has the next run time ``NEVER``, so that it can be paused
+    and started like any other job. Its ``timezone`` is always UTC, job stores convert the next run
+    time to the timezone of the trigger.
+    """
+    __slots__ = ("upstream", "timezone")
+
+    def __init__(self, upstream):
+        self.upstream = tuple(upstream)
+        self.timezone = dt_timezone.utc
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        return NEVER if previous_fire_time is None else None
+
+    def __getstate__(self):
+        return {"version": 2, "upstream": list(self.upstream), "timezone": self.timezone}
+
+    def __setstate__(self, state):
+        self.upstream = tuple(state["upstream"])
+        # version 1 had no timezone
+        self.timezone = state.get("timezone", dt_timezone.utc)
+
+    def __str__(self):
+        return f"after[{', '.join(self.upstream)}]"
+
+    def __repr__(self):
+        return f"<DependencyTrigger (upstream={list(self.upstream)!r})>"
+
+
+def make_trigger(interval=60, cron=None, run_date=None, timezone=None, jitter=None, start_date=None):
+    """ Build the trigger of a job.
+
+    :param interval: run every ``interval`` seconds, used if neither ``cron`` nor ``run_date`` is given
+    :param cron: run at the times of a crontab expression (``"*/5 * * * *"``) or of a dict with the
+        fields of apscheduler's ``CronTrigger`` (``{"hour": "3", "minute": "30"}``)
+    :param run_date: run once at this time (datetime or ISO string)
+    :param timezone: timezone of cron expressions and of dates without timezone
+    :param jitter: delay each run of an interval or cron job by a random number of up to ``jitter`` seconds
+    :param start_date: first run of an interval job, the following runs are aligned to it
+    """
+    if cron is not None and run_date is not None:
+        raise ValueError("A job has either a cron expression or a run date, not both")
+    if cron is not None:
+        if isinstance(cron, str):
+            trigger = CronTrigger.from_crontab(cron, timezone=timezone)
+            trigger.jitter = jitter
+            return trigger
+        return CronTrigger(timezone=timezone, jitter=jitter, **cron)
+    if run_date is not None:
+        return DateTrigger(run_date=convert_to_datetime(run_date, timezone, "run_date"), timezone=timezone)
+    return IntervalTrigger(seconds=interval, start_date=start_date, jitter=jitter)
+
+
+def marshal_trigger(trigger):
+    """ the trigger of a job as a data structure which can be sent over the RPC line """
+    if isinstance(trigger, IntervalTrigger):
+        return {
+            "type": "interval",
+            "interval": trigger.interval.total_seconds(),
+            "start_date": trigger.start_date.isoformat() if trigger.start_date else None,
+            "timezone": str(trigger.timezone),
+            "jitter": trigger.jitter,
+        }
+    if isinstance(trigger, CronTrigger):
+        return {
+            "type": "cron",
+            "fields": {field.name: str(field) for field in trigger.fields},
+            "start_date": trigger.start_date.isoformat() if trigger.start_date else None,
+            "end_date": trigger.end_date.isoformat() if trigger.end_date else None,
+            "timezone": str(trigger.timezone),
+            "jitter": trigger.jitter,
+        }
+    if isinstance(trigger, DateTrigger):
+        return {
+            "type": "date",
+            "run_date": trigger.run_date.isoformat(),
+            "timezone": str(trigger.run_date.tzinfo),
+        }
+    if isinstance(trigger, DependencyTrigger):
+        return {"type": "dependency", "after": list(trigger.upstream)}
+    return {"type": type(trigger).__name__, "description": str(trigger)}
+
+
+def next_fire_times(trigger, next_run_time, count=DEFAULT_FIRE_TIMES, until=None):
+    """ The next ``count`` fire times of a trigger, starting with ``next_run_time``.
+
+    With ``until``, fire times are computed up to that time instead (at most ``MAX_FIRE_TIMES``).
+    """
+    if next_run_time is None or isinstance(trigger, DependencyTrigger):
+        return ()
+    fire_times = [next_run_time]
+    limit = MAX_FIRE_TIMES if until is not None else count
+    fire_time = next_run_time
+    while len(fire_times) < limit:
+        fire_time = trigger.get_next_fire_time(fire_time, fire_time)
+        if fire_time is None or fire_time <= fire_times[-1] or (until is not None and fire_time > until):
+            break
+        fire_times.append(fire_time)
+    return tuple(fire_times)
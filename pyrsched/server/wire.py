@@ -0,0 +1,313 @@
+"""
+A compact, versioned binary encoding of RPC results, e.g. large job lists.
+
+A message starts with ``MAGIC`` and the version of the format, followed by three sections:
+
+* the string table: every distinct string (dict keys, ids, names, paths) is stored once and
+  referenced by its index everywhere else
+* the template table: the kwargs the server sets for all jobs alike (``SHARED_KWARGS``: log
+  path and format, pipeline path, ...) are stored once per distinct combination, a job refers to
+  its template and only carries the kwargs of its own (priority, concurrency group, ...)
+* the value itself, as tagged values with variable length integers
+
+ISO timestamps with a time zone offset (next run times, start dates) are sent as the difference
+in seconds to the previous timestamp of the message and decoded to the same ISO string, so the
+fire times of a job take a few bytes each. Job ids (UUIDs) are sent as 16 bytes, floats without a
+fraction as integers. :func:`decode` returns exactly the value that was encoded, so clients see
+the same data as with plain pickled results.
+
+Clients ask for the versions the server supports with ``wire_formats()`` and call
+``call_encoded(method, version, *args, **kwargs)`` with the newest version they know.
+"""
+import math
+import struct
+import uuid
+from datetime import datetime, timedelta, timezone
+
+MAGIC = b"PW"
+WIRE_FORMAT_VERSION = 1
+SUPPORTED_VERSIONS = (1, )
+# kwargs which are the same for all jobs added with the same settings, see SchedulerService._job_settings
+SHARED_KWARGS = ("log_path", "log_format", "log_level", "pipeline_path", "sensitive_keys")
+
+(NONE, FALSE, TRUE, INT, FLOAT, STR, LIST, TUPLE, DICT, TIMESTAMP, TIMESTAMP_MICROS, KWARGS, BYTES, UUID,
+ INTEGRAL_FLOAT) = range(15)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_DOUBLE = struct.Struct("!d")
+
+
+class WireFormatError(ValueError):
+    """ a message can not be decoded """
+
+
+def _write_varint(buffer, value):
+    while value > 0x7f:
+        buffer.append(value & 0x7f | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _write_signed(buffer, value):
+    # zigzag: small negative numbers stay short
+    _write_varint(buffer, value * 2 if value >= 0 else -value * 2 - 1)
+
+
+def _timestamp(text):
+    """ ``(epoch seconds, microseconds, utc offset seconds)`` of an ISO timestamp which decodes to the same text """
+    if not 19 <= len(text) <= 32 or text[10:11] != "T" or not text[:4].isdigit():
+        return None
+    try:
+        value = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if value.tzinfo is None:
+        return None
+    offset = value.utcoffset()
+    delta = value - EPOCH
+    encoded = delta.days * 86400 + delta.seconds, delta.microseconds, offset.days * 86400 + offset.seconds
+    return encoded if _format_timestamp(*encoded) == text else None
+
+
+def _format_timestamp(seconds, micros, offset):
+    utc = EPOCH + timedelta(seconds=seconds, microseconds=micros)
+    return utc.astimezone(timezone(timedelta(seconds=offset))).isoformat()
+
+
+def _uuid(text):
+    """ the 16 bytes of a UUID string in its canonical form, else ``None`` """
+    if len(text) != 36 or text[8] != "-" or text[23] != "-":
+        return None
+    try:
+        value = uuid.UUID(text)
+    except ValueError:
+        return None
+    return value.bytes if str(value) == text else None
+
+
+class _Encoder:
+    def __init__(self):
+        self.strings = {}  # string -> index
+        self.templates = {}  # encoded template -> index
+        self.last_timestamp = (0, 0)  # (epoch seconds, offset) of the previous timestamp
+
+    def string(self, buffer, text):
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.strings)
+        buffer.append(STR)
+        _write_varint(buffer, index)
+
+    def value(self, buffer, value):
+        # subclasses (e.g. of int or str) are encoded like their base class
+        for cls in type(value).__mro__:
+            write = _WRITERS.get(cls)
+            if write is not None:
+                write(self, buffer, value)
+                return
+        raise TypeError(f"Can not encode {type(value).__name__} values")
+
+    def none(self, buffer, value):
+        buffer.append(NONE)
+
+    def boolean(self, buffer, value):
+        buffer.append(TRUE if value else FALSE)
+
+    def integer(self, buffer, value):
+        buffer.append(INT)
+        _write_signed(buffer, value)
+
+    def float(self, buffer, value):
+        # -0.0 keeps its sign as a double
+        if value.is_integer() and abs(value) < 2 ** 53 and (value != 0 or math.copysign(1, value) > 0):
+            buffer.append(INTEGRAL_FLOAT)
+            _write_signed(buffer, int(value))
+        else:
+            buffer.append(FLOAT)
+            buffer += _DOUBLE.pack(value)
+
+    def sequence(self, buffer, value):
+        buffer.append(LIST if isinstance(value, list) else TUPLE)
+        _write_varint(buffer, len(value))
+        for item in value:
+            self.value(buffer, item)
+
+    def bytes(self, buffer, value):
+        buffer.append(BYTES)
+        _write_varint(buffer, len(value))
+        buffer += value
+
+    def text(self, buffer, value):
+        timestamp = _timestamp(value)
+        if timestamp is not None:
+            seconds, micros, offset = timestamp
+            buffer.append(TIMESTAMP_MICROS if micros else TIMESTAMP)
+            _write_signed(buffer, seconds - self.last_timestamp[0])
+            _write_signed(buffer, offset - self.last_timestamp[1])
+            if micros:
+                _write_varint(buffer, micros)
+            self.last_timestamp = (seconds, offset)
+            return
+        uuid_bytes = _uuid(value)
+        if uuid_bytes is not None:
+            buffer.append(UUID)
+            buffer += uuid_bytes
+            return
+        self.string(buffer, value)
+
+    def dict(self, buffer, value):
+        buffer.append(DICT)
+        _write_varint(buffer, len(value))
+        for key, item in value.items():
+            self.value(buffer, key)
+            if key == "kwargs" and isinstance(item, dict):
+                self.kwargs(buffer, item)
+            else:
+                self.value(buffer, item)
+
+    def kwargs(self, buffer, kwargs):
+        shared = {key: kwargs[key] for key in SHARED_KWARGS if key in kwargs}
+        # templates are decoded on their own, timestamps in them do not refer to the previous one
+        last_timestamp, self.last_timestamp = self.last_timestamp, (0, 0)
+        template = bytearray()
+        self.dict(template, shared)
+        template = bytes(template)
+        self.last_timestamp = last_timestamp
+        index = self.templates.get(template)
+        if index is None:
+            index = self.templates[template] = len(self.templates)
+        buffer.append(KWARGS)
+        _write_varint(buffer, index)
+        self.dict(buffer, {key: item for key, item in kwargs.items() if key not in shared})
+
+
+# how the encoder writes a value of a type
+_WRITERS = {
+    type(None): _Encoder.none,
+    bool: _Encoder.boolean,
+    int: _Encoder.integer,
+    float: _Encoder.float,
+    str: _Encoder.text,
+    dict: _Encoder.dict,
+    list: _Encoder.sequence,
+    tuple: _Encoder.sequence,
+    bytes: _Encoder.bytes,
+    bytearray: _Encoder.bytes,
+}
+
+
+def encode(value, version=WIRE_FORMAT_VERSION):
+    """ encode a result of the scheduler service (dicts, lists, strings, numbers, ...) """
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported wire format version {version}, use one of {SUPPORTED_VERSIONS}")
+    encoder = _Encoder()
+    body = bytearray()
+    encoder.value(body, value)
+
+    message = bytearray(MAGIC)
+    message.append(version)
+    _write_varint(message, len(encoder.strings))
+    for text in encoder.strings:
+        data = text.encode("utf-8")
+        _write_varint(message, len(data))
+        message += data
+    _write_varint(message, len(encoder.templates))
+    for template in encoder.templates:
+        _write_varint(message, len(template))
+        message += template
+    message += body
+    return bytes(message)
+
+
+class _Decoder:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.position = 0
+        self.strings = []
+        self.templates = []
+        self.last_timestamp = (0, 0)
+
+    def varint(self):
+        result = shift = 0
+        while True:
+            byte = self.data[self.position]
+            self.position += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def signed(self):
+        value = self.varint()
+        return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+    def raw(self, length):
+        start = self.position
+        self.position += length
+        if self.position > len(self.data):
+            raise IndexError("message too short")
+        return self.data[start:self.position]
+
+    def value(self):
+        tag = self.data[self.position]
+        self.position += 1
+        read = _READERS.get(tag)
+        if read is None:
+            raise WireFormatError(f"Unknown tag {tag} at position {self.position - 1}")
+        return read(self)
+
+    def timestamp(self, micros=False):
+        seconds = self.last_timestamp[0] + self.signed()
+        offset = self.last_timestamp[1] + self.signed()
+        self.last_timestamp = (seconds, offset)
+        return _format_timestamp(seconds, self.varint() if micros else 0, offset)
+
+    def kwargs(self):
+        template = self.templates[self.varint()]
+        # the values of the template are shared by all jobs which use it
+        kwargs = dict(template)
+        kwargs.update(self.value())
+        return kwargs
+
+
+# how the decoder reads the value after a tag
+_READERS = {
+    NONE: lambda decoder: None,
+    FALSE: lambda decoder: False,
+    TRUE: lambda decoder: True,
+    INT: _Decoder.signed,
+    FLOAT: lambda decoder: _DOUBLE.unpack(decoder.raw(8))[0],
+    STR: lambda decoder: decoder.strings[decoder.varint()],
+    LIST: lambda decoder: [decoder.value() for _ in range(decoder.varint())],
+    TUPLE: lambda decoder: tuple(decoder.value() for _ in range(decoder.varint())),
+    DICT: lambda decoder: {decoder.value(): decoder.value() for _ in range(decoder.varint())},
+    TIMESTAMP: _Decoder.timestamp,
+    TIMESTAMP_MICROS: lambda decoder: decoder.timestamp(micros=True),
+    KWARGS: _Decoder.kwargs,
+    BYTES: lambda decoder: bytes(decoder.raw(decoder.varint())),
+    UUID: lambda decoder: str(uuid.UUID(bytes=bytes(decoder.raw(16)))),
+    INTEGRAL_FLOAT: lambda decoder: float(decoder.signed()),
+}
+
+
+def decode(data):
+    """ decode a message of :func:`encode` """
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise WireFormatError("Not an encoded pyrsched message")
+    decoder = _Decoder(data)
+    decoder.position = len(MAGIC)
+    version = decoder.data[decoder.position]
+    decoder.position += 1
+    if version not in SUPPORTED_VERSIONS:
+        raise WireFormatError(f"Unsupported wire format version {version}, this client knows {SUPPORTED_VERSIONS}")
+    try:
+        decoder.strings = [str(decoder.raw(decoder.varint()), "utf-8") for _ in range(decoder.varint())]
+        templates = [decoder.raw(decoder.varint()) for _ in range(decoder.varint())]
+        body_start = decoder.position
+        for template in templates:
+            decoder.data, decoder.position, decoder.last_timestamp = template, 0, (0, 0)
+            decoder.templates.append(decoder.value())
+        decoder.last_timestamp = (0, 0)
+        decoder.data, decoder.position = memoryview(data), body_start
+        return decoder.value()
+    except (IndexError, KeyError) as exc:
+        raise WireFormatError(f"Truncated or corrupt message: {exc!r}") from exc
@@ -0,0 +1,137 @@
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from multiprocessing.managers import BaseManager
+from traceback import format_exc
+
+import click
+
+from . import logger as pyrsched_logger
+from .executors import current_job_id
+from .service import job_function
+
+DEFAULT_POLL_TIMEOUT = 30
+DEFAULT_HEARTBEAT_INTERVAL = 10
+
+
+def connect(address, authkey):
+    """ a proxy of the scheduler service of the server at ``address``, like the rpc client uses """
+    class SchedulerManager(BaseManager):
+        pass
+
+    SchedulerManager.register("scheduler")
+    manager = SchedulerManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.scheduler()
+
+
+class WorkerAgent:
+    """
+    Runs the pipelines of remote jobs (``add_job(..., execution_mode="remote")``) outside the server.
+
+    The agent pulls batches of due runs from the scheduler service, runs up to ``workers`` of them
+    at a time in threads and reports the results with its next call. ``job_function`` sets up the
+    pipeline log file and the masking of sensitive values on the worker, like it does in the server.
+
+    :param scheduler: the scheduler service, usually a proxy from :func:`connect`
+    :param worker_id: the id of this worker (default: host name and process id)
+    :param workers: the number of pipelines run at the same time
+    :param poll_timeout: seconds an idle agent waits for runs in one call
+    :param heartbeat_interval: seconds between calls while all threads are busy, to renew the leases of the runs
+    :param pipeline_path: the directory of the pipelines on this worker (default: the server's path)
+    :param log_path: the directory of the pipeline log files on this worker (default: the server's path)
+    """
+    def __init__(self, scheduler, worker_id=None, workers=4, poll_timeout=DEFAULT_POLL_TIMEOUT,
+                 heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL, pipeline_path=None, log_path=None, logger=None):
+        self._scheduler = scheduler
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.workers = workers
+        self.poll_timeout = poll_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.pipeline_path = pipeline_path
+        self.log_path = log_path
+        self._logger = logger or pyrsched_logger.getChild("worker")
+        self._running = set()  # futures of the runs in progress
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _execute(self, run):
+        kwargs = dict(run["kwargs"])
+        if self.pipeline_path is not None:
+            kwargs["pipeline_path"] = str(self.pipeline_path)
+        if self.log_path is not None:
+            kwargs["log_path"] = str(self.log_path)
+        self._logger.info(f"Running {run['name']} ({run['run_id']})")
+        result = {"run_id": run["run_id"], "error": None, "traceback": None, "started": time.time()}
+        start = time.perf_counter()
+        token = current_job_id.set(run["job_id"])
+        try:
+            job_function(*run["args"], **kwargs)
+        except BaseException as exc:
+            self._logger.warning(f"{run['name']} ({run['run_id']}) failed: {exc!r}")
+            result.update(error=repr(exc), traceback=format_exc())
+        finally:
+            current_job_id.reset(token)
+        result["duration"] = time.perf_counter() - start
+        return result
+
+    def _report_finished(self):
+        finished = [future for future in self._running if future.done()]
+        if finished:
+            self._running.difference_update(finished)
+            self._scheduler.report_runs(self.worker_id, [future.result() for future in finished])
+
+    def run_once(self, pool, timeout):
+        """ report finished runs, then pull new runs for the idle threads and start them """
+        self._report_finished()
+        runs = self._scheduler.pull_runs(self.worker_id, self.workers - len(self._running), timeout)
+        for run in runs:
+            self._running.add(pool.submit(self._execute, run))
+        return len(runs)
+
+    def run_forever(self):
+        self._logger.info(f"Worker {self.worker_id} started with {self.workers} threads")
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="pyrsched-worker") as pool:
+            while not self._stopped.is_set():
+                if self._running:
+                    # report as soon as a run has finished, renew the leases at least every heartbeat
+                    wait(self._running, timeout=self.heartbeat_interval, return_when=FIRST_COMPLETED)
+                    self.run_once(pool, 0)
+                else:
+                    self.run_once(pool, self.poll_timeout)
+            wait(self._running)
+            self._report_finished()
+        self._logger.info(f"Worker {self.worker_id} stopped")
+
+
+@click.command()
+@click.option("--host", default="localhost", help="host of the pyrsched server")
+@click.option("--port", default=12345, help="server_port of the pyrsched server")
+@click.option("--workers", default=4, help="number of pipelines run at the same time")
+@click.option("--worker-id", default=None, help="id of this worker (default: host name and process id)")
+@click.option("--pipeline-path", default=None, help="pipeline directory on this worker (default: the server's)")
+@click.option("--log-path", default=None, help="pipeline log directory on this worker (default: the server's)")
+def cli(host, port, workers, worker_id, pipeline_path, log_path):
+    authkey = os.environ.get("PYRSCHED_SECRET", None)
+    if not authkey:
+        raise click.UsageError("Set the shared secret of the server in the PYRSCHED_SECRET environment variable")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    click.echo(f"Connecting to the scheduler at {host}:{port}")
+    scheduler = connect((host, port), authkey.encode("utf-8"))
+    agent = WorkerAgent(
+        scheduler, worker_id=worker_id, workers=workers, pipeline_path=pipeline_path, log_path=log_path
+    )
+    try:
+        agent.run_forever()
+    except (KeyboardInterrupt, SystemExit, ConnectionError):
+        pyrsched_logger.info("Shutting down worker.")
+
+
+if __name__ == "__main__":
+    cli(prog_name="pyrsched-worker")
@@ -44,6 +44,11 @@ setup(
         "click",
         "pypyr",
     ],
+    entry_points={
+        'console_scripts': [
+            'pyrsched-worker=pyrsched.server.worker:cli',
+        ],
+    },
     setup_requires=['pytest-runner'],
     tests_require=['pytest'],
 )
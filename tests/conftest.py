@@ -1,7 +1,10 @@
+import copy
 import os
 import sys
+import time
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from datetime import datetime, timezone
 from pathlib import Path
 from types import SimpleNamespace
 
@@ -9,6 +12,25 @@ import pytest
 import yaml
 
 
+def wait_for(condition, timeout=30, interval=0.01):
+    """ poll ``condition`` until it is true, fail after ``timeout`` seconds """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(interval)
+
+
+def run_now(service, job_id):
+    """ run a job of a started service right away """
+    service._scheduler.modify_job(job_id, next_run_time=datetime.now(timezone.utc))
+
+
+def add_and_run(service, pipeline_name, **kwargs):
+    """ add an hourly job and run it right away """
+    job_id = service.add_job(pipeline_name, interval=3600, **kwargs)
+    run_now(service, job_id)
+    return job_id
+
 
 @pytest.fixture(scope="function")
 def temp_pipeline(tmp_path):
@@ -70,7 +92,7 @@ def apscheduler_config():
             'type': 'memory',
         },
         'apscheduler.executors.default': {
-            'class': 'apscheduler.executors.pool:ThreadPoolExecutor',
+            'class': 'pyrsched.server.executors:PriorityThreadPoolExecutor',
             'max_workers': '1'
         },
         'apscheduler.job_defaults.coalesce': 'false',
@@ -111,6 +133,21 @@ def scheduler_service(test_config):
     service = SchedulerService(scheduler=scheduler, config=test_config, logger=None)
     return service
 
+@pytest.fixture(scope="function")
+def running_service(test_config, tmp_path):
+    """ a started service which runs the pipelines of tests/testdata """
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from pyrsched.server.service import SchedulerService
+
+    config = copy.deepcopy(test_config)
+    config.pypyr["pipelines.base_path"] = "tests/testdata"
+    config.pypyr["pipelines.log_path"] = str(tmp_path)
+    scheduler = BackgroundScheduler(copy.deepcopy(config.apscheduler))
+    service = SchedulerService(scheduler=scheduler, config=config, logger=None)
+    scheduler.start()
+    yield service
+    scheduler.shutdown(wait=False)
+
 @pytest.fixture(scope="function")
 def scheduler_server():
     from pyrsched.server.server import ServerWrapper
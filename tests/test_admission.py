@@ -0,0 +1,119 @@
+import time
+
+import pytest
+from apscheduler.events import EVENT_JOB_MISSED
+from apscheduler.schedulers.background import BackgroundScheduler
+from conftest import wait_for
+
+from pyrsched.server.admission import ADMIT, DEFER, SHED, AdmissionController
+
+_started = []
+
+
+def tracked_run(name, priority=0):
+    _started.append(name)
+
+
+class FakeLoad(AdmissionController):
+    """ an admission controller with a load which the tests set """
+    load = 0.0
+    memory = 0.0
+
+    def _measure(self):
+        return self.load, self.memory
+
+
+@pytest.fixture(scope="function")
+def controller():
+    controller = FakeLoad()
+    controller.configure(max_load=1.0, max_memory_percent=90, recheck_interval=0)
+    return controller
+
+
+@pytest.fixture(scope="function")
+def admission_scheduler(monkeypatch, controller):
+    del _started[:]
+    monkeypatch.setattr("pyrsched.server.admission.AdmissionMixin.admission", controller)
+    scheduler = BackgroundScheduler({
+        "apscheduler.executors.default": {"class": "pyrsched.server.executors:ThreadPoolExecutor", "max_workers": "2"},
+    })
+    scheduler.start()
+    yield scheduler
+    scheduler.shutdown()
+
+
+class TestAdmissionController:
+    def test_disabled(self):
+        controller = AdmissionController()
+        assert not controller.enabled
+        assert controller.decide(-100) == ADMIT
+
+    def test_decide(self, controller):
+        assert controller.decide(-1) == ADMIT
+
+        controller.load = 2.0
+        assert controller.decide(-1) == SHED
+        assert controller.decide(0) == DEFER
+        # protected jobs run regardless of the load
+        assert controller.decide(10) == ADMIT
+
+        controller.load = 0.0
+        controller.memory = 95.0
+        assert controller.decide(0) == DEFER
+        assert controller.stats()["shed"] == 1
+        assert controller.stats()["deferred"] == 2
+
+    def test_queue_depth(self, controller):
+        controller.configure(max_queue_depth=5)
+        assert controller.overload(queue_depth=5) is None
+        assert "queue depth" in controller.overload(queue_depth=6)
+
+
+class TestAdmissionExecutor:
+    def test_held_until_load_drops(self, admission_scheduler, controller):
+        controller.load = 2.0
+        admission_scheduler.add_job(tracked_run, args=["held"])
+        wait_for(lambda: controller.stats()["held"] == 1)
+        time.sleep(0.1)
+        assert _started == []
+
+        controller.load = 0.5
+        wait_for(lambda: _started == ["held"])
+        assert controller.stats()["held"] == 0
+
+    def test_high_priority_first(self, admission_scheduler, controller):
+        controller.load = 2.0
+        admission_scheduler.add_job(tracked_run, args=["normal"])
+        admission_scheduler.add_job(tracked_run, args=["important"], kwargs={"priority": 5})
+        wait_for(lambda: controller.stats()["held"] == 2)
+
+        controller.load = 0.5
+        wait_for(lambda: len(_started) == 2)
+        assert _started == ["important", "normal"]
+
+    def test_shed(self, admission_scheduler, controller):
+        missed = []
+        admission_scheduler.add_listener(lambda event: missed.append(event.job_id), EVENT_JOB_MISSED)
+        controller.load = 2.0
+        low = admission_scheduler.add_job(tracked_run, args=["low"], kwargs={"priority": -1})
+        wait_for(lambda: missed == [low.id])
+
+        # held runs are shed after max_delay
+        controller.configure(max_load=1.0, max_delay=0.1, recheck_interval=0)
+        normal = admission_scheduler.add_job(tracked_run, args=["normal"])
+        wait_for(lambda: missed == [low.id, normal.id])
+        assert _started == []
+
+
+class TestServiceAdmission:
+    def test_priority(self, scheduler_service):
+        job_id = scheduler_service.add_job("testpipeline", priority=5)
+        assert scheduler_service.get_job(job_id)["kwargs"]["priority"] == 5
+        job_id = scheduler_service.add_job("testpipeline")
+        assert "priority" not in scheduler_service.get_job(job_id)["kwargs"]
+
+    def test_state(self, scheduler_service):
+        admission = scheduler_service.state()["admission"]
+        # no limits are configured in the tests
+        assert not admission["enabled"]
+        assert admission["held"] == 0
@@ -0,0 +1,209 @@
+import copy
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from apscheduler.schedulers.background import BackgroundScheduler
+from conftest import wait_for
+
+from pyrsched.server.cluster import ClusterJobStore, owner
+from pyrsched.server.jobstore import SQLiteJobStore
+from pyrsched.server.service import SchedulerService
+
+
+def record_run(log_path, job_id):
+    with open(log_path, "a") as log:
+        log.write(f"{job_id} {os.getpid()} {time.time()}\n")
+
+
+def run_node(path, node_id):
+    """ a scheduler node in its own process, it runs until it is terminated """
+    store = ClusterJobStore(path, node_id=node_id, lease_seconds=1, heartbeat_interval=0.2)
+    scheduler = BackgroundScheduler(jobstores={"default": store})
+    scheduler.start()
+    while True:
+        time.sleep(1)
+
+
+def members(path):
+    with sqlite3.connect(path) as conn:
+        try:
+            return {row[0] for row in conn.execute("SELECT id FROM nodes WHERE expires >= ?", (time.time(), ))}
+        except sqlite3.OperationalError:
+            return set()  # no node has created the table yet
+
+
+def read_runs(log_path):
+    runs = defaultdict(list)  # job id -> [(time, pid)]
+    if log_path.exists():
+        for line in log_path.read_text().splitlines():
+            job_id, pid, run_time = line.split()
+            runs[job_id].append((float(run_time), int(pid)))
+    return runs
+
+
+@pytest.fixture(scope="function")
+def cluster_store(tmp_path):
+    """ start nodes in this process, each with its own scheduler (paused) """
+    schedulers = []
+
+    def inner(node_id):
+        store = ClusterJobStore(tmp_path / "jobs.sqlite", node_id=node_id, lease_seconds=2, heartbeat_interval=0.5)
+        scheduler = BackgroundScheduler(jobstores={"default": store})
+        scheduler.start(paused=True)
+        schedulers.append(scheduler)
+        return store
+
+    yield inner
+    for scheduler in schedulers:
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+
+
+class TestOwner:
+    def test_rebalance_moves_only_the_jobs_of_the_node(self):
+        job_ids = [f"job_{i}" for i in range(300)]
+        before = {job_id: owner(job_id, ["a", "b", "c"]) for job_id in job_ids}
+        after = {job_id: owner(job_id, ["a", "b"]) for job_id in job_ids}
+
+        assert set(before.values()) == {"a", "b", "c"}
+        assert all(after[job_id] == before[job_id] for job_id in job_ids if before[job_id] != "c")
+        # about a third of the jobs each
+        assert all(60 < list(before.values()).count(node) < 140 for node in "abc")
+
+
+class TestClusterJobStore:
+    def test_membership(self, cluster_store):
+        first = cluster_store("first")
+        second = cluster_store("second")
+        first.heartbeat()
+        assert first.nodes == ("first", "second")
+        assert first.stats()["nodes"] == ["first", "second"]
+
+        # a node which stops leaves the cluster right away
+        second._scheduler.shutdown(wait=False)
+        first.heartbeat()
+        assert first.nodes == ("first", )
+
+    def test_run_is_claimed_once(self, cluster_store, monkeypatch):
+        first = cluster_store("first")
+        second = cluster_store("second")
+        first.heartbeat()
+        job = first._scheduler.add_job(record_run, "interval", seconds=60, args=["log", "job"], id="job")
+        now = datetime.now(timezone.utc) + timedelta(seconds=61)
+        assert job.next_run_time <= now
+
+        # both nodes believe they own the job, e.g. while a node joins
+        monkeypatch.setattr(ClusterJobStore, "owns", lambda self, job_id: True)
+        assert [job.id for job in first.get_due_jobs(now)] == ["job"]
+        assert second.get_due_jobs(now) == []
+        assert second.get_next_run_time() is None
+
+    def test_concurrent_claimers(self, cluster_store, monkeypatch):
+        stores = [cluster_store(f"node_{i}") for i in range(4)]
+        with stores[0].batch():
+            for i in range(200):
+                stores[0]._scheduler.add_job(record_run, "interval", seconds=60, args=["log", i], id=f"job_{i}")
+        for store in stores:
+            store.heartbeat()
+        monkeypatch.setattr(ClusterJobStore, "owns", lambda self, job_id: True)
+
+        # all nodes look for due runs at the same time, each run is claimed by exactly one of them
+        for round in range(5):
+            now = datetime.now(timezone.utc) + timedelta(seconds=61 + 60 * round)
+            barrier = threading.Barrier(len(stores))
+
+            def claim(store):
+                barrier.wait()
+                jobs = store.get_due_jobs(now)
+                for job in jobs:
+                    job._modify(next_run_time=job.trigger.get_next_fire_time(job.next_run_time, now))
+                    store.update_job(job)
+                return [job.id for job in jobs]
+
+            with ThreadPoolExecutor(len(stores)) as pool:
+                claimed = [job_id for job_ids in pool.map(claim, stores) for job_id in job_ids]
+            assert sorted(claimed) == sorted(f"job_{i}" for i in range(200))
+
+    def test_claims_of_dead_nodes_are_void(self, cluster_store, monkeypatch):
+        first = cluster_store("first")
+        second = cluster_store("second")
+        first._scheduler.add_job(record_run, "interval", seconds=60, args=["log", "job"], id="job")
+        now = datetime.now(timezone.utc) + timedelta(seconds=61)
+        monkeypatch.setattr(ClusterJobStore, "owns", lambda self, job_id: True)
+        assert len(first.get_due_jobs(now)) == 1
+
+        # the first node died after it claimed the run
+        first._stopped.set()
+        first._conn.execute("UPDATE nodes SET expires = 0 WHERE id = 'first'")
+        second.heartbeat()
+        assert [job.id for job in second.get_due_jobs(now)] == ["job"]
+
+
+class TestClusterProcesses:
+    def test_partition_and_failover(self, tmp_path):
+        path = str(tmp_path / "jobs.sqlite")
+        log_path = tmp_path / "runs.log"
+        context = multiprocessing.get_context("spawn")
+        nodes = [context.Process(target=run_node, args=(path, f"node_{i}"), daemon=True) for i in range(3)]
+        for node in nodes:
+            node.start()
+        try:
+            wait_for(lambda: len(members(path)) == 3, interval=0.05)
+
+            # jobs can be added through any process which uses the database
+            scheduler = BackgroundScheduler(jobstores={"default": SQLiteJobStore(path)})
+            scheduler.start(paused=True)
+            for i in range(12):
+                scheduler.add_job(record_run, "interval", seconds=1, args=[str(log_path), f"job_{i}"], id=f"job_{i}")
+            scheduler.shutdown()
+
+            wait_for(lambda: len(read_runs(log_path)) == 12 and min(map(len, read_runs(log_path).values())) >= 2, interval=0.05)
+            runs = read_runs(log_path)
+            # each job runs on one node, the jobs are spread over all nodes
+            assert all(len({pid for _, pid in job_runs}) == 1 for job_runs in runs.values())
+            assert {job_runs[0][1] for job_runs in runs.values()} == {node.pid for node in nodes}
+
+            dead = nodes[0]
+            dead.terminate()
+            dead.join()
+            killed_at = time.time()
+            orphans = [job_id for job_id, job_runs in runs.items() if job_runs[0][1] == dead.pid]
+
+            # once the lease of the dead node has expired, its jobs run on the other nodes
+            wait_for(lambda: all(
+                any(pid != dead.pid and t > killed_at for t, pid in read_runs(log_path)[job_id]) for job_id in orphans
+            ), interval=0.05)
+            for job_runs in read_runs(log_path).values():
+                times = sorted(t for t, _ in job_runs)
+                # no run was executed twice
+                assert all(later - earlier > 0.5 for earlier, later in zip(times, times[1:]))
+        finally:
+            for node in nodes:
+                node.terminate()
+                node.join()
+
+
+class TestServiceCluster:
+    def test_state(self, test_config, tmp_path):
+        config = copy.deepcopy(test_config)
+        config.apscheduler["apscheduler.jobstores.default"] = {
+            "class": "pyrsched.server.cluster:ClusterJobStore",
+            "path": str(tmp_path / "jobs.sqlite"),
+            "node_id": "service_node",
+        }
+        scheduler = BackgroundScheduler(copy.deepcopy(config.apscheduler))
+        service = SchedulerService(scheduler=scheduler, config=config, logger=None)
+        scheduler.start(paused=True)
+        try:
+            job_id = service.add_job("testpipeline")
+            assert service.state()["cluster"] == [{"node_id": "service_node", "nodes": ["service_node"], "owned_jobs": 1}]
+            assert service.get_job(job_id)["name"] == "testpipeline"
+        finally:
+            scheduler.shutdown()
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+from apscheduler.schedulers.background import BackgroundScheduler
+from conftest import wait_for
+
+from pyrsched.server.concurrency import ConcurrencyGroups, concurrency_groups
+
+_lock = threading.Lock()
+_running = {}
+_max_running = {}
+_started = []
+
+
+def tracked_run(name, concurrency_group=None, concurrency_weight=1):
+    key = concurrency_group or name
+    with _lock:
+        _started.append(name)
+        _running[key] = _running.get(key, 0) + concurrency_weight
+        _max_running[key] = max(_max_running.get(key, 0), _running[key])
+    time.sleep(0.2)
+    with _lock:
+        _running[key] -= concurrency_weight
+
+
+@pytest.fixture(scope="function")
+def group_scheduler():
+    _running.clear()
+    _max_running.clear()
+    del _started[:]
+    scheduler = BackgroundScheduler({
+        "apscheduler.executors.default": {"class": "pyrsched.server.executors:ThreadPoolExecutor", "max_workers": "2"},
+    })
+    scheduler.start()
+    yield scheduler
+    scheduler.shutdown()
+    concurrency_groups.remove("test_db")
+
+
+class TestConcurrencyGroups:
+    def test_acquire_release(self):
+        groups = ConcurrencyGroups()
+        groups.set_capacity("db", 3)
+        calls = []
+
+        assert groups.acquire("db", 2, lambda: calls.append("a"))
+        assert not groups.acquire("db", 2, lambda: calls.append("b"))
+        # queued runs keep their order, a small run does not overtake a big one
+        assert not groups.acquire("db", 1, lambda: calls.append("c"))
+        assert calls == ["a"]
+        assert groups.stats()["db"] == {"capacity": 3, "used": 2, "waiting": 2}
+
+        groups.release("db", 2)
+        assert calls == ["a", "b", "c"]
+        assert groups.stats()["db"] == {"capacity": 3, "used": 3, "waiting": 0}
+
+    def test_resize(self):
+        groups = ConcurrencyGroups()
+        groups.set_capacity("db", 1)
+        calls = []
+        groups.acquire("db", 1, lambda: calls.append("a"))
+        groups.acquire("db", 1, lambda: calls.append("b"))
+
+        groups.set_capacity("db", 2)
+        assert calls == ["a", "b"]
+        with pytest.raises(ValueError):
+            groups.remove("db")
+        with pytest.raises(ValueError):
+            groups.set_capacity("db", 0)
+
+    def test_weight_above_capacity(self):
+        groups = ConcurrencyGroups()
+        groups.set_capacity("db", 2)
+        calls = []
+        assert groups.acquire("db", 5, lambda: calls.append("big"))
+        assert not groups.acquire("db", 1, lambda: calls.append("small"))
+        groups.release("db", 5)
+        assert calls == ["big", "small"]
+
+    def test_unknown_group(self):
+        calls = []
+        assert ConcurrencyGroups().acquire("unknown", 1, lambda: calls.append("a"))
+        assert calls == ["a"]
+
+
+class TestGroupExecutor:
+    def test_group_limit(self, group_scheduler):
+        concurrency_groups.set_capacity("test_db", 1)
+        for i in range(3):
+            group_scheduler.add_job(tracked_run, args=[f"grouped_{i}"], kwargs={"concurrency_group": "test_db"})
+        group_scheduler.add_job(tracked_run, args=["free"])
+
+        wait_for(lambda: len(_started) == 4)
+        # the deferred runs did not occupy the second worker, the free job ran next to the group
+        assert _started.index("free") < 2
+        assert _max_running["test_db"] == 1
+        wait_for(lambda: concurrency_groups.stats()["test_db"]["used"] == 0)
+
+    def test_deferred_runs_count_as_instances(self, group_scheduler):
+        concurrency_groups.set_capacity("test_db", 1)
+        group_scheduler.add_job(tracked_run, args=["first"], kwargs={"concurrency_group": "test_db"})
+        wait_for(lambda: _started == ["first"])
+
+        job = group_scheduler.add_job(tracked_run, args=["second"], kwargs={"concurrency_group": "test_db"})
+        executor = group_scheduler._lookup_executor("default")
+        wait_for(lambda: executor.deferred_runs == 1 or "second" in _started)
+        wait_for(lambda: "second" in _started)
+        assert executor.deferred_runs == 0
+        wait_for(lambda: not executor._instances)
+        assert group_scheduler.get_job(job.id) is None
@@ -0,0 +1,183 @@
+import copy
+from types import SimpleNamespace
+
+import pytest
+from apscheduler.schedulers.background import BackgroundScheduler
+from conftest import run_now, wait_for
+
+from pyrsched.server.service import SchedulerService
+
+
+@pytest.fixture(scope="function")
+def cluster_services(test_config, tmp_path):
+    """ services of two nodes (paused) which share one job set """
+    schedulers = []
+
+    def inner(node_id):
+        config = copy.deepcopy(test_config)
+        config.apscheduler["apscheduler.jobstores.default"] = {
+            "class": "pyrsched.server.cluster:ClusterJobStore",
+            "path": str(tmp_path / "jobs.sqlite"),
+            "node_id": node_id,
+        }
+        scheduler = BackgroundScheduler(copy.deepcopy(config.apscheduler))
+        service = SchedulerService(scheduler=scheduler, config=config, logger=None)
+        scheduler.start(paused=True)
+        schedulers.append(scheduler)
+        return service
+
+    yield inner
+    for scheduler in schedulers:
+        scheduler.shutdown(wait=False)
+
+
+def runs(service, job_id):
+    return service.get_run_stats(job_id)["runs"]
+
+
+class TestDependencies:
+    def test_chain_and_fan_in(self, running_service):
+        first = running_service.add_job("helloworld", interval=3600)
+        second = running_service.add_job("helloworld", interval=3600)
+        # runs after both, and "last" after "fan_in"
+        fan_in = running_service.add_job("helloworld", after=[first, second])
+        last = running_service.add_job("helloworld", after=fan_in)
+        running_service.start_jobs([fan_in, last])
+
+        run_now(running_service, first)
+        wait_for(lambda: runs(running_service, first) == 1)
+        assert running_service.get_dependencies(fan_in)["waiting_for"] == [second]
+        assert runs(running_service, fan_in) == 0
+
+        run_now(running_service, second)
+        wait_for(lambda: runs(running_service, last) == 1)
+        assert runs(running_service, fan_in) == 1
+        # the next run waits for both upstream jobs again
+        assert running_service.get_dependencies(fan_in) == {
+            "after": sorted([first, second]), "waiting_for": sorted([first, second]), "downstream": [last], "orphaned": False,
+        }
+        assert running_service.state()["dependencies"] == {"jobs": 2, "orphaned": [], "submitted": 2, "skipped": 0}
+
+    def test_failed_and_paused_upstream(self, running_service):
+        failing = running_service.add_job("does_not_exist", interval=3600)
+        succeeding = running_service.add_job("helloworld", interval=3600)
+        after_failing = running_service.add_job("helloworld", after=failing)
+        paused = running_service.add_job("helloworld", after=succeeding)
+        running_service.start_job(after_failing)
+
+        run_now(running_service, failing)
+        run_now(running_service, succeeding)
+        wait_for(lambda: running_service.state()["dependencies"]["skipped"] == 1)
+        wait_for(lambda: runs(running_service, failing) == 1)
+        assert runs(running_service, after_failing) == 0
+        assert runs(running_service, paused) == 0
+
+    def test_marshalled_job(self, scheduler_service):
+        upstream = scheduler_service.add_job("helloworld")
+        job_id = scheduler_service.add_job("helloworld", after=[upstream])
+        job = scheduler_service.start_job(job_id)
+        # running, but without a time of its own
+        assert job["is_running"]
+        assert job["next_run_time"] is None
+        assert job["next_run_times"] == []
+        assert job["trigger"] == {"type": "dependency", "after": [upstream]}
+
+        job = scheduler_service.reschedule_job(job_id, interval=60)
+        assert job["trigger"]["type"] == "interval"
+        assert scheduler_service.get_dependencies(upstream)["downstream"] == []
+
+    def test_invalid_dependencies(self, scheduler_service):
+        first = scheduler_service.add_job("helloworld")
+        second = scheduler_service.add_job("helloworld", after=first)
+        with pytest.raises(ValueError):
+            scheduler_service.add_job("helloworld", after=["does not exist"])
+        with pytest.raises(ValueError):
+            scheduler_service.add_job("helloworld", after=[])
+        # cycles
+        with pytest.raises(ValueError):
+            scheduler_service.reschedule_job(first, after=second)
+        with pytest.raises(ValueError):
+            scheduler_service.reschedule_job(first, after=first)
+
+    def test_add_graph_in_one_request(self, scheduler_service):
+        results = scheduler_service.add_jobs([
+            {"pipeline_name": "extract"},
+            {"pipeline_name": "transform", "after": [0]},
+            {"pipeline_name": "load", "after": [1, 0]},
+            {"pipeline_name": "invalid", "after": [4]},
+        ])
+        extract, transform, load = (r["result"] for r in results[:3])
+        assert results[3]["error"] is not None
+        assert scheduler_service.get_dependencies(load)["after"] == sorted([extract, transform])
+        assert scheduler_service.get_dependencies(extract)["downstream"] == sorted([transform, load])
+
+        # removed upstream jobs are dropped, "load" runs after "extract" only
+        scheduler_service._scheduler.start(paused=True)
+        scheduler_service.remove_job(transform)
+        assert scheduler_service.get_dependencies(load)["after"] == [extract]
+
+    def test_orphaned_job(self, scheduler_service, caplog):
+        upstream = scheduler_service.add_job("extract")
+        downstream = scheduler_service.add_job("load", after=upstream)
+        scheduler_service._scheduler.start(paused=True)
+
+        # without upstream jobs, the downstream job never runs
+        scheduler_service.remove_job(upstream)
+        assert scheduler_service.get_dependencies(downstream) == {
+            "after": [], "waiting_for": [], "downstream": [], "orphaned": True,
+        }
+        assert scheduler_service.state()["dependencies"]["orphaned"] == [downstream]
+        assert any(downstream in r.getMessage() for r in caplog.records if r.levelname == "WARNING")
+
+        scheduler_service.reschedule_job(downstream, interval=60)
+        assert not scheduler_service.get_dependencies(downstream)["orphaned"]
+        assert scheduler_service.state()["dependencies"]["orphaned"] == []
+
+    def test_sqlite_store(self, test_config, tmp_path):
+        config = copy.deepcopy(test_config)
+        config.apscheduler["apscheduler.jobstores.default"] = {
+            "class": "pyrsched.server.jobstore:SQLiteJobStore",
+            "path": str(tmp_path / "jobs.sqlite"),
+        }
+
+        def open_service():
+            scheduler = BackgroundScheduler(copy.deepcopy(config.apscheduler))
+            service = SchedulerService(scheduler=scheduler, config=config, logger=None)
+            scheduler.start(paused=True)
+            return service
+
+        service = open_service()
+        upstream = service.add_job("extract")
+        downstream = service.add_job("load", after=[upstream])
+        # the next run time of a started job is restored with the timezone of its trigger
+        assert service.start_job(downstream)["is_running"]
+        assert service.get_job(downstream)["is_running"]
+        service._scheduler.shutdown(wait=False)
+
+        restarted = open_service()
+        try:
+            assert restarted.get_job(downstream)["is_running"]
+            assert restarted.get_dependencies(upstream)["downstream"] == [downstream]
+        finally:
+            restarted._scheduler.shutdown(wait=False)
+
+    def test_changes_of_other_nodes(self, cluster_services):
+        first, second = cluster_services("first"), cluster_services("second")
+        upstream = first.add_job("extract")
+        other = first.add_job("clean")
+        downstream = second.add_job("load", after=[upstream, other])
+        assert first.get_dependencies(upstream)["downstream"] == []
+
+        # the heartbeat picks up the changes of the job set
+        first._scheduler._lookup_jobstore("default").heartbeat()
+        assert first.get_dependencies(upstream)["downstream"] == [downstream]
+
+        # jobs which still wait for the same upstream jobs keep what they waited for so far
+        first._dependencies._on_executed(SimpleNamespace(job_id=upstream))
+        first._scheduler._lookup_jobstore("default").heartbeat()
+        assert first.get_dependencies(downstream)["waiting_for"] == [other]
+
+        second.remove_job(downstream)
+        first._scheduler._lookup_jobstore("default").heartbeat()
+        assert first.get_dependencies(upstream)["downstream"] == []
+        assert first.state()["dependencies"]["jobs"] == 0
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture(scope="function")
+def process_scheduler(apscheduler_config):
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    apscheduler_config["apscheduler.executors.processpool"] = {
+        "class": "pyrsched.server.executors:PipelineProcessPoolExecutor",
+        "max_workers": "2",
+        "max_runs_per_child": "2",
+    }
+    scheduler = BackgroundScheduler(apscheduler_config)
+    scheduler.start()
+    yield scheduler
+    scheduler.shutdown()
+
+
+def run_once(scheduler, pipeline_name, log_path, sensitive_keys=None, **kwargs):
+    """ run a pipeline once in the process pool and wait for its result event """
+    from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+    from pyrsched.server.service import job_function
+
+    done = threading.Event()
+    events = []
+
+    def listener(event):
+        events.append(event)
+        done.set()
+
+    scheduler.add_listener(listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+    scheduler.add_job(
+        job_function,
+        executor="processpool",
+        args=[pipeline_name, ],
+        kwargs={
+            "log_path": str(log_path),
+            "log_format": None,
+            "log_level": logging.INFO,
+            "pipeline_path": "tests/testdata",
+            "sensitive_keys": sensitive_keys,
+            **kwargs,
+        },
+    )
+    assert done.wait(timeout=60)
+    scheduler.remove_listener(listener)
+    return events[0]
+
+
+class TestPipelineProcessPoolExecutor:
+    def test_workers_are_preforked(self, process_scheduler):
+        executor = process_scheduler._lookup_executor("processpool")
+
+        # all workers are running before the first job was submitted
+        assert len(executor._pool._processes) == 2
+
+    def test_run_in_worker(self, process_scheduler, tmp_path):
+        event = run_once(process_scheduler, "helloworld", tmp_path)
+        assert event.exception is None
+
+        # the worker writes to the pipeline log file
+        assert "Hello World!" in (tmp_path / "helloworld.log").read_text()
+
+    def test_censor_in_worker(self, process_scheduler, tmp_path):
+        run_once(process_scheduler, "testlogcensor", tmp_path, sensitive_keys=["sensitive_value", ])
+
+        log = (tmp_path / "testlogcensor.log").read_text()
+        assert "'sensitive_value': '*****'" in log
+        assert "classified" not in log
+
+    def test_recycle_after_max_runs(self, process_scheduler, tmp_path):
+        executor = process_scheduler._lookup_executor("processpool")
+        old_pool = executor._pool
+
+        # two runs end up in one worker at the latest after three runs with two workers
+        for _ in range(3):
+            run_once(process_scheduler, "helloworld", tmp_path)
+
+        assert executor.recycle_count >= 1
+        assert executor._pool is not old_pool
+
+    def test_broken_pool_replaced_once(self, process_scheduler, tmp_path):
+        from concurrent.futures.process import BrokenProcessPool
+        from datetime import datetime, timezone
+        from pyrsched.server.service import job_function
+
+        executor = process_scheduler._lookup_executor("processpool")
+        both_submitting = threading.Barrier(2)
+
+        class BrokenPool:
+            def submit(self, *args, **kwargs):
+                both_submitting.wait(timeout=10)
+                raise BrokenProcessPool()
+
+            def shutdown(self, wait=True):
+                pass
+
+        executor._pool.shutdown()
+        executor._pool = BrokenPool()
+        recycle_count = executor.recycle_count
+        job = process_scheduler.add_job(
+            job_function, executor="processpool", next_run_time=None, args=["helloworld", ], kwargs={
+                "log_path": str(tmp_path), "log_format": None, "log_level": logging.INFO,
+                "pipeline_path": "tests/testdata", "sensitive_keys": None,
+            },
+        )
+        # two runs which both find the pool broken
+        threads = [
+            threading.Thread(target=executor._do_submit_job, args=(job, [datetime.now(timezone.utc)]))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert executor.recycle_count == recycle_count + 1
+
+    def test_concurrency_group(self, process_scheduler, tmp_path):
+        from pyrsched.server.concurrency import concurrency_groups
+
+        concurrency_groups.set_capacity("test_processes", 1)
+        try:
+            for _ in range(2):
+                run_once(process_scheduler, "helloworld", tmp_path, concurrency_group="test_processes")
+                # the finished run gave its capacity back to the group
+                deadline = time.monotonic() + 10
+                while concurrency_groups.stats()["test_processes"]["used"] and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                assert concurrency_groups.stats()["test_processes"]["used"] == 0
+        finally:
+            concurrency_groups.remove("test_processes")
+
+
+class TestExecutionMode:
+    def test_default_is_thread(self, scheduler_service):
+        job_id = scheduler_service.add_job("testpipeline")
+        assert scheduler_service.get_job(job_id)["executor"] == "default"
+
+    def test_process(self, test_config):
+        from apscheduler.schedulers.background import BackgroundScheduler
+        from pyrsched.server.service import SchedulerService
+
+        test_config.apscheduler["apscheduler.executors.processpool"] = {
+            "class": "pyrsched.server.executors:PipelineProcessPoolExecutor",
+        }
+        service = SchedulerService(BackgroundScheduler(test_config.apscheduler), test_config)
+        job_id = service.add_job("testpipeline", execution_mode="process")
+        assert service.get_job(job_id)["executor"] == "processpool"
+
+    def test_unknown(self, scheduler_service):
+        with pytest.raises(ValueError):
+            scheduler_service.add_job("testpipeline", execution_mode="gpu")
+
+    def test_executor_not_configured(self, scheduler_service):
+        # the test config has neither a process pool nor an executor for remote workers
+        for execution_mode in ("process", "remote"):
+            with pytest.raises(ValueError, match="not configured"):
+                scheduler_service.add_job("testpipeline", execution_mode=execution_mode)
+        assert scheduler_service.list_jobs() == []
@@ -0,0 +1,139 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from apscheduler.events import (
+    EVENT_JOB_ERROR,
+    EVENT_JOB_EXECUTED,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_REMOVED,
+    EVENT_JOB_SUBMITTED,
+    JobEvent,
+    JobExecutionEvent,
+    JobSubmissionEvent,
+)
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from pyrsched.server.executors import ThreadPoolExecutor
+from pyrsched.server.history import RunBuffer, RunHistory, time_events
+
+
+class TestRunBuffer:
+    def test_empty(self):
+        stats = RunBuffer(10).stats()
+        assert stats["runs"] == 0
+        assert stats["p50"] is None
+        assert stats["failure_rate"] is None
+
+    def test_percentiles(self):
+        buffer = RunBuffer(100)
+        for i in range(100):
+            buffer.append(float(i), float(i + 1))
+        stats = buffer.stats()
+        assert (stats["p50"], stats["p95"], stats["p99"]) == (50.0, 95.0, 99.0)
+        assert stats["mean"] == 50.5
+
+    def test_wraparound(self):
+        buffer = RunBuffer(3)
+        for i in range(5):
+            buffer.append(float(i), 1.0, error="boom" if i == 1 else None)
+
+        # only the last three runs are kept, the error of run 1 is remembered anyway
+        assert [run["started"] for run in buffer.runs()] == [2.0, 3.0, 4.0]
+        stats = buffer.stats()
+        assert stats["runs"] == 3
+        assert stats["total_runs"] == 5
+        assert stats["failures"] == 0
+        assert stats["last_run"] == 4.0
+        assert stats["last_error"] == "boom"
+
+
+class TestRunHistory:
+    def run(self, scheduler, job_id, exception=None):
+        run_time = datetime.now(timezone.utc)
+        scheduler._dispatch_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, job_id, "default", [run_time]))
+        code = EVENT_JOB_EXECUTED if exception is None else EVENT_JOB_ERROR
+        scheduler._dispatch_event(JobExecutionEvent(code, job_id, "default", run_time, exception=exception))
+
+    def test_records_runs(self):
+        scheduler = BackgroundScheduler()
+        history = RunHistory(scheduler, size=10)
+        self.run(scheduler, "a")
+        self.run(scheduler, "a", exception=ValueError("broken"))
+        self.run(scheduler, "b")
+
+        stats = history.stats("a")
+        assert stats["runs"] == 2
+        assert stats["failure_rate"] == 0.5
+        assert stats["last_error"] == "ValueError('broken')"
+        assert [run["success"] for run in history.runs("a")] == [True, False]
+        assert history.stats("b")["failures"] == 0
+
+    def test_bounded(self):
+        scheduler = BackgroundScheduler()
+        history = RunHistory(scheduler, size=5)
+        for _ in range(50):
+            self.run(scheduler, "a")
+        assert len(history.runs("a")) == 5
+
+        # the history of a removed job is dropped
+        scheduler._dispatch_event(JobEvent(EVENT_JOB_REMOVED, "a", "default"))
+        assert history.runs("a") == []
+        assert history.stats("a")["runs"] == 0
+
+    def test_missed_runs(self):
+        scheduler = BackgroundScheduler()
+        history = RunHistory(scheduler, size=5)
+        run_time = datetime.now(timezone.utc)
+        scheduler._dispatch_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, "a", "default", [run_time]))
+        scheduler._dispatch_event(JobExecutionEvent(EVENT_JOB_MISSED, "a", "default", run_time))
+        # a run shed by the executor is reported as missed before its submission
+        shed_time = datetime.now(timezone.utc)
+        scheduler._dispatch_event(JobExecutionEvent(EVENT_JOB_MISSED, "a", "default", shed_time))
+        scheduler._dispatch_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, "a", "default", [shed_time]))
+
+        assert history._running == {}
+        assert history._ended == {}
+        assert history.runs("a") == []
+
+    def test_finished_before_submission(self):
+        scheduler = BackgroundScheduler()
+        history = RunHistory(scheduler, size=5)
+        run_time = datetime.now(timezone.utc)
+        # a short run finishes in its worker thread before the scheduler thread reports its submission
+        finished = JobExecutionEvent(EVENT_JOB_EXECUTED, "a", "default", run_time)
+        scheduler._dispatch_event(time_events([finished], 1000.0, 0.25)[0])
+        scheduler._dispatch_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, "a", "default", [run_time]))
+
+        assert history.runs("a") == [{"started": 1000.0, "duration": 0.25, "success": True}]
+        assert history._running == {}
+        assert history._ended == {}
+
+    def test_timed_where_executed(self):
+        scheduler = BackgroundScheduler()
+        history = RunHistory(scheduler, size=5)
+        scheduler.add_executor(ThreadPoolExecutor(1))
+        scheduler.start(paused=True)
+        try:
+            release = threading.Event()
+            blocker = scheduler.add_job(release.wait, args=[5], id="blocker")
+            job = scheduler.add_job(time.sleep, args=[0.01], id="a")
+            executor = scheduler._lookup_executor("default")
+            executor.submit_job(blocker, [datetime.now(timezone.utc)])
+            # waits for the only worker thread, which is not part of the run's duration
+            submitted = time.time()
+            run_time = datetime.now(timezone.utc)
+            executor.submit_job(job, [run_time])
+            scheduler._dispatch_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, "a", "default", [run_time]))
+            time.sleep(0.2)
+            release.set()
+            deadline = time.monotonic() + 5
+            while not history.runs("a"):
+                assert time.monotonic() < deadline, "timed out"
+                time.sleep(0.01)
+        finally:
+            scheduler.shutdown()
+
+        run = history.runs("a")[0]
+        assert run["started"] >= submitted + 0.2
+        assert 0.01 <= run["duration"] < 0.15
@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+
+@pytest.fixture(scope="function")
+def counted_marshal(scheduler_service):
+    """ count how often the service marshals a job """
+    calls = []
+    marshal = scheduler_service._job_cache._marshal
+
+    def counting(job, *args):
+        calls.append(job.id)
+        return marshal(job, *args)
+
+    scheduler_service._job_cache._marshal = counting
+    return calls
+
+
+class TestJobStateCache:
+    def test_reads_without_changes(self, scheduler_service, counted_marshal):
+        job_id = scheduler_service.add_job("testpipeline")
+        scheduler_service.list_jobs()
+        del counted_marshal[:]
+
+        # nothing changed, so nothing is marshalled again
+        scheduler_service.list_jobs()
+        scheduler_service.state()
+        scheduler_service.get_job(job_id)
+        assert counted_marshal == []
+
+    def test_only_changed_job_marshalled(self, scheduler_service, counted_marshal):
+        job_ids = [scheduler_service.add_job("testpipeline") for _ in range(5)]
+        scheduler_service.list_jobs()
+        del counted_marshal[:]
+
+        scheduler_service.start_job(job_ids[2])
+        # the changed job is marshalled for the next snapshot (and for the return value of start_job)
+        assert set(counted_marshal) == {job_ids[2]}
+        del counted_marshal[:]
+        jobs = scheduler_service.list_jobs()
+
+        assert counted_marshal == []
+        # the scheduled job comes first, paused jobs last
+        assert jobs[0]["id"] == job_ids[2]
+        assert jobs[0]["next_run_time"] is not None
+
+    def test_change_on_scheduler(self, scheduler_service):
+        job_id = scheduler_service.add_job("testpipeline", interval=10)
+        scheduler_service.list_jobs()
+
+        # changes which bypass the service are picked up from the scheduler's events and published shortly after
+        scheduler_service._scheduler.resume_job(job_id)
+        assert scheduler_service._job_cache.wait_published(5)
+        assert scheduler_service.get_job(job_id)["next_run_time"] is not None
+
+        scheduler_service._scheduler.remove_job(job_id)
+        assert scheduler_service._job_cache.wait_published(5)
+        assert scheduler_service.get_job(job_id) is None
+        assert scheduler_service.list_jobs() == []
+
+    def test_wait_for_slow_publish(self, scheduler_service):
+        job_id = scheduler_service.add_job("helloworld")
+        marshal = scheduler_service._job_cache._marshal
+
+        def slow(job, *args):
+            time.sleep(0.3)
+            return marshal(job, *args)
+
+        scheduler_service._job_cache._marshal = slow
+        scheduler_service._scheduler.modify_job(job_id, name="renamed")
+        # the publisher has taken the change, but not stored the snapshot with it yet
+        time.sleep(0.1)
+        assert scheduler_service._job_cache.wait_published(5)
+        assert scheduler_service.get_job(job_id)["name"] == "renamed"
+
+    def test_scheduler_start(self, scheduler_service):
+        job_id = scheduler_service.add_job("testpipeline")
+        scheduler_service.list_jobs()
+
+        scheduler_service._scheduler.start(paused=True)
+        try:
+            assert scheduler_service._job_cache.wait_published(5)
+            assert scheduler_service.state()["job_list"][0]["id"] == job_id
+        finally:
+            scheduler_service._scheduler.shutdown()
+
+
+class TestSnapshots:
+    def test_reads_do_not_call_the_scheduler(self, scheduler_service, monkeypatch):
+        job_ids = [scheduler_service.add_job("testpipeline", interval=10 + i) for i in range(3)]
+        scheduler_service.start_job(job_ids[0])
+
+        def locked(*args, **kwargs):
+            raise AssertionError("the scheduler was called")
+
+        monkeypatch.setattr(scheduler_service._scheduler, "get_jobs", locked)
+        monkeypatch.setattr(scheduler_service._scheduler, "get_job", locked)
+        assert [job["id"] for job in scheduler_service.list_jobs()] == job_ids
+        assert scheduler_service.get_job(job_ids[1])["name"] == "testpipeline"
+        assert scheduler_service.query_jobs(limit=1)["total"] == 3
+        assert len(scheduler_service.upcoming_runs(within=3600)) == 360
+        assert scheduler_service.state()["total_jobs"] == 3
+
+    def test_snapshots_are_not_changed(self, scheduler_service):
+        job_id = scheduler_service.add_job("testpipeline")
+        snapshot = scheduler_service._job_cache.snapshot
+        entries = list(snapshot.entries)
+
+        scheduler_service.start_job(job_id)
+        scheduler_service.add_job("otherpipeline")
+        assert snapshot.entries == entries
+        assert scheduler_service._job_cache.snapshot.version > snapshot.version
+        assert scheduler_service.state()["snapshot"]["version"] == scheduler_service._job_cache.snapshot.version
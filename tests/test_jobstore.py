@@ -0,0 +1,168 @@
+import copy
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from pyrsched.server.jobstore import SQLiteJobStore
+from pyrsched.server.service import SchedulerService
+
+
+@pytest.fixture(scope="function")
+def sqlite_config(test_config, tmp_path):
+    test_config.apscheduler["apscheduler.jobstores.default"] = {
+        "class": "pyrsched.server.jobstore:SQLiteJobStore",
+        "path": str(tmp_path / "jobs.sqlite"),
+    }
+    return test_config
+
+
+@pytest.fixture(scope="function")
+def open_service(sqlite_config):
+    """ start services on the same database, all of them are shut down after the test """
+    schedulers = []
+
+    def inner():
+        # apscheduler consumes its configuration, each scheduler needs its own copy
+        scheduler = BackgroundScheduler(copy.deepcopy(sqlite_config.apscheduler))
+        service = SchedulerService(scheduler=scheduler, config=sqlite_config, logger=None)
+        scheduler.start(paused=True)
+        schedulers.append(scheduler)
+        return service
+
+    yield inner
+    for scheduler in schedulers:
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+
+
+class TestSQLiteJobStore:
+    def test_configured_store(self, open_service):
+        service = open_service()
+        assert isinstance(service._scheduler._lookup_jobstore("default"), SQLiteJobStore)
+
+    def test_jobs_survive_restart(self, open_service):
+        service = open_service()
+        paused_id = service.add_job("testpipeline", interval=10)
+        started_id = service.add_job("testpipeline", interval=20)
+        service.start_job(started_id)
+        next_run_time = service._scheduler.get_job(started_id).next_run_time
+        service._scheduler.shutdown(wait=False)
+
+        restarted = open_service()
+        started = restarted._scheduler.get_job(started_id)
+        assert started.next_run_time == next_run_time
+        assert started.trigger.interval == timedelta(seconds=20)
+        assert started.kwargs == service._job_settings()["kwargs"]
+        assert restarted._scheduler.get_job(paused_id).next_run_time is None
+        # scheduled jobs first, paused jobs last
+        assert [job["id"] for job in restarted.list_jobs()] == [started_id, paused_id]
+
+    def test_shared_template(self, open_service):
+        service = open_service()
+        service.add_jobs([{"pipeline_name": f"pipeline_{i}"} for i in range(10)])
+        service.add_job("other", execution_mode="thread", interval=5)
+        service.add_jobs([{"pipeline_name": f"killable_{i}", "timeout": 60} for i in range(5)])
+
+        # all jobs have the same settings, which are stored only once, jobs with a timeout share another template
+        conn = service._scheduler._lookup_jobstore("default")._conn
+        assert conn.execute("SELECT COUNT(*) FROM job_templates").fetchone() == (2, )
+        assert conn.execute("SELECT COUNT(*) FROM jobs").fetchone() == (16, )
+
+    def test_due_jobs(self, open_service):
+        service = open_service()
+        job_ids = [service.add_job("testpipeline", interval=3600) for _ in range(3)]
+        service.start_job(job_ids[1])
+        store = service._scheduler._lookup_jobstore("default")
+
+        now = datetime.now(timezone.utc)
+        assert store.get_due_jobs(now) == []
+        assert store.get_next_run_time() is not None
+        due = store.get_due_jobs(now + timedelta(hours=2))
+        assert [job.id for job in due] == [job_ids[1]]
+
+    def test_errors(self, open_service):
+        service = open_service()
+        job_id = service.add_job("testpipeline")
+        store = service._scheduler._lookup_jobstore("default")
+        job = store.lookup_job(job_id)
+
+        with pytest.raises(ConflictingIdError):
+            store.add_job(job)
+        store.remove_job(job_id)
+        with pytest.raises(JobLookupError):
+            store.update_job(job)
+        with pytest.raises(JobLookupError):
+            store.remove_job(job_id)
+        assert store.lookup_job(job_id) is None
+
+    def test_batch_rollback(self, open_service):
+        service = open_service()
+        store = service._scheduler._lookup_jobstore("default")
+        with pytest.raises(RuntimeError):
+            with store.batch():
+                service.add_job("testpipeline")
+                raise RuntimeError()
+        assert store.get_all_jobs() == []
+
+    def test_batch_next_to_single_calls(self, open_service):
+        service = open_service()
+        job_id = service.add_job("testpipeline")
+        stop = threading.Event()
+        results = []
+
+        def pause():
+            # like the listeners of the service which change or look up jobs, the snapshot is not published
+            while not stop.is_set():
+                service._scheduler.pause_job(job_id)
+
+        def add_jobs():
+            results.extend(service.add_jobs([{"pipeline_name": f"pipeline_{i}"} for i in range(300)]))
+            stop.set()
+
+        threads = [threading.Thread(target=pause, daemon=True), threading.Thread(target=add_jobs, daemon=True)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        stop.set()
+        assert not any(thread.is_alive() for thread in threads), "deadlocked"
+        assert [r["error"] for r in results] == [None] * 300
+
+    def test_broken_job_removed(self, open_service):
+        service = open_service()
+        job_id = service.add_job("testpipeline")
+        store = service._scheduler._lookup_jobstore("default")
+        store._conn.execute("UPDATE jobs SET state = ? WHERE id = ?", (b"garbage", job_id))
+
+        # a job which cannot be restored is logged and dropped instead of breaking the scheduler
+        assert store.get_all_jobs() == []
+        assert store._conn.execute("SELECT COUNT(*) FROM jobs").fetchone() == (0, )
+
+    def test_cold_start_benchmark(self, open_service):
+        service = open_service()
+        count = 10000
+        start = time.perf_counter()
+        results = service.add_jobs([{"pipeline_name": f"pipeline_{i}", "interval": 60 + i} for i in range(count)])
+        write_time = time.perf_counter() - start
+        job_ids = [r["result"] for r in results]
+        service.start_jobs(job_ids[::2])
+        service._scheduler.shutdown(wait=False)
+
+        start = time.perf_counter()
+        restarted = open_service()
+        open_time = time.perf_counter() - start
+        # not measured: the snapshot of the job cache, which the new scheduler publishes in the background
+        restarted._job_cache.publish()
+        start = time.perf_counter()
+        jobs = restarted._scheduler.get_jobs()
+        restore_time = time.perf_counter() - start
+
+        print(f"\n{count} jobs: added in {write_time:.3f}s, opened in {open_time:.3f}s, restored in {restore_time:.3f}s")
+        assert len(jobs) == count
+        # the goal is well under a second, the restore takes about 0.15s on a laptop
+        assert open_time < 0.5
+        assert restore_time < 0.5
@@ -1,4 +1,5 @@
 import logging
+import re
 from pathlib import Path
 import time
 
@@ -24,15 +25,195 @@ class TestLogging:
         print(formatted_messages)
         assert any("'sensitive_value': '*****'" in m for m in formatted_messages)
 
-    # test if log messages are mangled between log files
-    # def test_parallel(self, caplog, scheduler_service):
-    #     # ass a job and start it
-    #     job_id1 = scheduler_service.add_job("helloworld", interval=1)
-    #     job1 = scheduler_service.start_job(job_id1)      
-    #     job_id2 = scheduler_service.add_job("pipeline_now", interval=1)
-    #     job2 = scheduler_service.start_job(job_id2)    
+    def test_parallel_runs_are_isolated(self, tmp_path):
+        from concurrent.futures import ThreadPoolExecutor
+        from pyrsched.server.service import job_function
+
+        # run a slow and a fast pipeline at the same time, the fast one
+        # finishes while the slow one is still sleeping
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(job_function, name, str(tmp_path), logging.INFO, None, "tests/testdata", None)
+                for name in ("sleep", "helloworld")
+            ]
+            for f in futures:
+                f.result()
+
+        # each log file only contains the messages of its own pipeline
+        sleep_log = (tmp_path / "sleep.log").read_text()
+        hello_log = (tmp_path / "helloworld.log").read_text()
+        assert "woke up" in sleep_log
+        assert "Hello World!" not in sleep_log
+        assert "Hello World!" in hello_log
+        assert "sleep pipeline" not in hello_log
+
+    def test_logger_level_restored(self, tmp_path):
+        from pyrsched.server.service import job_function
+
+        logger = logging.getLogger("pypyr")
+        old_level = logger.level
+        job_function("helloworld", str(tmp_path), logging.DEBUG, None, "tests/testdata", None)
+        assert logger.level == old_level
+
+
+class LegacySensitiveValueFormatter(logging.Formatter):
+    """ the formatter before single pass masking, one regex per key (for the benchmark) """
+    def __init__(self, fmt=None, sensitive_keys=None):
+        super().__init__(fmt)
+        self.regex_list = [re.compile(r"\'(?P<key>" + key + r")\':\s*\'.*?\'") for key in sensitive_keys]
+
+    def format(self, record):
+        formatted_record = super().format(record)
+        for r in self.regex_list:
+            formatted_record = r.sub(r"'\g<key>': '*****'", formatted_record)
+        return formatted_record
+
+
+def make_record(msg):
+    return logging.LogRecord("pypyr", logging.INFO, __file__, 0, msg, None, None)
+
+
+class TestSensitiveValueFormatter:
+    KEYS = [f"secret_{i}" for i in range(40)]
+    MESSAGES = [
+        "{'loop': '1', 'secret_3': 'classified', 'secret_17': 'also classified'}",
+        "running step pypyr.steps.echo",
+        "'secret_39':'no blank'",
+    ] + [f"step {i} done without anything to hide" for i in range(20)]
+
+    def test_same_result_as_legacy(self):
+        from pyrsched.server.logging import SensitiveValueFormatter
+
+        formatter = SensitiveValueFormatter(sensitive_keys=self.KEYS)
+        legacy = LegacySensitiveValueFormatter(sensitive_keys=self.KEYS)
+        for msg in self.MESSAGES:
+            assert formatter.format(make_record(msg)) == legacy.format(make_record(msg))
+
+    def test_keys_are_literal(self):
+        from pyrsched.server.logging import SensitiveValueFormatter
+
+        formatter = SensitiveValueFormatter(sensitive_keys=["db.passwd", ])
+        assert formatter.format(make_record("'db.passwd': 'x'")) == "'db.passwd': '*****'"
+
+        # the dot does not match any character
+        assert formatter.format(make_record("'db_passwd': 'x'")) == "'db_passwd': 'x'"
+
+    def test_pattern_shared(self):
+        from pyrsched.server.logging import SensitiveValueFormatter
+
+        first = SensitiveValueFormatter(sensitive_keys=self.KEYS)
+        second = SensitiveValueFormatter(sensitive_keys=list(self.KEYS))
+        assert first.regex is second.regex
+
+    def test_benchmark(self):
+        from pyrsched.server.logging import SensitiveValueFormatter
+
+        records = [make_record(msg) for msg in self.MESSAGES] * 200
+
+        def measure(formatter):
+            start = time.perf_counter()
+            for r in records:
+                formatter.format(r)
+            return time.perf_counter() - start
+
+        legacy_time = measure(LegacySensitiveValueFormatter(sensitive_keys=self.KEYS))
+        new_time = measure(SensitiveValueFormatter(sensitive_keys=self.KEYS))
+        print(
+            f"{len(records)} records, {len(self.KEYS)} keys: "
+            f"{len(records) / legacy_time:.0f} records/s per-key regex, "
+            f"{len(records) / new_time:.0f} records/s single pass"
+        )
+        assert new_time < legacy_time
+
+
+class TestHandlerRegistry:
+    def test_handler_reused(self, tmp_path):
+        from pyrsched.server.logging import LogHandlerRegistry
+
+        registry = LogHandlerRegistry()
+        handler = registry.acquire(tmp_path / "a.log", sensitive_keys=["secret", ])
+        registry.release(handler)
+
+        # the next run with the same log file gets the same, still open handler
+        assert registry.acquire(tmp_path / "a.log", sensitive_keys=["secret", ]) is handler
+        registry.close()
+
+    def test_lru_eviction(self, tmp_path):
+        from pyrsched.server.logging import LogHandlerRegistry
+
+        registry = LogHandlerRegistry(max_open=2)
+        handlers = [registry.acquire(tmp_path / f"{name}.log") for name in ("a", "b", "c")]
+
+        # all handlers are in use, none of them may be closed
+        assert registry.open_handlers() == 3
+
+        for h in handlers:
+            registry.release(h)
+        assert registry.open_handlers() == 2
+
+        # "a" was the least recently used one
+        assert registry.acquire(tmp_path / "a.log") is not handlers[0]
+        registry.close()
+
+    def test_queue(self, tmp_path):
+        from pyrsched.server.logging import LogHandlerRegistry
+
+        registry = LogHandlerRegistry(use_queue=True)
+        handler = registry.acquire(tmp_path / "queued.log", log_format="%(levelname)s %(message)s", sensitive_keys=["secret", ])
+        logger = logging.getLogger("pyrsched.test.queue")
+        handler.handle(logger.makeRecord(logger.name, logging.INFO, __file__, 0, "'secret': '%s'", ("42", ), None))
+        registry.release(handler)
+
+        # closing waits until the listener has written all queued records
+        registry.close()
+        assert (tmp_path / "queued.log").read_text() == "INFO 'secret': '*****'\n"
+
+    def test_switch_mode_while_in_use(self, tmp_path):
+        from pyrsched.server.logging import LogHandlerRegistry
+
+        registry = LogHandlerRegistry(use_queue=True)
+        logger = logging.getLogger("pyrsched.test.switch")
+        in_use = registry.acquire(tmp_path / "running.log", log_format="%(message)s")
+        idle = registry.acquire(tmp_path / "idle.log")
+        registry.release(idle)
+
+        registry.configure(use_queue=False)
+        assert registry.open_handlers() == 0
+        # the running pipeline keeps writing through its queued handler until it releases it
+        in_use.handle(logger.makeRecord(logger.name, logging.INFO, __file__, 0, "still running", (), None))
+        direct = registry.acquire(tmp_path / "running.log", log_format="%(message)s")
+        assert direct is not in_use
+        registry.release(in_use)
+        assert (tmp_path / "running.log").read_text() == "still running\n"
+        assert in_use.target.stream is None  # closed on release
+
+        registry.release(direct)
+        registry.close()
+
+
+class TestParallelBenchmark:
+    RUNS = 8
+    SLEEP = 0.5  # seconds, see tests/testdata/sleep.yaml
+
+    def test_sleeping_pipelines_run_concurrently(self, tmp_path):
+        from concurrent.futures import ThreadPoolExecutor
+        from pyrsched.server.service import job_function
+
+        # warm up pypyr (imports, pipeline cache) so that only the runs are measured
+        job_function("sleep", str(tmp_path), logging.INFO, None, "tests/testdata", None)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.RUNS) as executor:
+            futures = [
+                executor.submit(job_function, "sleep", str(tmp_path), logging.INFO, None, "tests/testdata", None)
+                for _ in range(self.RUNS)
+            ]
+            for f in futures:
+                f.result()
+        elapsed = time.perf_counter() - start
 
-    #     time.sleep(15)
+        serial = self.RUNS * self.SLEEP
+        print(f"{self.RUNS} sleeping pipelines: {elapsed:.2f}s parallel, {serial:.2f}s if run serially")
 
-    #     for r in caplog.records:
-    #         print(r.msg)
+        # the runs overlap, so the total time is far below the serial sum
+        assert elapsed < serial / 2
@@ -0,0 +1,157 @@
+import logging
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED, JobExecutionEvent, JobSubmissionEvent
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from pyrsched.server.exposition import MetricsServer
+from pyrsched.server.logging import PipelineLoggingContext
+from pyrsched.server.metrics import LOG_LOCK_WAIT, MetricsRegistry, SchedulerMetrics, instrument
+
+
+def sample_value(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[-1])
+    raise KeyError(name)
+
+
+class TestRegistry:
+    def test_exposition(self):
+        registry = MetricsRegistry()
+        registry.counter("test_runs", "Runs", ["result"]).labels("success").inc(3)
+        registry.gauge("test_depth", "Depth").labels().set(2)
+        histogram = registry.histogram("test_seconds", "Seconds", buckets=(1, 5)).labels()
+        for value in (0.5, 2, 10):
+            histogram.observe(value)
+
+        text = registry.exposition()
+        assert "# TYPE test_runs counter" in text
+        assert sample_value(text, 'test_runs_total{result="success"}') == 3
+        assert sample_value(text, "test_depth") == 2
+        # histogram buckets are cumulative
+        assert sample_value(text, 'test_seconds_bucket{le="1.0"}') == 1
+        assert sample_value(text, 'test_seconds_bucket{le="5.0"}') == 2
+        assert sample_value(text, 'test_seconds_bucket{le="+Inf"}') == 3
+        assert sample_value(text, "test_seconds_sum") == 12.5
+
+    def test_same_family(self):
+        registry = MetricsRegistry()
+        assert registry.counter("test_a", "A") is registry.counter("test_a", "A")
+        with pytest.raises(ValueError):
+            registry.counter("test_b", "B", ["label"]).labels()
+
+    def test_observe_overhead(self):
+        histogram = MetricsRegistry().histogram("test_overhead", "Overhead").labels()
+        count = 100000
+        start = time.perf_counter()
+        for i in range(count):
+            histogram.observe(0.01)
+        per_call = (time.perf_counter() - start) / count
+        print(f"\nhistogram observe: {per_call * 1e9:.0f}ns")
+        assert per_call < 0.0001
+
+    def test_http_endpoint(self):
+        registry = MetricsRegistry()
+        registry.counter("test_scraped", "Scraped").labels().inc()
+        server = MetricsServer(0, registry=registry).start()
+        try:
+            host, port = server.address
+            with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5) as response:
+                assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+                assert sample_value(response.read().decode("utf-8"), "test_scraped_total") == 1
+        finally:
+            server.shutdown()
+
+
+class TestSchedulerMetrics:
+    def test_executors(self):
+        registry = MetricsRegistry()
+        scheduler = BackgroundScheduler({"apscheduler.executors.default": {"type": "threadpool", "max_workers": "2"}})
+        SchedulerMetrics(scheduler, registry=registry)
+        scheduler.start(paused=True)
+        try:
+            executor = scheduler._lookup_executor("default")
+            executor._instances.update({"a": 2, "b": 1})
+            text = registry.exposition()
+        finally:
+            executor._instances.clear()
+            scheduler.shutdown(wait=False)
+
+        assert sample_value(text, 'pyrsched_executor_workers{executor="default"}') == 2
+        assert sample_value(text, 'pyrsched_executor_busy_workers{executor="default"}') == 2
+        assert sample_value(text, 'pyrsched_executor_queue_depth{executor="default"}') == 1
+
+    def test_misfires_and_coalesced(self, scheduler_service):
+        scheduler = scheduler_service._scheduler
+        job_id = scheduler_service.add_job("testpipeline", interval=10)
+        scheduler.get_job(job_id).coalesce = True  # the test config does not coalesce, the pending job is changed in place
+
+        metrics = scheduler_service._metrics
+        before = metrics._coalesced.get(), metrics._misfires.get()
+        start = datetime.now(timezone.utc)
+        # the second run comes 50 seconds after the first, four runs in between were coalesced
+        for offset in (0, 50):
+            run_time = start + timedelta(seconds=offset)
+            scheduler._dispatch_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, job_id, "default", [run_time]))
+        scheduler._dispatch_event(JobExecutionEvent(EVENT_JOB_MISSED, job_id, "default", start))
+        metrics._collect_coalesced()
+
+        assert metrics._coalesced.get() - before[0] == 4
+        assert metrics._misfires.get() - before[1] == 1
+
+    def test_coalesced_of_changed_and_removed_jobs(self, scheduler_service, monkeypatch):
+        scheduler = scheduler_service._scheduler
+        scheduler.start(paused=True)
+        job_id = scheduler_service.add_job("testpipeline", interval=10)
+        scheduler.modify_job(job_id, coalesce=True)
+        metrics = scheduler_service._metrics
+        lookups = []
+        get_job = scheduler.get_job
+        monkeypatch.setattr(scheduler, "get_job", lambda job_id: lookups.append(job_id) or get_job(job_id))
+
+        def submit(*offsets):
+            start = datetime.now(timezone.utc)
+            for offset in offsets:
+                run_time = start + timedelta(seconds=offset)
+                scheduler._dispatch_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, job_id, "default", [run_time]))
+            before = metrics._coalesced.get()
+            metrics._collect_coalesced()
+            return metrics._coalesced.get() - before
+
+        assert submit(0, 30) == 2
+        # the trigger is kept between scrapes
+        assert submit(0, 30) == 2
+        assert lookups == [job_id]
+
+        # looked up again after a change
+        scheduler_service.reschedule_job(job_id, interval=5)
+        assert submit(0, 30) == 5
+        assert lookups == [job_id, job_id]
+
+        scheduler_service.remove_job(job_id)
+        assert job_id not in metrics._last_run_times
+        assert job_id not in metrics._triggers
+
+    def test_log_lock_wait(self, tmp_path):
+        logger = logging.getLogger("pyrsched.test.metrics")
+        count, _ = LOG_LOCK_WAIT.labels().get()
+        with PipelineLoggingContext(logger, loglevel=logging.INFO, log_filename=tmp_path / "test.log"):
+            logger.info("one")
+            logger.info("two")
+        assert LOG_LOCK_WAIT.labels().get()[0] >= count + 2
+
+
+class TestInstrument:
+    def test_rpc_latency(self, scheduler_service):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("test_rpc_seconds", "RPC", labelnames=["method"])
+        served = instrument(scheduler_service, histogram)
+
+        assert served.list_jobs() == []
+        assert not hasattr(served, "_marshal_job")
+        assert histogram.labels("list_jobs").get()[0] == 1
+        assert histogram.labels("state").get()[0] == 0
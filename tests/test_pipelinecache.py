@@ -0,0 +1,95 @@
+import logging
+import os
+
+import pytest
+
+
+def write_pipeline(directory, name, message):
+    pipeline_file = directory / f"{name}.yaml"
+    pipeline_file.write_text(f"steps:\n  - name: pypyr.steps.echo\n    in:\n      echoMe: '{message}'\n")
+    return pipeline_file
+
+
+def touch_later(pipeline_file):
+    # make sure the modification time changes even on file systems with a coarse resolution
+    stat = pipeline_file.stat()
+    os.utime(pipeline_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+class TestPipelineCache:
+    def test_hit_and_miss(self, tmp_path):
+        from pyrsched.server.pipelinecache import PipelineCache
+
+        cache = PipelineCache()
+        write_pipeline(tmp_path, "first", "one")
+
+        definition, loaded = cache.get("first", tmp_path)
+        assert loaded
+        assert definition["steps"][0]["in"]["echoMe"] == "one"
+
+        # the second lookup is served from the cache
+        _, loaded = cache.get("first", tmp_path)
+        assert not loaded
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_invalidate_on_change(self, tmp_path):
+        from pyrsched.server.pipelinecache import PipelineCache
+
+        cache = PipelineCache()
+        pipeline_file = write_pipeline(tmp_path, "first", "one")
+        cache.get("first", tmp_path)
+
+        write_pipeline(tmp_path, "first", "two")
+        touch_later(pipeline_file)
+
+        definition, loaded = cache.get("first", tmp_path)
+        assert loaded
+        assert definition["steps"][0]["in"]["echoMe"] == "two"
+
+    def test_lru_eviction(self, tmp_path):
+        from pyrsched.server.pipelinecache import PipelineCache
+
+        cache = PipelineCache(max_size=2)
+        for name in ("a", "b", "c"):
+            write_pipeline(tmp_path, name, name)
+
+        cache.get("a", tmp_path)
+        cache.get("b", tmp_path)
+        cache.get("a", tmp_path)  # "b" is the least recently used now
+        cache.get("c", tmp_path)
+
+        stats = cache.stats()
+        assert stats["size"] == 2
+        assert stats["evictions"] == 1
+        assert not cache.get("a", tmp_path)[1]
+        assert cache.get("b", tmp_path)[1]
+
+    def test_not_found(self, tmp_path):
+        from pypyr.errors import PipelineNotFoundError
+        from pyrsched.server.pipelinecache import PipelineCache
+
+        with pytest.raises(PipelineNotFoundError):
+            PipelineCache().get("nonexistent_gibberish", tmp_path)
+
+
+class TestJobFunctionCache:
+    def test_changed_pipeline_is_run(self, tmp_path):
+        from pyrsched.server.service import job_function
+
+        pipeline_dir = tmp_path / "pipelines"
+        pipeline_dir.mkdir()
+        pipeline_file = write_pipeline(pipeline_dir, "cached_pipeline", "first version")
+
+        job_function("cached_pipeline", str(tmp_path), logging.INFO, None, str(pipeline_dir), None)
+        write_pipeline(pipeline_dir, "cached_pipeline", "second version")
+        touch_later(pipeline_file)
+        job_function("cached_pipeline", str(tmp_path), logging.INFO, None, str(pipeline_dir), None)
+
+        log = (tmp_path / "cached_pipeline.log").read_text()
+        assert "first version" in log
+        assert "second version" in log
+
+    def test_state(self, scheduler_service):
+        stats = scheduler_service.state()["pipeline_cache"]
+        assert {"hits", "misses", "size", "max_size"} <= set(stats)
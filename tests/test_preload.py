@@ -0,0 +1,112 @@
+import subprocess
+import sys
+
+import pytest
+
+from pyrsched.server import executors
+from pyrsched.server.preload import pipeline_names, preload_pipelines, step_names
+
+# runs in a fresh interpreter: the time to import the server, the duration of the first pipeline run
+# and the step modules the run imported
+STARTUP_BENCHMARK = """
+import sys, tempfile, time
+start = time.perf_counter()
+from pyrsched.server.server import ServerWrapper
+from pyrsched.server.service import run_pipeline
+imported = time.perf_counter() - start
+if sys.argv[1] == "preload":
+    from pyrsched.server.preload import preload_pipelines
+    preload_pipelines("tests/testdata", ["testlogcensor"])
+before = set(sys.modules)
+start = time.perf_counter()
+run_pipeline("testlogcensor", tempfile.mkdtemp(), 20, "%(message)s", "tests/testdata", None)
+duration = time.perf_counter() - start
+print(imported, duration, *sorted(m for m in set(sys.modules) - before if m.startswith("pypyr.steps.")))
+"""
+
+
+@pytest.fixture(scope="function")
+def preload_modules():
+    """ restores the modules the fork server preloads """
+    saved = list(executors.PRELOAD_MODULES)
+    yield executors.PRELOAD_MODULES
+    executors.PRELOAD_MODULES[:] = saved
+
+
+def write_step_pipeline(directory):
+    (directory / "preloadstep.py").write_text("def run_step(context):\n    context['preloaded'] = True\n")
+    (directory / "nested").mkdir()
+    (directory / "nested" / "custom.yaml").write_text(
+        "pipeline:\n  description: uses a step from the pipeline directory\n"
+        "steps:\n  - preloadstep\n  - name: pypyr.steps.echo\n    in:\n      echoMe: done\n"
+        "on_failure:\n  - name: does.not.exist\n"
+    )
+    (directory / "broken.yaml").write_text("steps: [\n")
+
+
+class TestStepNames:
+    def test_groups_and_parser(self):
+        definition = {
+            "context_parser": "pypyr.parser.keyvaluepairs",
+            "pipeline": {"description": "metadata"},
+            "steps": ["pypyr.steps.echo", {"name": "pypyr.steps.py", "in": {}}],
+            "cleanup": [{"name": "pypyr.steps.echo"}],
+        }
+        assert step_names(definition) == ["pypyr.parser.keyvaluepairs", "pypyr.steps.echo", "pypyr.steps.py"]
+
+
+class TestPreload:
+    def test_preload(self, tmp_path, preload_modules):
+        write_step_pipeline(tmp_path)
+        assert pipeline_names(tmp_path) == ["broken", "nested/custom"]
+        assert "preloadstep" not in sys.modules
+
+        result = preload_pipelines(tmp_path)
+        # the step from the pipeline directory was imported, broken pipelines and steps are skipped
+        assert "preloadstep" in sys.modules
+        assert result["pipelines"] == 1
+        assert result["modules"] == 2
+        assert len(result["errors"]) == 2
+        assert "preloadstep" in preload_modules
+
+    def test_service(self, scheduler_service, test_config, preload_modules):
+        test_config.pypyr["pipelines.base_path"] = "tests/testdata"
+        result = scheduler_service.preload_pipelines(["helloworld", "sleep"])
+        assert result["pipelines"] == 2
+        assert result["modules"] == 2  # echo and py
+        assert result["errors"] == []
+
+
+class TestStartup:
+    def test_cli_imports_lazily(self):
+        code = "import sys, pyrsched.server.cli; print(sorted(m for m in ('apscheduler', 'pypyr') if m in sys.modules))"
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        assert output.strip() == "[]"
+
+    def test_server_imports_optional_subsystems_lazily(self):
+        optional = (
+            "pyrsched.server.cluster", "pyrsched.server.remote", "pyrsched.server.wire", "pyrsched.server.exposition",
+            "psutil",
+        )
+        code = f"import sys, pyrsched.server.server; print(sorted(m for m in {optional} if m in sys.modules))"
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        assert output.strip() == "[]"
+
+    def test_startup_benchmark(self):
+        timings = {"cold": [], "preload": []}
+        step_modules = {}
+        for _ in range(3):
+            for mode in timings:
+                output = subprocess.run(
+                    [sys.executable, "-c", STARTUP_BENCHMARK, mode], capture_output=True, text=True, check=True
+                ).stdout.split()
+                timings[mode].append([float(t) for t in output[:2]])
+                step_modules[mode] = output[2:]
+        # the fastest of three interpreters, the first run happens only once in each
+        imported = min(t[0] for t in timings["cold"])
+        cold, preloaded = (min(t[1] for t in timings[mode]) for mode in ("cold", "preload"))
+        print(f"\nimport: {imported:.3f}s, first run: {cold:.4f}s cold, {preloaded:.4f}s preloaded")
+
+        # the timings are for reading only, what makes the preloaded run faster is that its steps are imported
+        assert step_modules["cold"] == ["pypyr.steps.echo"]
+        assert step_modules["preload"] == []
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+from apscheduler.schedulers.background import BackgroundScheduler
+from conftest import wait_for
+
+from pyrsched.server.priority import PriorityThreadPool
+
+_started = []
+_gate = threading.Event()
+
+
+def blocking_run(name, priority=0):
+    _started.append(name)
+    _gate.wait(timeout=10)
+
+
+@pytest.fixture(scope="function")
+def priority_scheduler():
+    del _started[:]
+    _gate.clear()
+    scheduler = BackgroundScheduler({
+        "apscheduler.executors.default": {
+            "class": "pyrsched.server.executors:PriorityThreadPoolExecutor", "max_workers": "1",
+        },
+    })
+    scheduler.start()
+    yield scheduler
+    _gate.set()
+    scheduler.shutdown()
+
+
+class TestPriorityThreadPool:
+    def test_priority_order(self):
+        pool = PriorityThreadPool(1, aging=None)
+        gate, started = threading.Event(), threading.Event()
+        order = []
+        pool.submit(lambda: (started.set(), gate.wait()))
+        started.wait(timeout=10)
+        futures = [pool.submit_prioritized(priority, order.append, name) for priority, name in [
+            (0, "bulk_1"), (5, "urgent"), (0, "bulk_2"), (1, "normal"),
+        ]]
+        assert pool.queue_depth == 4
+        gate.set()
+        for future in futures:
+            future.result(timeout=10)
+        # same priority keeps the submission order
+        assert order == ["urgent", "normal", "bulk_1", "bulk_2"]
+        pool.shutdown()
+
+    def test_aging(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr("pyrsched.server.priority.time.monotonic", lambda: now[0])
+        pool = PriorityThreadPool(1, aging=10)
+        # a run which waited 30 seconds with priority 0 goes before a new one with priority 2
+        old = pool._sort_key(0)
+        now[0] += 30
+        assert old < pool._sort_key(2)
+        assert old > pool._sort_key(4)
+
+    def test_exception_and_shutdown(self):
+        pool = PriorityThreadPool(2)
+        future = pool.submit(lambda: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            future.result(timeout=10)
+        pool.shutdown()
+        with pytest.raises(RuntimeError):
+            pool.submit(print)
+        assert all(not thread.is_alive() for thread in pool._threads)
+
+
+class TestPriorityExecutor:
+    def test_urgent_job_overtakes(self, priority_scheduler):
+        priority_scheduler.add_job(blocking_run, args=["first"])
+        wait_for(lambda: _started == ["first"])
+
+        priority_scheduler.add_job(blocking_run, args=["bulk"], kwargs={"priority": -1})
+        priority_scheduler.add_job(blocking_run, args=["urgent"], kwargs={"priority": 10})
+        executor = priority_scheduler._lookup_executor("default")
+        wait_for(lambda: executor.queue_depth() == 2)
+
+        _gate.set()
+        wait_for(lambda: len(_started) == 3)
+        assert _started == ["first", "urgent", "bulk"]
+
+
+class TestServicePriority:
+    def test_marshalled_priority(self, scheduler_service):
+        job_id = scheduler_service.add_job("testpipeline", priority=3)
+        assert scheduler_service.get_job(job_id)["priority"] == 3
+        results = scheduler_service.add_jobs([{"pipeline_name": "testpipeline"}])
+        assert scheduler_service.get_job(results[0]["result"])["priority"] == 0
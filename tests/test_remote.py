@@ -0,0 +1,120 @@
+import copy
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+from apscheduler.schedulers.background import BackgroundScheduler
+from conftest import add_and_run, wait_for
+
+from pyrsched.server.rpc import AsyncRPCServer
+from pyrsched.server.service import SchedulerService
+from pyrsched.server.worker import WorkerAgent, connect
+
+AUTHKEY = b"not-so-secret"
+
+
+@pytest.fixture(scope="function")
+def remote_service(test_config, tmp_path):
+    config = copy.deepcopy(test_config)
+    config.apscheduler["apscheduler.executors.remote"] = {
+        "class": "pyrsched.server.remote:RemoteWorkerExecutor",
+        "lease_seconds": "60",
+    }
+    config.pypyr["pipelines.base_path"] = "tests/testdata"
+    config.pypyr["pipelines.log_path"] = str(tmp_path)
+    config.pypyr["pipelines.sensitive_keywords"] = ["sensitive_value"]
+    scheduler = BackgroundScheduler(copy.deepcopy(config.apscheduler))
+    service = SchedulerService(scheduler=scheduler, config=config, logger=None)
+    scheduler.start()
+    yield service
+    scheduler.shutdown(wait=False)
+
+
+class _InlinePool:
+    """ runs submitted calls right away """
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class TestRemoteExecutor:
+    def test_pull_and_report(self, remote_service):
+        job_id = add_and_run(remote_service, "helloworld", execution_mode="remote")
+        runs = remote_service.pull_runs("worker_1", max_runs=5, timeout=10)
+        assert [(run["job_id"], run["args"]) for run in runs] == [(job_id, ["helloworld"])]
+        assert remote_service.state()["remote_workers"]["remote"]["leased"] == 1
+        # nothing else is due
+        assert remote_service.pull_runs("worker_1", max_runs=5, timeout=0) == []
+
+        report = {"run_id": runs[0]["run_id"], "error": None, "started": 1000.0, "duration": 0.5}
+        remote_service.report_runs("worker_1", [report])
+        wait_for(lambda: remote_service.get_run_stats(job_id)["runs"] == 1)
+        assert remote_service.get_run_stats(job_id)["failures"] == 0
+        # timed on the worker
+        assert remote_service.get_run_stats(job_id, include_runs=True)["run_history"] == [
+            {"started": 1000.0, "duration": 0.5, "success": True}
+        ]
+        assert remote_service.state()["remote_workers"]["remote"]["leased"] == 0
+
+    def test_lost_worker(self, remote_service):
+        job_id = add_and_run(remote_service, "helloworld", execution_mode="remote")
+        executor = remote_service._scheduler._lookup_executor("remote")
+        executor.lease_seconds = 0.1
+        assert len(remote_service.pull_runs("worker_1", timeout=10)) == 1
+
+        time.sleep(0.2)
+        executor.expire_leases()
+        stats = remote_service.get_run_stats(job_id)
+        assert stats["failures"] == 1
+        assert "was lost" in stats["last_error"]
+        # a late report of the lost run is ignored
+        remote_service.report_runs("worker_1", [{"run_id": "remote-1", "error": None}])
+
+    def test_not_configured(self, scheduler_service):
+        with pytest.raises(ValueError):
+            scheduler_service.pull_runs("worker_1")
+
+
+class TestWorkerAgent:
+    def test_run_over_rpc(self, remote_service, tmp_path):
+        server = AsyncRPCServer(remote_service, "scheduler", ("127.0.0.1", 0), AUTHKEY)
+        ready = threading.Event()
+        server_thread = threading.Thread(target=server.serve_forever, args=(ready, ), daemon=True)
+        server_thread.start()
+        assert ready.wait(timeout=10)
+
+        worker_logs = tmp_path / "worker"
+        worker_logs.mkdir()
+        agent = WorkerAgent(connect(server.address, AUTHKEY), worker_id="worker_1", workers=2,
+                            poll_timeout=0.2, heartbeat_interval=0.2, log_path=worker_logs)
+        agent_thread = threading.Thread(target=agent.run_forever, daemon=True)
+        agent_thread.start()
+        try:
+            job_ids = [add_and_run(remote_service, "testlogcensor", execution_mode="remote"), add_and_run(remote_service, "helloworld", execution_mode="remote")]
+            wait_for(lambda: all(remote_service.get_run_stats(job_id)["runs"] == 1 for job_id in job_ids))
+            assert all(remote_service.get_run_stats(job_id)["failures"] == 0 for job_id in job_ids)
+
+            # the worker wrote the logs and masked the sensitive values
+            log = (worker_logs / "testlogcensor.log").read_text()
+            assert "'sensitive_value': '*****'" in log
+            assert "classified" not in log
+            assert "Hello World!" in (worker_logs / "helloworld.log").read_text()
+        finally:
+            agent.stop()
+            agent_thread.join(timeout=10)
+            server.shutdown()
+            server_thread.join(timeout=10)
+
+    def test_failed_run(self, remote_service):
+        job_id = add_and_run(remote_service, "does_not_exist", execution_mode="remote")
+        agent = WorkerAgent(remote_service, worker_id="worker_1", poll_timeout=0.2, heartbeat_interval=0.2,
+                            logger=logging.getLogger("test_worker"))
+        assert agent.run_once(_InlinePool(), 10) == 1
+        # the result is reported with the next call
+        agent.run_once(_InlinePool(), 0)
+        wait_for(lambda: remote_service.get_run_stats(job_id)["runs"] == 1)
+        assert remote_service.get_run_stats(job_id)["failures"] == 1
+
@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.managers import BaseManager, RemoteError
+
+import pytest
+
+AUTHKEY = b"not-so-secret"
+
+
+@pytest.fixture(scope="function")
+def rpc_server(scheduler_service):
+    from pyrsched.server.rpc import AsyncRPCServer
+
+    server = AsyncRPCServer(scheduler_service, "scheduler", ("127.0.0.1", 0), AUTHKEY, workers=2)
+    ready = threading.Event()
+    thread = threading.Thread(target=server.serve_forever, args=(ready, ), daemon=True)
+    thread.start()
+    assert ready.wait(timeout=10)
+    yield server
+    server.shutdown()
+    thread.join(timeout=10)
+
+
+def connect(server, authkey=AUTHKEY):
+    """ connect like the rpc client does, with a plain BaseManager """
+    class SchedulerManager(BaseManager):
+        pass
+
+    SchedulerManager.register("scheduler")
+    manager = SchedulerManager(address=server.address, authkey=authkey)
+    manager.connect()
+    return manager.scheduler()
+
+
+class TestAsyncRPCServer:
+    def test_method_calls(self, rpc_server):
+        scheduler = connect(rpc_server)
+
+        job_id = scheduler.add_job("testpipeline", 30)
+        assert scheduler.get_job(job_id)["id"] == job_id
+        assert [job["id"] for job in scheduler.list_jobs()] == [job_id]
+        assert scheduler.state()["total_jobs"] == 1
+
+    def test_remote_exception(self, rpc_server):
+        scheduler = connect(rpc_server)
+
+        # exceptions of the service are raised in the client
+        with pytest.raises(ValueError):
+            scheduler.add_job("testpipeline", 30, "gpu")
+
+    def test_not_exposed(self, rpc_server):
+        scheduler = connect(rpc_server)
+
+        # like with BaseManager, the traceback of the server is sent to the client
+        with pytest.raises(RemoteError, match="not in exposed"):
+            scheduler._callmethod("_marshal_job", (None, ))
+
+    def test_wrong_authkey(self, rpc_server):
+        with pytest.raises(AuthenticationError):
+            connect(rpc_server, authkey=b"wrong")
+
+    def test_many_clients(self, rpc_server):
+        def poll(_):
+            scheduler = connect(rpc_server)
+            return [scheduler.state()["run_state"] for _ in range(5)]
+
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            results = list(executor.map(poll, range(40)))
+
+        assert results == [[0] * 5] * 40
+
+    def test_long_polls_do_not_block_calls(self, rpc_server):
+        version = connect(rpc_server).state()["version"]
+
+        def long_poll(_):
+            return connect(rpc_server).get_changes(version, 5)
+
+        # more long-polling clients than the server has worker threads
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            polls = [executor.submit(long_poll, i) for i in range(4)]
+            time.sleep(0.5)
+            assert not any(poll.done() for poll in polls)
+
+            scheduler = connect(rpc_server)
+            started = time.monotonic()
+            job_id = scheduler.add_job("testpipeline", 30)
+            assert [job["id"] for job in scheduler.list_jobs()] == [job_id]
+            assert time.monotonic() - started < 2
+
+            # the change ends the long polls
+            for poll in polls:
+                assert poll.result(timeout=5)["changes"][0]["job_id"] == job_id
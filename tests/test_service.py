@@ -179,3 +179,243 @@ class TestRunPause:
 
         # the scheduler should do nothing and return None
         assert job is None
+
+
+class TestQueryJobs:
+    def test_filter_name(self, scheduler_service):
+        backup_id = scheduler_service.add_job("backup_db")
+        scheduler_service.add_job("report")
+
+        jobs = scheduler_service.list_jobs(name="backup_*")
+        assert [job["id"] for job in jobs] == [backup_id]
+
+    def test_filter_running(self, scheduler_service):
+        running_id = scheduler_service.add_job("testpipeline")
+        paused_id = scheduler_service.add_job("testpipeline")
+        scheduler_service.start_job(running_id)
+
+        assert [job["id"] for job in scheduler_service.list_jobs(running=True)] == [running_id]
+        assert [job["id"] for job in scheduler_service.list_jobs(running=False)] == [paused_id]
+
+    def test_filter_next_run_window(self, scheduler_service):
+        from datetime import datetime, timedelta, timezone
+
+        soon_id = scheduler_service.add_job("testpipeline", interval=10)
+        later_id = scheduler_service.add_job("testpipeline", interval=3600)
+        scheduler_service.start_job(soon_id)
+        scheduler_service.start_job(later_id)
+
+        # paused jobs have no next run time and never match a window
+        scheduler_service.add_job("testpipeline")
+
+        now = datetime.now(timezone.utc)
+        jobs = scheduler_service.list_jobs(next_run_from=now, next_run_until=now + timedelta(minutes=1))
+        assert [job["id"] for job in jobs] == [soon_id]
+
+        # ISO strings work as well
+        jobs = scheduler_service.list_jobs(next_run_from=(now + timedelta(minutes=1)).isoformat())
+        assert [job["id"] for job in jobs] == [later_id]
+
+    def test_fields(self, scheduler_service):
+        scheduler_service.add_job("testpipeline")
+
+        job = scheduler_service.list_jobs(fields=["name", "next_run_time"])[0]
+        assert set(job) == {"id", "name", "next_run_time"}
+
+    def test_pagination(self, scheduler_service):
+        job_ids = [scheduler_service.add_job("testpipeline") for _ in range(5)]
+
+        page = scheduler_service.query_jobs(limit=2)
+        assert page["total"] == 5
+        seen = [job["id"] for job in page["jobs"]]
+        while page["next_cursor"]:
+            page = scheduler_service.query_jobs(cursor=page["next_cursor"], limit=2)
+            seen += [job["id"] for job in page["jobs"]]
+
+        # every job is returned exactly once, in job store order
+        assert seen == job_ids
+
+    def test_invalid_cursor(self, scheduler_service):
+        with pytest.raises(ValueError):
+            scheduler_service.query_jobs(cursor="gibberish")
+
+
+class TestChanges:
+    def test_changes_since_state(self, scheduler_service):
+        version = scheduler_service.state()["version"]
+
+        job_id = scheduler_service.add_job("testpipeline")
+        scheduler_service.start_job(job_id)
+        scheduler_service.remove_job(job_id)
+
+        result = scheduler_service.get_changes(since=version)
+        assert not result["reset"]
+        assert [c["type"] for c in result["changes"]] == ["added", "modified", "removed"]
+        assert all(c["job_id"] == job_id for c in result["changes"])
+        assert result["version"] == result["changes"][-1]["version"]
+
+        # nothing new since the last version
+        assert scheduler_service.get_changes(since=result["version"])["changes"] == []
+
+    def test_changes_contain_job(self, scheduler_service):
+        job_id = scheduler_service.add_job("testpipeline")
+        change = scheduler_service.get_changes()["changes"][0]
+        assert change["job"]["id"] == job_id
+
+    def test_long_poll(self, scheduler_service):
+        import threading
+
+        version = scheduler_service.state()["version"]
+        threading.Timer(0.2, scheduler_service.add_job, args=("testpipeline", )).start()
+
+        # the call returns as soon as the job was added, not after the timeout
+        result = scheduler_service.get_changes(since=version, timeout=30)
+        assert [c["type"] for c in result["changes"]] == ["added"]
+
+    def test_reset(self, test_config):
+        from apscheduler.schedulers.background import BackgroundScheduler
+        from pyrsched.server.service import SchedulerService
+
+        test_config.pypyr["changes.buffer_size"] = 2
+        service = SchedulerService(scheduler=BackgroundScheduler(test_config.apscheduler), config=test_config)
+        for _ in range(3):
+            service.add_job("testpipeline")
+
+        # the first change was dropped from the buffer
+        assert service.get_changes(since=0)["reset"]
+        assert not service.get_changes(since=1)["reset"]
+
+        # versions from a previous server process
+        assert service.get_changes(since=100)["reset"]
+
+    def test_run_events(self, scheduler_service):
+        scheduler_service._scheduler.start()
+        try:
+            job_id = scheduler_service.add_job("testpipeline", interval=1)
+            version = scheduler_service.get_changes()["version"]
+            scheduler_service.start_job(job_id)
+
+            changes = []
+            while not any(c["type"] == "run_finished" for c in changes):
+                result = scheduler_service.get_changes(since=version, timeout=10)
+                assert result["changes"], "no run within 10 seconds"
+                changes += result["changes"]
+                version = result["version"]
+        finally:
+            scheduler_service._scheduler.shutdown()
+
+        assert "run_started" in [c["type"] for c in changes]
+        finished = [c for c in changes if c["type"] == "run_finished"][0]
+
+        # there is no pipeline directory in the test setup, so the run fails
+        assert not finished["success"]
+        assert finished["error"]
+
+
+class TestRunStats:
+    def test_unknown_job(self, scheduler_service):
+        assert scheduler_service.get_run_stats("nonexistent") is None
+
+    def test_run_recorded(self, scheduler_service):
+        scheduler_service._scheduler.start()
+        try:
+            job_id = scheduler_service.add_job("testpipeline", interval=1)
+            version = scheduler_service.get_changes()["version"]
+            scheduler_service.start_job(job_id)
+            changes = []
+            while not any(c["type"] == "run_finished" for c in changes):
+                result = scheduler_service.get_changes(since=version, timeout=10)
+                assert result["changes"], "no run within 10 seconds"
+                changes += result["changes"]
+                version = result["version"]
+            stats = scheduler_service.get_run_stats(job_id, include_runs=True)
+        finally:
+            scheduler_service._scheduler.shutdown()
+
+        assert stats["name"] == "testpipeline"
+        assert stats["runs"] >= 1
+        assert stats["p50"] >= 0
+        # there is no pipeline directory in the test setup, so the run fails
+        assert stats["failure_rate"] > 0
+        assert stats["last_error"]
+        assert len(stats["run_history"]) == stats["runs"]
+
+
+class TestConcurrencyGroups:
+    def test_add_to_group(self, scheduler_service):
+        scheduler_service.set_concurrency_group("test_service_db", 3)
+        try:
+            job_id = scheduler_service.add_job("testpipeline", concurrency_group="test_service_db", weight=2)
+            kwargs = scheduler_service.get_job(job_id)["kwargs"]
+            assert (kwargs["concurrency_group"], kwargs["concurrency_weight"]) == ("test_service_db", 2)
+            assert scheduler_service.state()["concurrency_groups"]["test_service_db"]["capacity"] == 3
+
+            with pytest.raises(ValueError):
+                scheduler_service.add_job("testpipeline", concurrency_group="nonexistent")
+            with pytest.raises(ValueError):
+                scheduler_service.add_job("testpipeline", concurrency_group="test_service_db", weight=0)
+        finally:
+            scheduler_service.remove_concurrency_group("test_service_db")
+
+    def test_reschedule_group(self, scheduler_service):
+        scheduler_service.set_concurrency_group("test_service_db", 1)
+        try:
+            job_id = scheduler_service.add_job("testpipeline")
+            job = scheduler_service.reschedule_job(job_id, interval=30, concurrency_group="test_service_db")
+            assert job["kwargs"]["concurrency_group"] == "test_service_db"
+
+            # without a group argument the job stays in its group
+            job = scheduler_service.reschedule_job(job_id, interval=40)
+            assert job["kwargs"]["concurrency_group"] == "test_service_db"
+
+            job = scheduler_service.reschedule_job(job_id, interval=40, concurrency_group=None)
+            assert "concurrency_group" not in job["kwargs"]
+        finally:
+            scheduler_service.remove_concurrency_group("test_service_db")
+
+
+class TestBulk:
+    def test_add_jobs(self, scheduler_service):
+        results = scheduler_service.add_jobs([
+            {"pipeline_name": "first"},
+            {"pipeline_name": "second", "interval": 10},
+            {"pipeline_name": "third", "execution_mode": "gpu"},
+        ])
+
+        assert [r["error"] is None for r in results] == [True, True, False]
+        jobs = scheduler_service.list_jobs()
+        assert [job["id"] for job in jobs] == [r["result"] for r in results[:2]]
+        assert jobs[1]["trigger"]["interval"] == pytest.approx(10.0)
+
+    def test_start_pause_remove(self, scheduler_service):
+        job_ids = [r["result"] for r in scheduler_service.add_jobs([{"pipeline_name": "testpipeline"}] * 3)]
+
+        results = scheduler_service.start_jobs(job_ids + ["not-a-job-id"])
+        assert all(r["result"]["next_run_time"] is not None for r in results[:3])
+        assert results[3] == {"result": None, "error": "job not found"}
+
+        results = scheduler_service.pause_jobs(job_ids[:2])
+        assert all(r["result"]["next_run_time"] is None for r in results)
+
+        scheduler_service.remove_jobs(job_ids)
+        assert scheduler_service.list_jobs() == []
+
+    def test_reschedule_jobs(self, scheduler_service):
+        job_ids = [r["result"] for r in scheduler_service.add_jobs([{"pipeline_name": "testpipeline"}] * 2)]
+
+        results = scheduler_service.reschedule_jobs([{"job_id": job_id, "interval": 30} for job_id in job_ids])
+        assert all(r["result"]["trigger"]["interval"] == pytest.approx(30.0) for r in results)
+
+    def test_single_wakeup(self, scheduler_service):
+        scheduler = scheduler_service._scheduler
+        scheduler.start()
+        wakeups = []
+        original_wakeup = scheduler.wakeup
+        scheduler.wakeup = lambda: wakeups.append(1) or original_wakeup()
+        try:
+            scheduler_service.add_jobs([{"pipeline_name": "testpipeline"}] * 20)
+        finally:
+            scheduler.shutdown()
+
+        # the scheduler is woken up once after the batch, not once per job
+        assert len(wakeups) == 1
@@ -0,0 +1,80 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from pyrsched.server.spreading import _spread_order, aligned_start, spread_offsets
+
+
+class TestSpreadOffsets:
+    def test_spread_order(self):
+        assert list(_spread_order(8)) == [0, 4, 2, 6, 1, 5, 3, 7]
+        assert sorted(_spread_order(60)) == list(range(60))
+
+    def test_even_fill(self):
+        offsets = spread_offsets(60, [], 120)
+        # every second of the interval is used exactly twice
+        assert sorted(offsets) == sorted(list(range(60)) * 2)
+        # a partly filled interval is spread as well
+        assert spread_offsets(60, [], 2) == [0, 32]
+
+    def test_existing_phases(self):
+        # the slots of the existing jobs are used last
+        offsets = spread_offsets(4, [0, 1, 2], 2)
+        assert offsets == [3, 0]
+
+    def test_long_interval(self):
+        offsets = spread_offsets(86400, [], 3)
+        # 3600 slots of 24 seconds, spread like the numbers up to 4096
+        assert offsets == [0, 2048 * 24, 1024 * 24]
+
+    def test_aligned_start(self):
+        now = datetime(2030, 1, 1, 12, 0, 30, tzinfo=timezone.utc)
+        start = aligned_start(10, 60, now)
+        assert start == datetime(2030, 1, 1, 12, 0, 10, tzinfo=timezone.utc)
+        assert aligned_start(40, 60, now) == datetime(2030, 1, 1, 11, 59, 40, tzinfo=timezone.utc)
+
+
+class TestServiceSpreading:
+    def test_flat_histogram(self, scheduler_service):
+        results = scheduler_service.add_jobs([{"pipeline_name": f"pipeline_{i}", "interval": 60} for i in range(120)])
+        scheduler_service.start_jobs([r["result"] for r in results])
+
+        counts = scheduler_service.fire_histogram(60)["counts"]
+        # the jobs of the current second may already be past it and run again in 60 seconds
+        assert sum(counts) >= 118
+        assert max(counts) == 2
+
+    def test_single_adds_are_spread(self, scheduler_service):
+        job_ids = [scheduler_service.add_job(f"pipeline_{i}", interval=10) for i in range(10)]
+        scheduler_service.start_jobs(job_ids)
+        counts = scheduler_service.fire_histogram(10)["counts"]
+        assert max(counts) == 1
+
+    def test_concurrent_adds_are_spread(self, scheduler_service):
+        barrier = threading.Barrier(10)
+
+        def add(i):
+            barrier.wait()
+            return scheduler_service.add_job(f"pipeline_{i}", interval=10)
+
+        with ThreadPoolExecutor(10) as pool:
+            job_ids = list(pool.map(add, range(10)))
+        scheduler_service.start_jobs(job_ids)
+        counts = scheduler_service.fire_histogram(10)["counts"]
+        assert max(counts) == 1
+
+    def test_spreading_off(self, scheduler_service):
+        scheduler_service._config.pypyr["triggers.spread_intervals"] = False
+        results = scheduler_service.add_jobs([{"pipeline_name": f"pipeline_{i}", "interval": 60} for i in range(20)])
+        scheduler_service.start_jobs([r["result"] for r in results])
+        # all jobs were created at the same time and run in the same second (or two, at a second boundary)
+        counts = scheduler_service.fire_histogram(62)["counts"]
+        assert max(counts) >= 10
+
+    def test_jitter(self, scheduler_service):
+        job_id = scheduler_service.add_job("testpipeline", interval=60, jitter=5)
+        assert scheduler_service.get_job(job_id)["trigger"]["jitter"] == 5
+
+        scheduler_service._config.pypyr["triggers.jitter"] = 2
+        job_id = scheduler_service.add_job("testpipeline", cron="* * * * *")
+        assert scheduler_service.get_job(job_id)["trigger"]["jitter"] == 2
@@ -0,0 +1,49 @@
+import psutil
+import pytest
+from conftest import add_and_run, wait_for
+
+from pyrsched.server.timeouts import killable_runs
+
+
+def sleeping_commands():
+    return [p for p in psutil.process_iter(["cmdline"]) if p.info["cmdline"] == ["sleep", "123"]]
+
+
+class TestTimeouts:
+    def test_timeout_frees_the_worker(self, running_service):
+        # the executor of the test config has a single thread
+        hanging = add_and_run(running_service, "hang", timeout=2)
+        wait_for(lambda: len(sleeping_commands()) == 1)
+        waiting = add_and_run(running_service, "helloworld")
+
+        wait_for(lambda: running_service.get_run_stats(waiting)["runs"] == 1)
+        stats = running_service.get_run_stats(hanging)
+        assert stats["failures"] == 1
+        assert "PipelineTimeout" in stats["last_error"]
+        assert running_service.state()["timeouts"] == {"running": 0, "timed_out": 1, "cancelled": 0}
+        # the command the pipeline started was killed as well
+        wait_for(lambda: sleeping_commands() == [])
+
+    def test_cancel_run(self, running_service):
+        job_id = add_and_run(running_service, "hang", timeout=60)
+        wait_for(lambda: killable_runs.running == 1)
+        assert running_service.cancel_run(job_id) == 1
+
+        wait_for(lambda: running_service.get_run_stats(job_id)["runs"] == 1)
+        assert "RunCancelled" in running_service.get_run_stats(job_id)["last_error"]
+        assert running_service.state()["timeouts"]["cancelled"] == 1
+        assert running_service.cancel_run(job_id) == 0
+
+    def test_results_of_the_child_process(self, running_service, tmp_path):
+        succeeding = add_and_run(running_service, "helloworld", timeout=30)
+        failing = add_and_run(running_service, "does_not_exist", timeout=30)
+        wait_for(lambda: all(running_service.get_run_stats(job_id)["runs"] == 1 for job_id in (succeeding, failing)))
+
+        assert running_service.get_run_stats(succeeding)["failures"] == 0
+        assert "Hello World!" in (tmp_path / "helloworld.log").read_text()
+        # the exception of the pipeline is passed back from the child process
+        assert "PipelineNotFoundError" in running_service.get_run_stats(failing)["last_error"]
+
+    def test_invalid_timeout(self, scheduler_service):
+        with pytest.raises(ValueError):
+            scheduler_service.add_job("helloworld", timeout=0)
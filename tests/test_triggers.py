@@ -0,0 +1,107 @@
+import pickle
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+from pyrsched.server.triggers import NEVER, DependencyTrigger, make_trigger, marshal_trigger, next_fire_times
+
+
+class TestMakeTrigger:
+    def test_interval(self):
+        trigger = make_trigger(interval=30)
+        assert isinstance(trigger, IntervalTrigger)
+        assert marshal_trigger(trigger)["interval"] == 30
+
+    def test_cron(self):
+        trigger = make_trigger(cron="30 3 * * mon-fri", timezone=timezone.utc)
+        assert isinstance(trigger, CronTrigger)
+        fields = marshal_trigger(trigger)["fields"]
+        assert (fields["hour"], fields["minute"], fields["day_of_week"]) == ("3", "30", "mon-fri")
+
+        trigger = make_trigger(cron={"hour": "*/2"}, timezone=timezone.utc)
+        assert marshal_trigger(trigger)["fields"]["hour"] == "*/2"
+
+    def test_date(self):
+        trigger = make_trigger(run_date="2030-01-01T12:00:00+00:00", timezone=timezone.utc)
+        assert isinstance(trigger, DateTrigger)
+        assert marshal_trigger(trigger) == {"type": "date", "run_date": "2030-01-01T12:00:00+00:00", "timezone": "UTC"}
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            make_trigger(cron="* * * * *", run_date="2030-01-01T12:00:00")
+        with pytest.raises(ValueError):
+            make_trigger(cron="not a crontab")
+
+
+class TestNextFireTimes:
+    def test_count(self):
+        start = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        times = next_fire_times(make_trigger(cron="0 * * * *", timezone=timezone.utc), start, count=3)
+        assert times == (start, start + timedelta(hours=1), start + timedelta(hours=2))
+
+    def test_until(self):
+        start = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        trigger = make_trigger(cron="*/10 * * * *", timezone=timezone.utc)
+        times = next_fire_times(trigger, start, until=start + timedelta(hours=1))
+        assert len(times) == 7
+
+    def test_ending_trigger(self):
+        run_date = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        assert next_fire_times(make_trigger(run_date=run_date), run_date) == (run_date, )
+        assert next_fire_times(make_trigger(interval=10), None) == ()
+
+    def test_dependency_trigger(self):
+        trigger = pickle.loads(pickle.dumps(DependencyTrigger(["a", "b"])))
+        assert trigger.upstream == ("a", "b")
+        # it never fires by time
+        assert trigger.get_next_fire_time(None, datetime.now(timezone.utc)) == NEVER
+        assert next_fire_times(trigger, NEVER) == ()
+
+
+class TestServiceTriggers:
+    def test_cron_job(self, scheduler_service):
+        job_id = scheduler_service.add_job("testpipeline", cron="*/15 * * * *")
+        job = scheduler_service.start_job(job_id)
+        assert job["trigger"]["type"] == "cron"
+        assert len(job["next_run_times"]) == 10
+        assert job["next_run_times"][0] == job["next_run_time"]
+
+    def test_reschedule_to_date(self, scheduler_service):
+        job_id = scheduler_service.add_job("testpipeline", interval=10)
+        job = scheduler_service.reschedule_job(job_id, run_date="2030-01-01T12:00:00+00:00")
+        assert job["trigger"]["type"] == "date"
+        assert job["next_run_times"] == [job["next_run_time"]]
+
+    def test_upcoming_runs(self, scheduler_service):
+        every_minute = scheduler_service.add_job("every_minute", cron="* * * * *")
+        hourly = scheduler_service.add_job("hourly", cron="0 * * * *")
+        paused = scheduler_service.add_job("paused", interval=60)
+        scheduler_service.start_jobs([every_minute, hourly])
+
+        runs = scheduler_service.upcoming_runs(within=3600)
+        names = [run["name"] for run in runs]
+        # the table of the every minute job (10 fire times) is extended to the whole hour
+        assert names.count("every_minute") >= 59
+        assert names.count("hourly") == 1
+        assert "paused" not in names
+        assert [run["run_time"] for run in runs] == sorted(run["run_time"] for run in runs)
+
+        assert {run["name"] for run in scheduler_service.upcoming_runs(within=3600, name="hour*")} == {"hourly"}
+        assert len(scheduler_service.upcoming_runs(within=3600, limit=5)) == 5
+
+    def test_upcoming_benchmark(self, scheduler_service):
+        count = 2000
+        results = scheduler_service.add_jobs([{"pipeline_name": f"pipeline_{i}", "cron": "0 */2 * * *"} for i in range(count)])
+        scheduler_service.start_jobs([r["result"] for r in results])
+        scheduler_service.list_jobs()  # marshals all jobs and computes their fire times once
+
+        start = time.perf_counter()
+        runs = scheduler_service.upcoming_runs(within=2 * 3600, limit=count * 10)
+        elapsed = time.perf_counter() - start
+        print(f"\nupcoming_runs over {count} jobs: {elapsed * 1000:.1f}ms")
+        assert len(runs) == count
+        assert elapsed < 5
@@ -0,0 +1,96 @@
+import pickle
+import time
+
+import pytest
+
+from pyrsched.server.wire import WireFormatError, decode, encode
+
+
+class TestEncoding:
+    def test_round_trip(self):
+        value = {
+            "none": None,
+            "flags": [True, False],
+            "numbers": [0, 1, -1, 127, 128, -300, 2 ** 70, 0.5, -1e-9, 60.0, -0.0, 1e300],
+            "ids": ["7d18d384-8a21-457e-a958-6c05a1608ee7", "7D18D384-8A21-457E-A958-6C05A1608EE7"],
+            "tuple": (1.5, 2.5, 3.5),
+            "text": ["", "ünïcode ✓", "text"],
+            "bytes": b"\x00\xff",
+            "timestamps": ["2026-10-18T11:31:32+02:00", "2026-10-18T09:31:32.123456+00:00", "1969-12-31T23:59:59-05:30"],
+            # not ISO strings which decode to the same text, they are sent as strings
+            "almost_timestamps": ["2026-10-18T11:31:32.5+02:00", "2026-10-18T11:31:32", "2026-10-18 11:31:32+02:00"],
+            7: {"nested": {"kwargs": {"log_path": "logs", "priority": 3}}},
+        }
+        decoded = decode(encode(value))
+        assert decoded == value
+        assert type(decoded["tuple"]) is tuple
+        assert str(decoded["numbers"][-2]) == "-0.0"
+
+    def test_timestamps_in_templates(self):
+        value = [
+            {"run_time": "2026-10-18T11:31:32+02:00", "kwargs": {"log_path": "2026-10-18T11:00:00+00:00"}},
+            {"run_time": "2026-10-18T11:32:32+02:00", "kwargs": {"log_path": "2026-10-18T11:00:00+00:00"}},
+        ]
+        assert decode(encode(value)) == value
+
+    def test_strings_are_sent_once(self):
+        encoded = encode([{"name": "a_long_pipeline_name"}] * 50)
+        assert encoded.count(b"a_long_pipeline_name") == 1
+        assert encoded.count(b"name") == 2
+
+    def test_shared_kwargs_are_sent_once(self):
+        kwargs = {"log_path": "/var/log/pipelines", "log_format": "%(message)s", "sensitive_keys": ["db_passwd"]}
+        jobs = [{"kwargs": dict(kwargs, priority=i)} for i in range(20)]
+        jobs.append({"kwargs": dict(kwargs, log_path="/elsewhere")})
+
+        encoded = encode(jobs)
+        assert encoded.count(b"%(message)s") == 1
+        assert decode(encoded) == jobs
+
+    def test_errors(self):
+        with pytest.raises(ValueError):
+            encode({}, version=99)
+        with pytest.raises(TypeError):
+            encode({"value": object()})
+        with pytest.raises(WireFormatError):
+            decode(pickle.dumps({}))
+        with pytest.raises(WireFormatError):
+            decode(encode({"key": "value"})[:-1])
+        # a newer version than this client knows
+        encoded = bytearray(encode({}))
+        encoded[2] = 2
+        with pytest.raises(WireFormatError):
+            decode(bytes(encoded))
+
+
+class TestService:
+    def test_encoded_job_list(self, scheduler_service):
+        scheduler_service._scheduler.start(paused=True)
+        for i in range(500):
+            scheduler_service.add_job(f"pipeline_{i % 10}", interval=60 + i, priority=i % 3)
+        scheduler_service.start_jobs([job["id"] for job in scheduler_service.list_jobs()[::2]])
+        assert scheduler_service.wire_formats() == [1]
+
+        jobs = scheduler_service.list_jobs()
+        start = time.perf_counter()
+        pickled = pickle.loads(pickle.dumps(jobs))
+        pickle_time = time.perf_counter() - start
+        start = time.perf_counter()
+        encoded = scheduler_service.call_encoded("list_jobs", 1)
+        decoded = decode(encoded)
+        wire_time = time.perf_counter() - start
+
+        assert decoded == pickled == jobs
+        print(f"\n500 jobs: pickled {len(pickle.dumps(jobs))} bytes in {pickle_time:.3f}s, "
+              f"encoded {len(encoded)} bytes in {wire_time:.3f}s")
+        assert len(encoded) < len(pickle.dumps(jobs)) / 3
+
+        state = decode(scheduler_service.call_encoded("state", 1))
+        assert state["job_list"] == jobs
+        assert decode(scheduler_service.call_encoded("query_jobs", 1, limit=10))["total"] == 500
+
+    def test_negotiation(self, scheduler_service):
+        with pytest.raises(ValueError):
+            scheduler_service.call_encoded("list_jobs", 2)
+        with pytest.raises(ValueError):
+            scheduler_service.call_encoded("remove_job", 1, "job_id")